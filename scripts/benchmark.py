@@ -0,0 +1,290 @@
+"""
+マージンコール処理のマイクロベンチマーク
+ローカルの再現可能な価格データ（LocalPriceData.synthetic）を用いるため、ネットワークアクセスは行わない
+
+usage:
+    python -m scripts.benchmark
+    python -m scripts.benchmark --sizes 1 5 --horizons 20 250 --save bench_baseline.json
+    python -m scripts.benchmark --compare bench_baseline.json
+    python -m scripts.benchmark --price-band --sizes 5 --horizons 3652 --no-import-time
+"""
+import argparse
+import contextlib
+from datetime import date, timedelta
+import gc
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Optional, Tuple
+
+from . import utils
+from .exec_simulator import ExecuteAutoAdjustmentTransactionSingle, ExecuteAutoAdjustmentTransactionMulti, ExecuteAutoAdjustmentTransactionDynamicMulti
+from .price_data.local_price import LocalPriceData
+from .types import PortfolioItem, PortfolioWithPriorityItem, TransactionOption
+
+START_DATE = date(2008, 9, 1)
+DEFAULT_SIZES = [1, 5, 25, 200]
+DEFAULT_HORIZONS = [20, 250, 2500]
+# 起動時間を計測するモジュール（シミュレーション本体は pandas, yfinance, matplotlib を読み込まずに import できること）
+IMPORT_MODULES = ['scripts.utils', 'scripts.exec_simulator', 'scripts.simulator', 'scripts.visualizer']
+IMPORT_REPEAT = 3
+# --price-band で用いる閾値（閾値内の日がバンドで省略される）
+PRICE_BAND_THRESHOLD = 0.1
+TRANSACTION_CLASSES = {
+    'Single': ExecuteAutoAdjustmentTransactionSingle,
+    'Multi': ExecuteAutoAdjustmentTransactionMulti,
+    'DynamicMulti': ExecuteAutoAdjustmentTransactionDynamicMulti,
+}
+
+
+def build_portfolios(size: int, price_data: LocalPriceData) -> Tuple[Dict[str, PortfolioWithPriorityItem], Dict[str, PortfolioItem]]:
+    """
+    size 銘柄ずつの担保（JCT）ポートフォリオと貸付（ST）ポートフォリオを作成する
+    担保は各銘柄とも貸付総額の3倍の価値を持たせ、初期差し入れが不足しないようにする
+    """
+    st_portfolio: Dict[str, PortfolioItem] = {
+        f'{5000 + i}.T': {'num': 1000, 'price': 0, 'is_usd': False} for i in range(size)
+    }
+    st_total_value = sum(price_data.get_close_price(code, START_DATE) * item['num'] for code, item in st_portfolio.items())
+    jct_portfolio: Dict[str, PortfolioWithPriorityItem] = {}
+    for i in range(size):
+        code = f'{1000 + i}.T'
+        jct_portfolio[code] = {
+            'num': math.ceil(st_total_value * 3 / price_data.get_close_price(code, START_DATE)),
+            'price': 0,
+            'priority': size - i,
+            'is_usd': False
+        }
+    return jct_portfolio, st_portfolio
+
+
+def run_case(transaction_class, size: int, horizon: int, price_data: LocalPriceData, measure_memory: bool, options: Optional[TransactionOption] = None) -> dict:
+    jct_portfolio, st_portfolio = build_portfolios(size, price_data)
+    end_date = START_DATE + timedelta(horizon + 1)
+    dates = [START_DATE + timedelta(n + 1) for n in range(horizon)]
+
+    def run():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            started = time.perf_counter()
+            transaction = transaction_class(jct_portfolio, st_portfolio, START_DATE, end_date, dict(options or {}))
+            initialized = time.perf_counter()
+            for _date in dates:
+                transaction.check_diff_and_margin_call(_date)
+            finished = time.perf_counter()
+        return transaction, initialized - started, finished - initialized
+
+    gc.collect()
+    blocks_before = sys.getallocatedblocks()
+    transaction, init_seconds, step_seconds = run()
+    # ログ等として取引に保持されているメモリブロック数
+    retained_blocks = sys.getallocatedblocks() - blocks_before
+    del transaction
+
+    result = {
+        'class': transaction_class.__name__,
+        'size': size,
+        'horizon': horizon,
+        'options': dict(options or {}),
+        'init_seconds': init_seconds,
+        'step_seconds': step_seconds,
+        'steps_per_sec': horizon / step_seconds if step_seconds > 0 else math.inf,
+        'retained_blocks_per_step': retained_blocks / horizon,
+        'peak_memory_bytes': None,
+    }
+
+    if measure_memory:
+        # tracemalloc は処理を遅くするため、時間計測とは別に実行する
+        gc.collect()
+        tracemalloc.start()
+        run()
+        result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return result
+
+
+def run_price_band_case(transaction_class, size: int, horizon: int, price_data: LocalPriceData) -> dict:
+    """
+    execute() を price_band なし・ありで実行し、処理時間と評価を省略した日数を返す
+    返り値のログを全て参照する（省略した日を埋める）時間は fill_seconds として別に計測する
+    """
+    jct_portfolio, st_portfolio = build_portfolios(size, price_data)
+    end_date = START_DATE + timedelta(horizon + 1)
+    seconds = {}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for price_band in (False, True):
+            options: TransactionOption = {'margin_call_threshold': PRICE_BAND_THRESHOLD, 'price_band': price_band}  # type: ignore
+            transaction = transaction_class(jct_portfolio, st_portfolio, START_DATE, end_date, options)
+            started = time.perf_counter()
+            logs = transaction.execute()
+            seconds[price_band] = time.perf_counter() - started
+        started = time.perf_counter()
+        for key in ('collateral_sum', 'collateral_portfolio'):
+            list(logs[key])
+        fill_seconds = time.perf_counter() - started
+
+    return {
+        'class': transaction_class.__name__,
+        'size': size,
+        'horizon': horizon,
+        'options': {'margin_call_threshold': PRICE_BAND_THRESHOLD, 'price_band': True},
+        'steps_per_sec': horizon / seconds[True],
+        'execute_seconds': seconds[True],
+        'baseline_seconds': seconds[False],
+        'deferred_days': len(transaction.deferred_steps),
+        'fill_seconds': fill_seconds,
+    }
+
+
+def run_benchmark(sizes: List[int], horizons: List[int], classes: List[str], measure_memory: bool = True, seed: int = 0, options: Optional[TransactionOption] = None,
+                  price_band: bool = False) -> List[dict]:
+    codes = [f'{1000 + i}.T' for i in range(max(sizes))] + [f'{5000 + i}.T' for i in range(max(sizes))] + ['JPY=X']
+    price_data = LocalPriceData.synthetic(codes, START_DATE, max(horizons) + 2, seed=seed, volatility=0.01)
+    original_price_getter = utils.price_getter
+    utils.set_price_getter(price_data)
+
+    results = []
+    try:
+        for name in classes:
+            for size in sizes:
+                for horizon in horizons:
+                    if price_band:
+                        result = run_price_band_case(TRANSACTION_CLASSES[name], size, horizon, price_data)
+                        print_price_band_result(result)
+                    else:
+                        result = run_case(TRANSACTION_CLASSES[name], size, horizon, price_data, measure_memory, options)
+                        print_result(result)
+                    results.append(result)
+    finally:
+        utils.set_price_getter(original_price_getter)
+    return results
+
+
+def measure_import_time(module: str) -> dict:
+    """
+    新しいインタプリタで module を import し、-X importtime の累積時間と読み込まれた重いモジュールを返す
+    """
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    heavy_modules = ['pandas', 'yfinance', 'matplotlib']
+    import_seconds = math.inf
+    loaded_heavy_modules: List[str] = []
+    for _ in range(IMPORT_REPEAT):
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=repo_root, capture_output=True, text=True, check=True
+        )
+        # 各行は "import time: self [us] | cumulative | imported package" の形式
+        loaded = set()
+        for line in completed.stderr.splitlines():
+            if not line.startswith('import time:') or '|' not in line:
+                continue
+            _self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            name = name.strip()
+            loaded.add(name)
+            if name == module:
+                import_seconds = min(import_seconds, int(cumulative_us) / 1e6)
+        loaded_heavy_modules = [name for name in heavy_modules if name in loaded]
+    return {
+        'module': module,
+        'import_seconds': import_seconds,
+        'heavy_modules': loaded_heavy_modules,
+    }
+
+
+def result_key(result: dict) -> str:
+    if 'module' in result:
+        return f"import/{result['module']}"
+    key = f"{result['class']}/{result['size']}/{result['horizon']}"
+    enabled_options = sorted(name for name, value in result.get('options', {}).items() if value)
+    if enabled_options:
+        key += '+' + ','.join(enabled_options)
+    return key
+
+
+def print_import_result(result: dict) -> None:
+    heavy = ', '.join(result['heavy_modules']) if result['heavy_modules'] else '-'
+    print(f"{result_key(result):<52} import {result['import_seconds'] * 1e3:9.2f}ms  heavy modules: {heavy}")
+
+
+def print_result(result: dict) -> None:
+    peak = result['peak_memory_bytes']
+    peak_str = f'{peak / 1e6:10.2f}MB' if peak is not None else f'{"-":>12}'
+    print(f"{result_key(result):<52} init {result['init_seconds'] * 1e3:9.2f}ms  "
+          f"{result['steps_per_sec']:11.1f} steps/s  {result['retained_blocks_per_step']:10.1f} blocks/step  peak {peak_str}")
+
+
+def print_price_band_result(result: dict) -> None:
+    print(f"{result_key(result):<52} execute {result['execute_seconds']:7.3f}s (without band {result['baseline_seconds']:7.3f}s, "
+          f"{result['baseline_seconds'] / result['execute_seconds']:5.2f}x)  deferred {result['deferred_days']}/{result['horizon']} days  "
+          f"fill on read {result['fill_seconds']:7.3f}s")
+
+
+def compare(results: List[dict], baseline: List[dict], tolerance: float) -> bool:
+    """
+    保存済みのベースラインと steps/sec（import は import 時間の逆数）を比較し、tolerance を超えて遅くなったケースがあれば False を返す
+    """
+    baseline_map = {result_key(result): result for result in baseline}
+    ok = True
+    print('-' * 80)
+    print('comparison with baseline (speed ratio)')
+    for result in results:
+        key = result_key(result)
+        if key not in baseline_map:
+            continue
+        if 'module' in result:
+            ratio = baseline_map[key]['import_seconds'] / result['import_seconds']
+        else:
+            ratio = result['steps_per_sec'] / baseline_map[key]['steps_per_sec']
+        mark = ''
+        if ratio < 1 - tolerance:
+            mark = '  <-- REGRESSION'
+            ok = False
+        print(f'{key:<52} {ratio:6.2f}x{mark}')
+    return ok
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Micro-benchmark of check_diff_and_margin_call and initial allocation.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--horizons', type=int, nargs='+', default=DEFAULT_HORIZONS)
+    parser.add_argument('--classes', nargs='+', choices=list(TRANSACTION_CLASSES.keys()), default=list(TRANSACTION_CLASSES.keys()))
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass for peak memory')
+    parser.add_argument('--no-import-time', action='store_true', help='skip measuring the import time of the scripts modules')
+    parser.add_argument('--compact-portfolio', action='store_true', help="run with option['compact_portfolio'] = True")
+    parser.add_argument('--price-band', action='store_true', help="time execute() with and without option['price_band'] instead of the step loop")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help='save results as a baseline json')
+    parser.add_argument('--compare', help='baseline json to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed slowdown ratio before reporting a regression')
+    args = parser.parse_args(argv)
+
+    results = []
+    if not args.no_import_time:
+        for module in IMPORT_MODULES:
+            import_result = measure_import_time(module)
+            results.append(import_result)
+            print_import_result(import_result)
+    options: TransactionOption = {}  # type: ignore
+    if args.compact_portfolio:
+        options['compact_portfolio'] = True
+    results += run_benchmark(args.sizes, args.horizons, args.classes, measure_memory=not args.no_memory, seed=args.seed, options=options,
+                             price_band=args.price_band)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,199 @@
+"""
+複数の取引（ブック）をまとめて日次で実行するためのクラス
+借り手の保有有価証券は参加者ごとの ParticipantInventory で共有する
+"""
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+
+from .fx import USDJPY_CODE, currency_of, fx_code
+from .inventory import ParticipantInventory
+from .ledger import LedgerEventWriter
+from .netting import NettingReport, TransferNetter
+from .types import PortfolioItem, PortfolioWithPriorityItem, TransactionOption
+from .utils import get_price_getter, prefetch_portfolio_price
+
+
+class HoldingIndex(object):
+    """
+    銘柄コードから、その銘柄を st または担保として保有する取引（transactions の番号）を引くための索引
+    外貨建ての銘柄を保有する取引は為替（USD は JPY=X、EUR は EURJPY=X など）の保有者としても登録する
+    担保移動で担保の銘柄が変わった取引は update() で索引を更新する
+    """
+
+    def __init__(self) -> None:
+        self.holders: Dict[str, Set[int]] = {}
+        self._holding_codes: Dict[int, Set[str]] = {}
+
+    @staticmethod
+    def holding_codes(transaction) -> Set[str]:
+        codes = set()
+        for portfolio in (transaction.st_portfolio, transaction.collateral_portfolio):
+            for code, security in portfolio.items():
+                codes.add(code)
+                currency_code = fx_code(currency_of(security))
+                if currency_code is not None:
+                    codes.add(currency_code)
+        return codes
+
+    def update(self, i: int, transaction) -> None:
+        codes = self.holding_codes(transaction)
+        previous = self._holding_codes.get(i, set())
+        for code in previous - codes:
+            self.holders[code].discard(i)
+            if not self.holders[code]:
+                del self.holders[code]
+        for code in codes - previous:
+            self.holders.setdefault(code, set()).add(i)
+        self._holding_codes[i] = codes
+
+    def affected(self, codes: Iterable[str]) -> Set[int]:
+        affected: Set[int] = set()
+        for code in codes:
+            affected.update(self.holders.get(code, ()))
+        return affected
+
+
+class TransactionBook(object):
+    """
+    ex.)
+        book = TransactionBook(start_date, end_date)
+        book.add_inventory('Borrower(A)', jct_portfolio)
+        book.add_transaction(ExecuteAutoAdjustmentTransactionMulti, st_portfolio_1, {'borrower': 'Borrower(A)'})
+        book.add_transaction(ExecuteAutoAdjustmentTransactionMulti, st_portfolio_2, {'borrower': 'Borrower(A)'})
+        logs_list = book.execute()
+    ledger（LedgerEventWriter）を指定した場合は、ネッティング後の担保移動と価格更新を書き出す
+    selective を指定した場合は、前日から価格が変わった銘柄を st・担保として保有する取引と、前回マージンコールを行った取引のみを再評価し、
+    それ以外の取引は carry_forward_step で前回のログを引き継ぐ（価格調整の処理量はブック全体ではなく影響を受ける取引の数に比例する）
+    """
+
+    def __init__(self, start_date: date, end_date: date, ledger: Optional[LedgerEventWriter] = None, selective: bool = False) -> None:
+        self.start_date = start_date
+        self.end_date = end_date
+        self.ledger = ledger
+        self.selective = selective
+        self.index = HoldingIndex()
+        self.last_prices: Dict[str, float] = {}
+        self.evaluation_logs: Dict[str, list] = {
+            'date': [],
+            'evaluated_num': [],
+            'price_changed_num': []
+        }
+        self.inventories: Dict[str, ParticipantInventory] = {}
+        self.transactions: list = []
+        self.netter = TransferNetter()
+        self.transfer_logs: Dict[str, list] = {
+            'date': [],
+            'gross_transfer_num': [],
+            'net_transfer_num': [],
+            'transfers': []
+        }
+
+    def add_inventory(self, participant: str, portfolio: Dict[str, PortfolioWithPriorityItem]) -> ParticipantInventory:
+        if participant in self.inventories:
+            raise ValueError(f'Inventory of {participant} already exists.')
+        inventory = ParticipantInventory(participant, portfolio)
+        self.inventories[participant] = inventory
+        return inventory
+
+    def add_transaction(self, transaction_class, st_portfolio: Dict[str, PortfolioItem], options: TransactionOption, codes: Optional[Iterable[str]] = None):
+        """
+        借り手の在庫を jct_portfolio として取引を作成する
+        transaction_class は ExecuteAutoAdjustmentTransaction* を想定
+        """
+        borrower = options['borrower'] if 'borrower' in options else "Borrower(A)"
+        if borrower not in self.inventories:
+            raise ValueError(f'Inventory of {borrower} is not registered.')
+        inventory = self.inventories[borrower]
+
+        transaction = transaction_class(inventory.view(codes), st_portfolio, self.start_date, self.end_date, options)
+        # 初期差し入れ分を在庫に反映
+        inventory.commit()
+        if self.ledger is not None:
+            self.ledger.record_step(transaction, self.start_date, {})
+        self.index.update(len(self.transactions), transaction)
+        self.transactions.append(transaction)
+        return transaction
+
+    def date_range(self):
+        # 初日は各取引の初期化処理で処理済みのため、2日目以降
+        for n in range(int((self.end_date - self.start_date).days) - 1):
+            yield self.start_date + timedelta(n + 1)
+
+    def step(self, date: date) -> NettingReport:
+        """
+        全取引のマージンコールを行った上で、当日の在庫の増減を参加者ごとに一括反映する
+        各取引の担保移動は (借り手, 貸し手, 銘柄) ごとにネッティングし、最小限の移動のみを記録する
+        """
+        self.netter.reset()
+        # 当日分（未取得の場合）と翌日分の全取引の保有銘柄の価格取得を並行して開始しておく
+        portfolios = [portfolio for transaction in self.transactions
+                      for portfolio in (transaction.st_portfolio, transaction.jct_portfolio, transaction.collateral_portfolio)]
+        prefetch_portfolio_price(portfolios, date)
+        prefetch_portfolio_price(portfolios, date + timedelta(1))
+
+        changed_codes: Optional[List[str]] = None
+        if self.selective:
+            changed_codes = self.changed_codes(date)
+            dirty = self.index.affected(changed_codes)
+        evaluated = []
+        for i, transaction in enumerate(self.transactions):
+            if self.selective and i not in dirty and transaction.can_carry_forward():
+                transaction.carry_forward_step(date)
+                continue
+            evaluated.append(transaction)
+            before = {code: collateral['num'] for code, collateral in transaction.collateral_portfolio.items()}
+            transaction.check_diff_and_margin_call(date)
+            after = {code: collateral['num'] for code, collateral in transaction.collateral_portfolio.items()}
+            self.netter.record_portfolio_diff(transaction.borrower, transaction.lender, before, after)
+            if self.selective and after.keys() != before.keys():
+                self.index.update(i, transaction)
+
+        for inventory in self.inventories.values():
+            inventory.commit()
+
+        report = self.netter.net()
+        if self.ledger is not None:
+            # 価格を更新したのは再評価した取引のみ（前回のログを引き継いだ取引の保有銘柄は価格が変わっていない）
+            for transaction in evaluated:
+                for portfolio in (transaction.st_portfolio, transaction.jct_portfolio, transaction.collateral_portfolio):
+                    self.ledger.record_prices(portfolio, date, transaction.arith.to_yen)
+            self.ledger.record_transfers(report['transfers'], date)
+        self.transfer_logs['date'].append(date)
+        self.transfer_logs['gross_transfer_num'].append(report['gross_transfer_num'])
+        self.transfer_logs['net_transfer_num'].append(report['net_transfer_num'])
+        self.transfer_logs['transfers'].append(report['transfers'])
+        self.evaluation_logs['date'].append(date)
+        self.evaluation_logs['evaluated_num'].append(len(evaluated))
+        self.evaluation_logs['price_changed_num'].append(len(changed_codes) if changed_codes is not None else None)
+        if report['gross_transfer_num'] > 0:
+            print(f"transfers: {report['gross_transfer_num']} (gross) -> {report['net_transfer_num']} (net)")
+        return report
+
+    def changed_codes(self, date: date) -> List[str]:
+        """
+        保有されている銘柄のうち、前日から価格が変わった（または初めて参照する）銘柄
+        価格は保有する取引と同じ取得元（is_dummy_data の場合はローカルのデータ）から取得する
+        """
+        price_getter = get_price_getter()
+        changed = []
+        for code, holders in self.index.holders.items():
+            is_local = self.transactions[min(holders)].is_dummy_data
+            if code == USDJPY_CODE:
+                price = price_getter.get_usdjpy_close(date, is_local=is_local)
+            else:
+                price = price_getter.get_close_price(code, date, is_local=is_local)
+            if self.last_prices.get(code) != price:
+                self.last_prices[code] = price
+                changed.append(code)
+        return changed
+
+    def execute(self) -> List[Dict[str, list]]:
+        for _date in self.date_range():
+            print("@" * 80)
+            print(_date)
+            self.step(_date)
+            print("@" * 80)
+
+        print("Finished!!!!")
+
+        return [transaction.logs for transaction in self.transactions]
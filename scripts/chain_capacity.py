@@ -0,0 +1,279 @@
+"""
+ブロックチェーンの処理能力（ブロック間隔・ブロックあたりのガス／トランザクション数の上限）と
+送信待ちキューをモデル化し、シミュレータのステップごとの操作数（価格更新 updateToken と担保移動 transfer）を処理しきれるかを評価する
+- 各ステップの操作はその時刻にまとめて送信され、送信順（価格更新 -> 担保移動）にブロックへ取り込まれる
+- ブロック時刻は最初のステップの時刻から block_interval ごととし、送信時刻より後のブロックにのみ取り込まれる
+
+ex.)
+    steps = operations_from_ledger('./data/ledger')
+    report = ChainCapacityModel({'block_interval': 2.0, 'block_gas_limit': 30000000}).run(steps)
+    print(report['latency'], report['max_settlement_time'])
+"""
+from collections import Counter, deque
+import calendar
+import csv
+from datetime import date
+import math
+import os
+from typing import Deque, Dict, List, Optional, Sequence, TypedDict
+
+import numpy as np
+
+OPERATION_KINDS = ('update_token', 'transfer')
+
+ChainCapacityOption = TypedDict('ChainCapacityOption', {
+    'block_interval': Optional[float],
+    'block_gas_limit': Optional[int],
+    'block_tx_limit': Optional[int],
+    'update_token_gas': Optional[int],
+    'transfer_gas': Optional[int],
+}, total=False)
+
+OperationStep = TypedDict('OperationStep', {
+    'time': float,
+    'update_token': int,
+    'transfer': int
+})
+
+ChainCapacityReport = TypedDict('ChainCapacityReport', {
+    'steps': int,
+    'blocks': int,
+    'confirmed': Dict[str, int],
+    'latency': Dict[str, float],
+    'backlog': List[int],
+    'max_backlog': int,
+    'settlement_time': List[float],
+    'max_settlement_time': float,
+    'drain_time': float,
+    'utilization': float,
+    'keeps_up': bool
+})
+
+
+class _Submission(object):
+    __slots__ = ('time', 'step', 'kind', 'gas', 'remaining')
+
+    def __init__(self, time: float, step: int, kind: str, gas: int, remaining: int) -> None:
+        self.time = time
+        self.step = step
+        self.kind = kind
+        self.gas = gas
+        self.remaining = remaining
+
+
+class ChainCapacityModel(object):
+    """
+    ブロックごとに送信待ちキューの先頭から、ガス・トランザクション数の上限まで取り込む
+    block_tx_limit が None の場合はガスの上限のみで制限する
+    """
+
+    def __init__(self, options: Optional[ChainCapacityOption] = None) -> None:
+        options = options if options is not None else {}
+        self.block_interval = options['block_interval'] if 'block_interval' in options else 5.0
+        self.block_gas_limit = options['block_gas_limit'] if 'block_gas_limit' in options else 30000000
+        self.block_tx_limit = options['block_tx_limit'] if 'block_tx_limit' in options else None
+        self.gas = {
+            'update_token': options['update_token_gas'] if 'update_token_gas' in options else 50000,
+            'transfer': options['transfer_gas'] if 'transfer_gas' in options else 60000,
+        }
+        if self.block_interval <= 0:
+            raise ValueError(f'block_interval must be positive: {self.block_interval}')
+        for kind, gas in self.gas.items():
+            if gas <= 0 or gas > self.block_gas_limit:
+                raise ValueError(f'{kind} gas must be between 1 and block_gas_limit ({self.block_gas_limit}): {gas}')
+
+    def block_capacity(self, kind: str) -> int:
+        """
+        1ブロックに取り込める kind の操作数
+        """
+        capacity = self.block_gas_limit // self.gas[kind]
+        return min(capacity, self.block_tx_limit) if self.block_tx_limit is not None else capacity
+
+    def run(self, steps: Sequence[OperationStep]) -> ChainCapacityReport:
+        steps = sorted(steps, key=lambda step: step['time'])
+        if not steps:
+            raise ValueError('steps is empty.')
+        self._genesis = steps[0]['time']
+        self._block = 1
+        self._queue: Deque[_Submission] = deque()
+        self._pending = 0
+        self._blocks = 0
+        self._gas_used = 0
+        self._latencies: List[np.ndarray] = []
+        self._weights: List[np.ndarray] = []
+        self._confirmed = Counter()
+        self._settled_at = [step['time'] for step in steps]
+        step_remaining = [0] * len(steps)
+        self._step_remaining = step_remaining
+
+        backlog = []
+        for i, step in enumerate(steps):
+            self._produce(until=step['time'])
+            backlog.append(self._pending)
+            for kind in OPERATION_KINDS:
+                num = int(step[kind]) if kind in step else 0
+                if num > 0:
+                    self._queue.append(_Submission(step['time'], i, kind, self.gas[kind], num))
+                    self._pending += num
+                    step_remaining[i] += num
+        self._produce(until=math.inf)
+
+        settlement_time = [settled_at - step['time'] for settled_at, step in zip(self._settled_at, steps)]
+        drain_time = max(self._settled_at) - steps[0]['time']
+        active_blocks = max(int(math.ceil(drain_time / self.block_interval)), 1)
+        return {
+            'steps': len(steps),
+            'blocks': self._blocks,
+            'confirmed': {kind: self._confirmed[kind] for kind in OPERATION_KINDS},
+            'latency': self._latency_summary(),
+            'backlog': backlog,
+            'max_backlog': max(backlog),
+            'settlement_time': settlement_time,
+            'max_settlement_time': max(settlement_time),
+            'drain_time': drain_time,
+            'utilization': self._gas_used / (active_blocks * self.block_gas_limit),
+            # 各ステップの操作が次のステップまでに全て取り込まれたか
+            'keeps_up': all(num == 0 for num in backlog),
+        }
+
+    def _block_time(self, block: int) -> float:
+        return self._genesis + block * self.block_interval
+
+    def _confirm(self, submission: _Submission, block: int, num_blocks: int, per_block: int) -> None:
+        """
+        block から num_blocks 個のブロックで per_block ずつ取り込む
+        """
+        block_times = self._genesis + (block + np.arange(num_blocks)) * self.block_interval
+        self._latencies.append(block_times - submission.time)
+        self._weights.append(np.full(num_blocks, per_block, dtype=np.int64))
+        num = per_block * num_blocks
+        submission.remaining -= num
+        self._pending -= num
+        self._confirmed[submission.kind] += num
+        self._step_remaining[submission.step] -= num
+        if self._step_remaining[submission.step] == 0:
+            self._settled_at[submission.step] = float(block_times[-1])
+
+    def _produce(self, until: float) -> None:
+        """
+        時刻 until までのブロックを生成する（キューが空の間のブロックは数えない）
+        """
+        queue = self._queue
+        while queue:
+            head = queue[0]
+            if self._block_time(self._block) <= head.time:
+                # 送信より前のブロックは空のため、送信後の最初のブロックまで進める
+                self._block = int(math.floor((head.time - self._genesis) / self.block_interval)) + 1
+            block_time = self._block_time(self._block)
+            if block_time > until:
+                return
+
+            capacity = self.block_capacity(head.kind)
+            full_blocks = head.remaining // capacity - 1
+            if full_blocks > 0:
+                # 先頭の送信だけで埋まるブロックはまとめて処理する（until までのブロックに限る）
+                if until != math.inf:
+                    full_blocks = min(full_blocks, int(math.floor((until - block_time) / self.block_interval)) + 1)
+                self._confirm(head, self._block, full_blocks, capacity)
+                self._blocks += full_blocks
+                self._gas_used += full_blocks * capacity * head.gas
+                self._block += full_blocks
+                continue
+
+            # 1ブロック分を先頭から順に詰める
+            gas_left = self.block_gas_limit
+            tx_left = self.block_tx_limit if self.block_tx_limit is not None else math.inf
+            while queue:
+                submission = queue[0]
+                if submission.time >= block_time:
+                    break
+                num = int(min(submission.remaining, tx_left, gas_left // submission.gas))
+                if num == 0:
+                    break
+                self._confirm(submission, self._block, 1, num)
+                gas_left -= num * submission.gas
+                tx_left -= num
+                self._gas_used += num * submission.gas
+                if submission.remaining > 0:
+                    break
+                queue.popleft()
+            self._blocks += 1
+            self._block += 1
+
+    def _latency_summary(self) -> Dict[str, float]:
+        """
+        送信から取り込みまでの時間（秒）の分位点（操作数で重み付け）
+        """
+        if not self._latencies:
+            return {'mean': 0.0, 'p50': 0.0, 'p90': 0.0, 'p99': 0.0, 'max': 0.0}
+        latencies = np.concatenate(self._latencies)
+        weights = np.concatenate(self._weights)
+        order = np.argsort(latencies, kind='stable')
+        latencies, weights = latencies[order], weights[order]
+        cumulative = np.cumsum(weights)
+        total = cumulative[-1]
+
+        def percentile(q: float) -> float:
+            return float(latencies[np.searchsorted(cumulative, q * total, side='left')])
+
+        return {
+            'mean': float(np.dot(latencies, weights) / total),
+            'p50': percentile(0.5),
+            'p90': percentile(0.9),
+            'p99': percentile(0.99),
+            'max': float(latencies[-1]),
+        }
+
+
+def _unix_time(_date: date) -> int:
+    return calendar.timegm(_date.timetuple())
+
+
+def operations_from_ledger(directory: str) -> List[OperationStep]:
+    """
+    LedgerEventWriter が書き出した update_token.csv, transfer_token.csv の updateTime ごとの行数
+    """
+    counts: Dict[str, Counter] = {}
+    for kind, filename in (('update_token', 'update_token.csv'), ('transfer', 'transfer_token.csv')):
+        counter: Counter = Counter()
+        with open(os.path.join(directory, filename), newline='') as f:
+            for row in csv.DictReader(f):
+                counter[int(row['updateTime'])] += 1
+        counts[kind] = counter
+    times = sorted(set(counts['update_token']) | set(counts['transfer']))
+    return [{'time': time, 'update_token': counts['update_token'][time], 'transfer': counts['transfer'][time]} for time in times]
+
+
+def operations_from_book(book) -> List[OperationStep]:
+    """
+    実行済みの TransactionBook のステップごとの操作数
+    価格更新は全取引が参照する銘柄数、担保移動はネッティング後の移動数とする（初日は初期差し入れ）
+    """
+    codes = set()
+    initial_transfers = 0
+    for transaction in book.transactions:
+        for portfolio in (transaction.st_portfolio, transaction.jct_portfolio, transaction.collateral_portfolio):
+            codes.update(portfolio.keys())
+        initial_collateral = transaction.logs['collateral_portfolio'][0] if transaction.logs['collateral_portfolio'] else {}
+        initial_transfers += sum(1 for collateral in initial_collateral.values() if collateral['num'] > 0)
+    steps: List[OperationStep] = [{'time': _unix_time(book.start_date), 'update_token': len(codes), 'transfer': initial_transfers}]
+    for _date, net_transfer_num in zip(book.transfer_logs['date'], book.transfer_logs['net_transfer_num']):
+        steps.append({'time': _unix_time(_date), 'update_token': len(codes), 'transfer': net_transfer_num})
+    return steps
+
+
+def operations_from_logs(logs: Dict[str, list]) -> List[OperationStep]:
+    """
+    1取引の execute() のログのステップごとの操作数
+    価格更新は JCT・担保ポートフォリオの銘柄数（ST ポートフォリオはログに含まれないため数えない）、
+    担保移動は担保ポートフォリオの数量が前日から変化した銘柄数とする
+    """
+    steps: List[OperationStep] = []
+    previous: Dict[str, int] = {}
+    for _date, jct_portfolio, collateral_portfolio in zip(logs['date'], logs['jct_portfolio'], logs['collateral_portfolio']):
+        codes = set(jct_portfolio) | set(collateral_portfolio)
+        nums = {code: collateral['num'] for code, collateral in collateral_portfolio.items()}
+        transfers = sum(1 for code in set(nums) | set(previous) if nums.get(code, 0) != previous.get(code, 0))
+        steps.append({'time': _unix_time(_date), 'update_token': len(codes), 'transfer': transfers})
+        previous = nums
+    return steps
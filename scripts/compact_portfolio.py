@@ -0,0 +1,247 @@
+"""
+ポートフォリオ（Dict[str, PortfolioWithPriorityItem]）を銘柄ごとの並列配列で保持するコンパクトな表現
+option['compact_portfolio'] が True の場合に取引内部で用い、execute() の返り値では dict に戻す
+"""
+from array import array
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, List, Mapping, Optional, Union
+
+from .fx import CURRENCIES, CURRENCY_JPY, CURRENCY_USD, currency_id, currency_of
+from .types import PortfolioItem, PortfolioWithPriorityItem
+
+
+class CompactItem(object):
+    """
+    CompactPortfolio の1銘柄分を PortfolioWithPriorityItem と同じ添字アクセス（item['num']）で扱うためのビュー
+    属性アクセス（item.num）も可能
+    """
+    __slots__ = ('_portfolio', '_idx')
+
+    def __init__(self, portfolio: 'CompactPortfolio', idx: int) -> None:
+        self._portfolio = portfolio
+        self._idx = idx
+
+    @property
+    def num(self) -> int:
+        return self._portfolio.nums[self._idx]
+
+    @num.setter
+    def num(self, value: int) -> None:
+        self._portfolio.nums[self._idx] = value
+
+    @property
+    def price(self) -> float:
+        return self._portfolio.prices[self._idx]
+
+    @price.setter
+    def price(self, value: float) -> None:
+        self._portfolio.prices[self._idx] = value
+
+    @property
+    def priority(self) -> int:
+        if not self._portfolio.has_priority:
+            raise KeyError('priority')
+        return self._portfolio.priorities[self._idx]
+
+    @property
+    def is_usd(self) -> bool:
+        return self._portfolio.currency_ids[self._idx] == CURRENCY_USD
+
+    @property
+    def currency(self) -> str:
+        return CURRENCIES[self._portfolio.currency_ids[self._idx]]
+
+    def __getitem__(self, key: str) -> Union[int, float, bool, str]:
+        if key == 'num':
+            return self._portfolio.nums[self._idx]
+        if key == 'price':
+            return self._portfolio.prices[self._idx]
+        if key == 'priority':
+            return self.priority
+        if key == 'is_usd':
+            return self._portfolio.currency_ids[self._idx] == CURRENCY_USD
+        if key == 'currency' and self._portfolio.currency_ids[self._idx] > CURRENCY_USD:
+            return self.currency
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value) -> None:
+        if key == 'num':
+            self._portfolio.nums[self._idx] = value
+        elif key == 'price':
+            self._portfolio.prices[self._idx] = value
+        elif key == 'priority' and self._portfolio.has_priority:
+            self._portfolio.priorities[self._idx] = value
+        elif key == 'is_usd':
+            self._portfolio.currency_ids[self._idx] = CURRENCY_USD if value else CURRENCY_JPY
+        elif key == 'currency':
+            # None の場合は is_usd で表す通貨（JPY / USD）に戻す
+            if value is not None:
+                self._portfolio.currency_ids[self._idx] = currency_id(value)
+            elif self._portfolio.currency_ids[self._idx] > CURRENCY_USD:
+                self._portfolio.currency_ids[self._idx] = CURRENCY_JPY
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key: str) -> bool:
+        if key == 'currency':
+            # JPY / USD は dict の場合と同じく 'currency' を持たない（is_usd で表す）
+            return self._portfolio.currency_ids[self._idx] > CURRENCY_USD
+        return key in ('num', 'price', 'is_usd') or (key == 'priority' and self._portfolio.has_priority)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, CompactItem):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
+
+    def to_dict(self) -> Union[PortfolioItem, PortfolioWithPriorityItem]:
+        return self._portfolio._item_dict(self._idx)
+
+    def copy(self) -> Union[PortfolioItem, PortfolioWithPriorityItem]:
+        return self.to_dict()
+
+
+class CompactPortfolio(MutableMapping):
+    """
+    codes, nums, prices, priorities, currency_ids（fx.CURRENCIES の id）の並列配列で保有有価証券を保持する
+    dict と同じく portfolio[code]['num'] でアクセスでき、新しい銘柄は portfolio[code] = {...} で追加する
+    コピー（ログ保存時の deepcopy）では配列のみを複製し、銘柄の並び（codes, index）は次に銘柄が追加されるまで共有する
+    """
+
+    def __init__(self, has_priority: bool = True, integer_prices: bool = False) -> None:
+        self.has_priority = has_priority
+        self.codes: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.nums = array('q')
+        # 固定小数点モードでは価格を 0.1円単位の整数で保持する
+        self.prices = array('q' if integer_prices else 'd')
+        self.priorities = array('q')
+        self.currency_ids = array('b')
+        self._shared_keys = False
+        self._views: Dict[str, CompactItem] = {}
+
+    @classmethod
+    def from_dict(cls, portfolio: Mapping[str, Mapping], integer_prices: bool = False) -> 'CompactPortfolio':
+        """
+        TypedDict 形式のポートフォリオから作成する（元の dict は変更しない）
+        全ての銘柄が priority を持つ場合のみ priority を保持する
+        integer_prices の場合、円単位の価格は取引開始時に更新されるため 0 として作成する
+        """
+        items = list(portfolio.values())
+        compact = cls(has_priority=all('priority' in item for item in items), integer_prices=integer_prices)
+        if not compact.has_priority and any('priority' in item for item in items):
+            raise ValueError('priority must be set for all securities or none of them.')
+        for code, item in portfolio.items():
+            compact[code] = dict(item, price=0) if integer_prices else item
+        return compact
+
+    def _unshare_keys(self) -> None:
+        if self._shared_keys:
+            self.codes = list(self.codes)
+            self.index = dict(self.index)
+            self._shared_keys = False
+
+    def _item_dict(self, idx: int) -> Union[PortfolioItem, PortfolioWithPriorityItem]:
+        item = {
+            'num': self.nums[idx],
+            'price': self.prices[idx],
+            'is_usd': self.currency_ids[idx] == CURRENCY_USD
+        }
+        if self.has_priority:
+            item['priority'] = self.priorities[idx]
+        if self.currency_ids[idx] > CURRENCY_USD:
+            item['currency'] = CURRENCIES[self.currency_ids[idx]]
+        return item  # type: ignore
+
+    def __getitem__(self, code: str) -> CompactItem:
+        view = self._views.get(code)
+        if view is None:
+            view = CompactItem(self, self.index[code])
+            self._views[code] = view
+        return view
+
+    def __setitem__(self, code: str, item: Mapping) -> None:
+        num = item['num']
+        if isinstance(num, float):
+            if not num.is_integer():
+                raise ValueError(f'num of {code} must be an integer: {num}')
+            num = int(num)
+        price = item['price'] if 'price' in item else 0
+        priority = item['priority'] if self.has_priority else 0
+        cid = currency_id(currency_of(item))
+
+        if code in self.index:
+            idx = self.index[code]
+            self.nums[idx] = num
+            self.prices[idx] = price
+            self.priorities[idx] = priority
+            self.currency_ids[idx] = cid
+            return
+
+        self._unshare_keys()
+        self.index[code] = len(self.codes)
+        self.codes.append(code)
+        self.nums.append(num)
+        self.prices.append(price)
+        self.priorities.append(priority)
+        self.currency_ids.append(cid)
+
+    def __delitem__(self, code: str) -> None:
+        idx = self.index[code]
+        self._unshare_keys()
+        for values in (self.nums, self.prices, self.priorities, self.currency_ids):
+            values.pop(idx)
+        self.codes.pop(idx)
+        self.index = {_code: i for i, _code in enumerate(self.codes)}
+        # 添字がずれるため、作成済みのビューは作り直す
+        self._views = {}
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.codes)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __contains__(self, code) -> bool:
+        return code in self.index
+
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
+
+    def copy(self) -> 'CompactPortfolio':
+        new = CompactPortfolio.__new__(CompactPortfolio)
+        new.has_priority = self.has_priority
+        new.codes = self.codes
+        new.index = self.index
+        new.nums = array('q', self.nums)
+        new.prices = array(self.prices.typecode, self.prices)
+        new.priorities = array('q', self.priorities)
+        new.currency_ids = array('b', self.currency_ids)
+        new._shared_keys = True
+        new._views = {}
+        self._shared_keys = True
+        return new
+
+    def __copy__(self) -> 'CompactPortfolio':
+        return self.copy()
+
+    def __deepcopy__(self, memo) -> 'CompactPortfolio':
+        return self.copy()
+
+    def to_dict(self) -> Dict[str, Union[PortfolioItem, PortfolioWithPriorityItem]]:
+        return {code: self._item_dict(idx) for idx, code in enumerate(self.codes)}
+
+
+def portfolio_logs_to_dict(logs: Dict[str, list], keys: Optional[List[str]] = None) -> Dict[str, list]:
+    """
+    ログ中の CompactPortfolio のスナップショットを TypedDict 形式に戻す（ログ自体を書き換えて返す）
+    """
+    for key in (keys if keys is not None else list(logs.keys())):
+        values = logs[key]
+        if isinstance(values, list) and any(isinstance(value, CompactPortfolio) for value in values):
+            logs[key] = [value.to_dict() if isinstance(value, CompactPortfolio) else value for value in values]
+    return logs
@@ -0,0 +1,161 @@
+"""
+価格バンド（price_band.py）で評価を省略した日のログ
+execute() の返り値では、評価を省略した日の価格・評価額に関わる項目を DeferredLog とし、その日の要素を初めて参照した時点で時価評価して埋める
+（参照しない日の時価評価は行わない。pickle・copy した場合は全ての日を埋めた list となる）
+
+ex.)
+    logs = ExecuteAutoAdjustmentTransactionMulti(jct_portfolio, st_portfolio, start_date, end_date, {'price_band': True}).execute()
+    logs['collateral_sum'][-1]  # 最後の日の評価を省略していた場合は、ここで最後の日のみ時価評価する
+"""
+from collections.abc import MutableSequence
+import copy
+from typing import Any, Dict, List, Optional
+
+from .compact_portfolio import portfolio_logs_to_dict
+from .fixed_point import fixed_point_logs_to_yen
+from .utils import update_portfolio_price
+
+# 評価を省略した日に埋める項目
+DEFERRED_VALUE_KEYS = ('st_total_value', 'jct_total_value', 'necessary_collateral_value', 'collateral_sum')
+DEFERRED_PORTFOLIO_KEYS = ('jct_portfolio', 'collateral_portfolio', 'initial_collateral_portfolio')
+
+
+class DeferredSteps(object):
+    """
+    評価を省略した日（ログの index, 日付, その日のポートフォリオの数量）と、その日のログの値の求め方
+    ポートフォリオの数量は直前に評価した日のログのものを参照するため書き換えず、複製して時価評価する（st のみ専用の複製の価格を更新する）
+    fill(index) は logs のその日の要素を埋める。convert が True の場合は execute() の返り値と同じ形式（dict のポートフォリオ・円）に変換して埋める
+    """
+
+    def __init__(self, transaction, steps: list, logs: Dict[str, Any], convert: bool = False) -> None:
+        self.arith = transaction.arith
+        self.is_dummy_data = transaction.is_dummy_data
+        self.lender_loan_ratio = transaction.lender_loan_ratio
+        self.borrower_loan_ratio = transaction.borrower_loan_ratio
+        self.pending: Dict[int, tuple] = {index: (_date, state) for index, _date, state in steps}
+        self.logs = logs
+        self.convert = convert
+
+    def values(self, _date, state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        _date の価格で時価評価したその日のログの値（check_diff_and_margin_call の閾値内の場合と同じ値）
+        """
+        portfolios = {key: copy.deepcopy(state[key]) for key in DEFERRED_PORTFOLIO_KEYS}
+        st_total_value = update_portfolio_price(state['st_portfolio'], _date, is_dummy_data=self.is_dummy_data, arith=self.arith)
+        values = {
+            'st_total_value': st_total_value,
+            'jct_total_value': update_portfolio_price(portfolios['jct_portfolio'], _date, is_dummy_data=self.is_dummy_data, arith=self.arith),
+            'necessary_collateral_value': self.arith.necessary_value(st_total_value, self.lender_loan_ratio, self.borrower_loan_ratio),
+            'collateral_sum': update_portfolio_price(portfolios['collateral_portfolio'], _date, is_dummy_data=self.is_dummy_data, arith=self.arith),
+        }
+        update_portfolio_price(portfolios['initial_collateral_portfolio'], _date, arith=self.arith)
+        values.update(portfolios)
+        return values
+
+    def fill(self, index: int) -> None:
+        _date, state = self.pending[index]
+        values = self.values(_date, state)
+        if self.convert:
+            # 1日分のログとして、execute() の返り値と同じ変換を行う
+            row = {key: [value] for key, value in values.items()}
+            portfolio_logs_to_dict(row)
+            if self.arith.is_fixed_point:
+                fixed_point_logs_to_yen(row)
+            values = {key: value[0] for key, value in row.items()}
+        for key, value in values.items():
+            self.logs[key][index] = value
+        del self.pending[index]
+
+    def fill_all(self) -> None:
+        for index in sorted(self.pending):
+            self.fill(index)
+
+
+class DeferredLog(MutableSequence):
+    """
+    評価を省略した日の要素を、参照された時点で DeferredSteps から埋めるリスト
+    """
+    __slots__ = ('_values', '_steps')
+
+    def __init__(self, values: List[Any], steps: DeferredSteps) -> None:
+        self._values = values
+        self._steps = steps
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def _index(self, i: int) -> int:
+        if i < 0:
+            i += len(self._values)
+        if i < 0 or i >= len(self._values):
+            raise IndexError('DeferredLog index out of range')
+        return i
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = self._index(i)
+        if i in self._steps.pending:
+            self._steps.fill(i)
+        return self._values[i]
+
+    def __setitem__(self, i, value) -> None:
+        if isinstance(i, slice):
+            self._steps.fill_all()
+        else:
+            # 同じ日の他の項目も埋まるため、先にその日を埋めてから書き換える
+            i = self._index(i)
+            if i in self._steps.pending:
+                self._steps.fill(i)
+        self._values[i] = value
+
+    def __delitem__(self, i) -> None:
+        # 以降の index がずれるため、全ての日を埋めてから削除する
+        self._steps.fill_all()
+        del self._values[i]
+
+    def insert(self, i: int, value) -> None:
+        if i < len(self._values):
+            self._steps.fill_all()
+        self._values.insert(i, value)
+
+    def append(self, value) -> None:
+        self._values.append(value)
+
+    def __iter__(self):
+        for i in range(len(self._values)):
+            yield self[i]
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (list, MutableSequence)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        return repr(self.to_list())
+
+    def __reduce__(self):
+        # pickle・copy では全ての日を埋めた list とする
+        return (list, (self.to_list(),))
+
+    def to_list(self) -> List[Any]:
+        self._steps.fill_all()
+        return list(self._values)
+
+
+def defer_logs(logs: Dict[str, Any], transaction, convert: bool = False) -> Optional[DeferredSteps]:
+    """
+    logs の評価を省略した日の項目を DeferredLog に置き換える（logs 自体を書き換える）
+    評価を省略した日がない場合は何もせず None を返す
+    """
+    if not transaction.deferred_steps:
+        return None
+    steps = DeferredSteps(transaction, transaction.deferred_steps, {}, convert)
+    for key in DEFERRED_VALUE_KEYS + DEFERRED_PORTFOLIO_KEYS:
+        # 取引の内部のログ（続きの実行で追加される）とは別のリストとする
+        values = list(logs[key])
+        steps.logs[key] = values
+        logs[key] = DeferredLog(values, steps)
+    return steps
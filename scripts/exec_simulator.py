@@ -4,11 +4,21 @@
 
 import copy
 from datetime import date, timedelta
-import math
 from pprint import pprint
-from typing import Dict
-
-from .utils import update_portfolio_price
+from typing import Dict, Optional
+
+from .compact_portfolio import CompactPortfolio, portfolio_logs_to_dict
+from .deferred_log import defer_logs
+from .fixed_point import fixed_point_logs_to_yen, get_arithmetic
+from .fork import fork_transaction, materialize_logs
+from .fx import currency_item
+from .inventory import attach_portfolio
+from .lag import LaggedPriceReference
+from .live_monitor import LiveMonitor
+from .memory_probe import MemoryProbe
+from .online_stats import OnlineLogStats
+from .profiler import NULL_PROFILER, StepProfiler
+from .utils import prefetch_portfolio_price, update_portfolio_price
 
 from .types import PortfolioItem, PortfolioWithPriorityItem, TransactionOption
 from .variable_local import AutoAdjustmentTransactionSingle, AutoAdjustmentTransactionMulti, AutoAdjustmentTransactionDynamicMulti
@@ -18,8 +28,13 @@ class ExecuteAutoAdjustmentTransactionSingle(AutoAdjustmentTransactionSingle):
     def __init__(self, jct_portfolio: Dict[str, PortfolioWithPriorityItem], st_portfolio: Dict[str, PortfolioItem], start_date: date, end_date: date, options: TransactionOption) -> None:
         self.borrower = options['borrower'] if 'borrower' in options else "Borrower(A)"
         self.lender = options['lender'] if 'lender' in options else 'Lender(B)'
-        self.jct_portfolio = copy.deepcopy(jct_portfolio)
-        self.st_portfolio = copy.deepcopy(st_portfolio)
+        self.compact_portfolio = options['compact_portfolio'] if 'compact_portfolio' in options else False
+        self.fixed_point = options['fixed_point'] if 'fixed_point' in options else False
+        self.arith = get_arithmetic(self.fixed_point)
+        self.jct_portfolio = attach_portfolio(jct_portfolio, self.compact_portfolio, self.fixed_point)
+        self.st_portfolio = attach_portfolio(st_portfolio, self.compact_portfolio, self.fixed_point)
+        # 遅延を指定した場合は reference_delay 日前の価格で時価評価する
+        self.price_reference = LaggedPriceReference.create(options['reference_delay'] if 'reference_delay' in options else 0, (jct_portfolio, st_portfolio))
         self.borrower_loan_ratio = options['borrower_loan_ratio'] if 'borrower_loan_ratio' in options else 1.0
         self.lender_loan_ratio = options['lender_loan_ratio'] if 'lender_loan_ratio' in options else 1.0
         self.print_log = options['print_log'] if 'print_log' in options else False
@@ -28,33 +43,65 @@ class ExecuteAutoAdjustmentTransactionSingle(AutoAdjustmentTransactionSingle):
         self.is_reverse = options['is_reverse'] if 'is_reverse' in options else False
         self.is_manual = options['is_manual'] if 'is_manual' in options else False
         self.margin_call_threshold = options['margin_call_threshold'] if 'margin_call_threshold' in options else 0.0
-        self.collateral_portfolio: Dict[str, PortfolioWithPriorityItem] = {}
+        self.rebalance_band = options['rebalance_band'] if 'rebalance_band' in options else None
+        self.reference_delay = options['reference_delay'] if 'reference_delay' in options else 0
+        self.profile = options['profile'] if 'profile' in options else False
+        self.profiler = StepProfiler() if self.profile else NULL_PROFILER
+        # keep_logs が False の場合はステップごとのログを保持せず、集計値（logs['summary']）のみを残す
+        self.keep_logs = options['keep_logs'] if 'keep_logs' in options else True
+        online_stats = options['online_stats'] if 'online_stats' in options else False
+        self.online_stats = OnlineLogStats(self.arith.to_yen) if online_stats or not self.keep_logs else None
+        # トークン移動・価格更新を書き出す LedgerEventWriter（ledger.py）
+        self.ledger = options['ledger'] if 'ledger' in options else None
+        # price_band が True の場合は、価格がマージンコールの起こらないバンド内の日の評価を省略する（price_band.py）
+        self.price_band = options['price_band'] if 'price_band' in options else False
+        self.no_margin_call_band = None
+        self.deferred_steps: list = []
+        self.deferred_state = None
+        # memory_probe にステップ数を指定した場合は、そのステップごとにメモリ使用量を記録する（memory_probe.py）
+        memory_probe = options['memory_probe'] if 'memory_probe' in options else None
+        self.memory_probe = MemoryProbe(memory_probe) if memory_probe else None
+        # live_monitor にステップ数を指定した場合は、そのステップごとに新しいログを図に追加する（live_monitor.py）
+        live_monitor = options['live_monitor'] if 'live_monitor' in options else None
+        if live_monitor and not self.keep_logs:
+            raise ValueError('live_monitor requires keep_logs (the monitor reads the step logs).')
+        self.live_monitor = LiveMonitor(live_monitor) if live_monitor else None
+        self.collateral_portfolio: Dict[str, PortfolioWithPriorityItem] = CompactPortfolio(integer_prices=self.fixed_point) if self.compact_portfolio else {}  # type: ignore
         self.logs: Dict[str, list] = {}
         self.start_date = start_date
+        self.end_date = end_date
+        # 実行済みの最後の日付（execute(until) で途中まで実行した場合、続きはこの翌日から）
+        self.current_date = start_date
 
         pprint(f'JCT portfolio: {self.jct_portfolio}')
         pprint(f'ST portfolio: {self.st_portfolio}')
 
-        def date_range():
-            for n in range(int((end_date - start_date).days) - 1):
-                yield start_date + timedelta(n + 1)
+        self.initialize()
 
-        # 初日は初期化処理を含むため、2日目以降のgeneratorを作成
-        self.date_range = date_range
+    def date_range(self, until: Optional[date] = None):
+        # 初日は初期化処理を含むため、実行済みの日付の翌日から end_date の前日（until を指定した場合は until）まで
+        current_date = self.current_date
+        last_date = self.end_date - timedelta(1) if until is None else min(until, self.end_date - timedelta(1))
+        for n in range(int((last_date - current_date).days)):
+            yield current_date + timedelta(n + 1)
 
-        self.initialize()
+    def fork(self, options: Optional[TransactionOption] = None, end_date: Optional[date] = None):
+        """
+        実行済みの日付から分岐させた取引を返す（分岐時点までのログは copy-on-write で共有する）
+        """
+        return fork_transaction(self, options, end_date)
 
     def initialize(self):
-        st_total_value = update_portfolio_price(self.st_portfolio, self.start_date, self.print_log, is_dummy_data=self.is_dummy_data)
-        jct_total_value = update_portfolio_price(self.jct_portfolio, self.start_date, self.print_log, is_dummy_data=self.is_dummy_data)
-        collateral_total_value = st_total_value * self.lender_loan_ratio / self.borrower_loan_ratio
+        st_total_value = update_portfolio_price(self.st_portfolio, self.start_date, self.print_log, is_dummy_data=self.is_dummy_data, arith=self.arith, price_getter=self.price_reference)
+        jct_total_value = update_portfolio_price(self.jct_portfolio, self.start_date, self.print_log, is_dummy_data=self.is_dummy_data, arith=self.arith, price_getter=self.price_reference)
+        collateral_total_value = self.arith.necessary_value(st_total_value, self.lender_loan_ratio, self.borrower_loan_ratio)
         self.necessary_collateral_value = collateral_total_value
 
         for code, collateral in sorted(self.jct_portfolio.items(), key=lambda x: x[1]['priority'], reverse=True):  # type: ignore
             pprint(f'{code}: {collateral}')
             collateral_value = collateral['price'] * collateral['num']
             if collateral_value >= collateral_total_value:
-                collateral_num = math.ceil(collateral_total_value / collateral['price'])
+                collateral_num = self.arith.ceil_div(collateral_total_value, collateral['price'])
 
                 if (collateral_num > self.jct_portfolio[code]['num']):
                     print("絶妙に足りない場合")
@@ -64,7 +111,8 @@ class ExecuteAutoAdjustmentTransactionSingle(AutoAdjustmentTransactionSingle):
                     'num': collateral_num,
                     'is_usd': collateral['is_usd'],
                     'price': collateral['price'],
-                    'priority': collateral['priority']
+                    'priority': collateral['priority'],
+                    **currency_item(collateral)
                 }
                 self.jct_portfolio[code]['num'] -= collateral_num
 
@@ -77,7 +125,8 @@ class ExecuteAutoAdjustmentTransactionSingle(AutoAdjustmentTransactionSingle):
                 'num': collateral['num'],
                 'is_usd': collateral['is_usd'],
                 'price': collateral['price'],
-                'priority': collateral['priority']
+                'priority': collateral['priority'],
+                **currency_item(collateral)
             }
             collateral_total_value -= collateral['price'] * collateral['num']
             self.jct_portfolio[code]['num'] = 0
@@ -85,7 +134,7 @@ class ExecuteAutoAdjustmentTransactionSingle(AutoAdjustmentTransactionSingle):
         if collateral_total_value > 0:
             raise ValueError(f'Initial JCT is insufficient!! {self.jct_portfolio}')
 
-        collateral_sum = update_portfolio_price(self.collateral_portfolio, self.start_date, self.print_log, is_dummy_data=self.is_dummy_data)
+        collateral_sum = update_portfolio_price(self.collateral_portfolio, self.start_date, self.print_log, is_dummy_data=self.is_dummy_data, arith=self.arith, price_getter=self.price_reference)
         self.logs['date'] = [self.start_date]
         self.logs['st_total_value'] = [st_total_value]
         self.logs['jct_total_value'] = [jct_total_value]
@@ -99,29 +148,94 @@ class ExecuteAutoAdjustmentTransactionSingle(AutoAdjustmentTransactionSingle):
 
         self.initial_collateral_portfolio = copy.deepcopy(self.collateral_portfolio)
         self.logs['initial_collateral_portfolio'] = [copy.deepcopy(self.collateral_portfolio)]
+        self.update_online_stats()
+        if self.ledger is not None:
+            self.ledger.record_step(self, self.start_date, {})
 
         print('Transaction is created.')
         if self.print_log:
             pprint(self.logs)
 
-    def execute(self):
-        for _date in self.date_range():
-            print("@" * 80)
-            print(_date)
-            self.check_diff_and_margin_call(_date)
-            print("@" * 80)
+    def execute(self, until: Optional[date] = None):
+        """
+        until を指定した場合は until までを実行する（続きは再度 execute() を呼ぶか、fork() で分岐させて実行する）
+        """
+        if self.memory_probe is not None:
+            self.memory_probe.start()
+        with self.profiler.capture_print():
+            for _date in self.date_range(until):
+                self.profiler.start()
+                # 当日分（未取得の場合）と翌日分の価格取得を並行して開始しておく
+                portfolios = (self.st_portfolio, self.jct_portfolio, self.collateral_portfolio)
+                prefetch_portfolio_price(portfolios, _date)
+                prefetch_portfolio_price(portfolios, _date + timedelta(1))
+                print("@" * 80)
+                print(_date)
+                before = {code: collateral['num'] for code, collateral in self.collateral_portfolio.items()} if self.ledger is not None else None
+                if self.is_in_no_margin_call_band(_date):
+                    # バンド内の日は閾値内となるため評価を省略し、ログは参照された時点で埋める
+                    self.defer_step(_date)
+                else:
+                    self.check_diff_and_margin_call(_date)
+                    self.update_no_margin_call_band()
+                self.current_date = _date
+                if self.ledger is not None:
+                    self.ledger.record_step(self, _date, before)
+                print("@" * 80)
+                self.profiler.finish_step()
+                if self.memory_probe is not None:
+                    self.memory_probe.sample((_date - self.start_date).days, self.memory_structures())
+                if self.live_monitor is not None:
+                    self.live_monitor.update((_date - self.start_date).days, self.logs, self.arith.to_yen)
 
         print("Finished!!!!")
+        self.sync_deferred_state()
+        if self.live_monitor is not None:
+            # 評価を省略した日を含めて描き直すため、先にログを埋める
+            self.fill_deferred_logs()
+            self.live_monitor.finish(self.logs, self.arith.to_yen)
+
+        if self.memory_probe is not None:
+            # 終了時点の状態を記録し、ログに添付する
+            self.memory_probe.sample((self.current_date - self.start_date).days, self.memory_structures(), force=True)
+            self.memory_probe.stop()
+            self.logs['memory'] = self.memory_probe.summary()  # type: ignore
+
+        if self.profile:
+            # フェーズ別の計測結果をログに添付する（profiler.summarize_profiles で集計可能）
+            self.logs['profile'] = self.profiler.summary()  # type: ignore
 
-        return self.logs
+        if self.online_stats is not None:
+            # ステップごとに更新した集計値（LogVisualizer の calc_* と同じ値）
+            self.logs['summary'] = self.online_stats.summary()  # type: ignore
+
+        # 続きの実行や分岐ができるよう self.logs は内部の形式のまま残し、変換したコピーを返す
+        logs = materialize_logs(self.logs)
+
+        if self.compact_portfolio:
+            # 返り値のログは従来通り TypedDict 形式のポートフォリオとする
+            portfolio_logs_to_dict(logs)
+
+        if self.fixed_point:
+            # 0.1円単位の整数で記録した価格・価値を円に戻す
+            fixed_point_logs_to_yen(logs)
+
+        # 評価を省略した日のログは、返り値でその日を参照した時点で埋める（deferred_log.py）
+        defer_logs(logs, self, convert=True)
+        return logs
 
 
 class ExecuteAutoAdjustmentTransactionMulti(AutoAdjustmentTransactionMulti):
     def __init__(self, jct_portfolio: Dict[str, PortfolioWithPriorityItem], st_portfolio: Dict[str, PortfolioItem], start_date: date, end_date: date, options: TransactionOption) -> None:
         self.borrower = options['borrower'] if 'borrower' in options else "Borrower(A)"
         self.lender = options['lender'] if 'lender' in options else 'Lender(B)'
-        self.jct_portfolio = copy.deepcopy(jct_portfolio)
-        self.st_portfolio = copy.deepcopy(st_portfolio)
+        self.compact_portfolio = options['compact_portfolio'] if 'compact_portfolio' in options else False
+        self.fixed_point = options['fixed_point'] if 'fixed_point' in options else False
+        self.arith = get_arithmetic(self.fixed_point)
+        self.jct_portfolio = attach_portfolio(jct_portfolio, self.compact_portfolio, self.fixed_point)
+        self.st_portfolio = attach_portfolio(st_portfolio, self.compact_portfolio, self.fixed_point)
+        # 遅延を指定した場合は reference_delay 日前の価格で時価評価する
+        self.price_reference = LaggedPriceReference.create(options['reference_delay'] if 'reference_delay' in options else 0, (jct_portfolio, st_portfolio))
         self.borrower_loan_ratio = options['borrower_loan_ratio'] if 'borrower_loan_ratio' in options else 1.0
         self.lender_loan_ratio = options['lender_loan_ratio'] if 'lender_loan_ratio' in options else 1.0
         self.print_log = options['print_log'] if 'print_log' in options else False
@@ -129,33 +243,65 @@ class ExecuteAutoAdjustmentTransactionMulti(AutoAdjustmentTransactionMulti):
         self.is_dummy_data = options['is_dummy_data'] if 'is_dummy_data' in options else False
         self.is_reverse = options['is_reverse'] if 'is_reverse' in options else False
         self.margin_call_threshold = options['margin_call_threshold'] if 'margin_call_threshold' in options else 0.0
-        self.collateral_portfolio: Dict[str, PortfolioWithPriorityItem] = {}
+        self.rebalance_band = options['rebalance_band'] if 'rebalance_band' in options else None
+        self.reference_delay = options['reference_delay'] if 'reference_delay' in options else 0
+        self.profile = options['profile'] if 'profile' in options else False
+        self.profiler = StepProfiler() if self.profile else NULL_PROFILER
+        # keep_logs が False の場合はステップごとのログを保持せず、集計値（logs['summary']）のみを残す
+        self.keep_logs = options['keep_logs'] if 'keep_logs' in options else True
+        online_stats = options['online_stats'] if 'online_stats' in options else False
+        self.online_stats = OnlineLogStats(self.arith.to_yen) if online_stats or not self.keep_logs else None
+        # トークン移動・価格更新を書き出す LedgerEventWriter（ledger.py）
+        self.ledger = options['ledger'] if 'ledger' in options else None
+        # price_band が True の場合は、価格がマージンコールの起こらないバンド内の日の評価を省略する（price_band.py）
+        self.price_band = options['price_band'] if 'price_band' in options else False
+        self.no_margin_call_band = None
+        self.deferred_steps: list = []
+        self.deferred_state = None
+        # memory_probe にステップ数を指定した場合は、そのステップごとにメモリ使用量を記録する（memory_probe.py）
+        memory_probe = options['memory_probe'] if 'memory_probe' in options else None
+        self.memory_probe = MemoryProbe(memory_probe) if memory_probe else None
+        # live_monitor にステップ数を指定した場合は、そのステップごとに新しいログを図に追加する（live_monitor.py）
+        live_monitor = options['live_monitor'] if 'live_monitor' in options else None
+        if live_monitor and not self.keep_logs:
+            raise ValueError('live_monitor requires keep_logs (the monitor reads the step logs).')
+        self.live_monitor = LiveMonitor(live_monitor) if live_monitor else None
+        self.collateral_portfolio: Dict[str, PortfolioWithPriorityItem] = CompactPortfolio(integer_prices=self.fixed_point) if self.compact_portfolio else {}  # type: ignore
         self.logs: Dict[str, list] = {}
         self.start_date = start_date
+        self.end_date = end_date
+        # 実行済みの最後の日付（execute(until) で途中まで実行した場合、続きはこの翌日から）
+        self.current_date = start_date
 
         pprint(f'JCT portfolio: {self.jct_portfolio}')
         pprint(f'ST portfolio: {self.st_portfolio}')
 
-        def date_range():
-            for n in range(int((end_date - start_date).days) - 1):
-                yield start_date + timedelta(n + 1)
+        self.initialize()
 
-        # 初日は初期化処理を含むため、2日目以降のgeneratorを作成
-        self.date_range = date_range
+    def date_range(self, until: Optional[date] = None):
+        # 初日は初期化処理を含むため、実行済みの日付の翌日から end_date の前日（until を指定した場合は until）まで
+        current_date = self.current_date
+        last_date = self.end_date - timedelta(1) if until is None else min(until, self.end_date - timedelta(1))
+        for n in range(int((last_date - current_date).days)):
+            yield current_date + timedelta(n + 1)
 
-        self.initialize()
+    def fork(self, options: Optional[TransactionOption] = None, end_date: Optional[date] = None):
+        """
+        実行済みの日付から分岐させた取引を返す（分岐時点までのログは copy-on-write で共有する）
+        """
+        return fork_transaction(self, options, end_date)
 
     def initialize(self):
-        st_total_value = update_portfolio_price(self.st_portfolio, self.start_date, self.print_log, is_dummy_data=self.is_dummy_data)
-        jct_total_value = update_portfolio_price(self.jct_portfolio, self.start_date, self.print_log, is_dummy_data=self.is_dummy_data)
-        collateral_total_value = st_total_value * self.lender_loan_ratio / self.borrower_loan_ratio
+        st_total_value = update_portfolio_price(self.st_portfolio, self.start_date, self.print_log, is_dummy_data=self.is_dummy_data, arith=self.arith, price_getter=self.price_reference)
+        jct_total_value = update_portfolio_price(self.jct_portfolio, self.start_date, self.print_log, is_dummy_data=self.is_dummy_data, arith=self.arith, price_getter=self.price_reference)
+        collateral_total_value = self.arith.necessary_value(st_total_value, self.lender_loan_ratio, self.borrower_loan_ratio)
         self.necessary_collateral_value = collateral_total_value
 
         for code, collateral in sorted(self.jct_portfolio.items(), key=lambda x: x[1]['priority'], reverse=True):  # type: ignore
             pprint(f'{code}: {collateral}')
             collateral_value = collateral['price'] * collateral['num']
             if collateral_value >= collateral_total_value:
-                collateral_num = math.ceil(collateral_total_value / collateral['price'])
+                collateral_num = self.arith.ceil_div(collateral_total_value, collateral['price'])
 
                 if (collateral_num > self.jct_portfolio[code]['num']):
                     print("絶妙に足りない場合")
@@ -165,7 +311,8 @@ class ExecuteAutoAdjustmentTransactionMulti(AutoAdjustmentTransactionMulti):
                     'num': collateral_num,
                     'is_usd': collateral['is_usd'],
                     'price': collateral['price'],
-                    'priority': collateral['priority']
+                    'priority': collateral['priority'],
+                    **currency_item(collateral)
                 }
                 self.jct_portfolio[code]['num'] -= collateral_num
 
@@ -178,7 +325,8 @@ class ExecuteAutoAdjustmentTransactionMulti(AutoAdjustmentTransactionMulti):
                 'num': collateral['num'],
                 'is_usd': collateral['is_usd'],
                 'price': collateral['price'],
-                'priority': collateral['priority']
+                'priority': collateral['priority'],
+                **currency_item(collateral)
             }
             collateral_total_value -= collateral['price'] * collateral['num']
             self.jct_portfolio[code]['num'] = 0
@@ -186,7 +334,7 @@ class ExecuteAutoAdjustmentTransactionMulti(AutoAdjustmentTransactionMulti):
         if collateral_total_value > 0:
             raise ValueError(f'Initial JCT is insufficient!! {self.jct_portfolio}')
 
-        collateral_sum = update_portfolio_price(self.collateral_portfolio, self.start_date, self.print_log, is_dummy_data=self.is_dummy_data)
+        collateral_sum = update_portfolio_price(self.collateral_portfolio, self.start_date, self.print_log, is_dummy_data=self.is_dummy_data, arith=self.arith, price_getter=self.price_reference)
         self.logs['date'] = [self.start_date]
         self.logs['st_total_value'] = [st_total_value]
         self.logs['jct_total_value'] = [jct_total_value]
@@ -200,29 +348,94 @@ class ExecuteAutoAdjustmentTransactionMulti(AutoAdjustmentTransactionMulti):
 
         self.initial_collateral_portfolio = copy.deepcopy(self.collateral_portfolio)
         self.logs['initial_collateral_portfolio'] = [copy.deepcopy(self.collateral_portfolio)]
+        self.update_online_stats()
+        if self.ledger is not None:
+            self.ledger.record_step(self, self.start_date, {})
 
         print('Transaction is created.')
         if self.print_log:
             pprint(self.logs)
 
-    def execute(self):
-        for _date in self.date_range():
-            print("@" * 80)
-            print(_date)
-            self.check_diff_and_margin_call(_date)
-            print("@" * 80)
+    def execute(self, until: Optional[date] = None):
+        """
+        until を指定した場合は until までを実行する（続きは再度 execute() を呼ぶか、fork() で分岐させて実行する）
+        """
+        if self.memory_probe is not None:
+            self.memory_probe.start()
+        with self.profiler.capture_print():
+            for _date in self.date_range(until):
+                self.profiler.start()
+                # 当日分（未取得の場合）と翌日分の価格取得を並行して開始しておく
+                portfolios = (self.st_portfolio, self.jct_portfolio, self.collateral_portfolio)
+                prefetch_portfolio_price(portfolios, _date)
+                prefetch_portfolio_price(portfolios, _date + timedelta(1))
+                print("@" * 80)
+                print(_date)
+                before = {code: collateral['num'] for code, collateral in self.collateral_portfolio.items()} if self.ledger is not None else None
+                if self.is_in_no_margin_call_band(_date):
+                    # バンド内の日は閾値内となるため評価を省略し、ログは参照された時点で埋める
+                    self.defer_step(_date)
+                else:
+                    self.check_diff_and_margin_call(_date)
+                    self.update_no_margin_call_band()
+                self.current_date = _date
+                if self.ledger is not None:
+                    self.ledger.record_step(self, _date, before)
+                print("@" * 80)
+                self.profiler.finish_step()
+                if self.memory_probe is not None:
+                    self.memory_probe.sample((_date - self.start_date).days, self.memory_structures())
+                if self.live_monitor is not None:
+                    self.live_monitor.update((_date - self.start_date).days, self.logs, self.arith.to_yen)
 
         print("Finished!!!!")
+        self.sync_deferred_state()
+        if self.live_monitor is not None:
+            # 評価を省略した日を含めて描き直すため、先にログを埋める
+            self.fill_deferred_logs()
+            self.live_monitor.finish(self.logs, self.arith.to_yen)
+
+        if self.memory_probe is not None:
+            # 終了時点の状態を記録し、ログに添付する
+            self.memory_probe.sample((self.current_date - self.start_date).days, self.memory_structures(), force=True)
+            self.memory_probe.stop()
+            self.logs['memory'] = self.memory_probe.summary()  # type: ignore
+
+        if self.profile:
+            # フェーズ別の計測結果をログに添付する（profiler.summarize_profiles で集計可能）
+            self.logs['profile'] = self.profiler.summary()  # type: ignore
+
+        if self.online_stats is not None:
+            # ステップごとに更新した集計値（LogVisualizer の calc_* と同じ値）
+            self.logs['summary'] = self.online_stats.summary()  # type: ignore
+
+        # 続きの実行や分岐ができるよう self.logs は内部の形式のまま残し、変換したコピーを返す
+        logs = materialize_logs(self.logs)
 
-        return self.logs
+        if self.compact_portfolio:
+            # 返り値のログは従来通り TypedDict 形式のポートフォリオとする
+            portfolio_logs_to_dict(logs)
+
+        if self.fixed_point:
+            # 0.1円単位の整数で記録した価格・価値を円に戻す
+            fixed_point_logs_to_yen(logs)
+
+        # 評価を省略した日のログは、返り値でその日を参照した時点で埋める（deferred_log.py）
+        defer_logs(logs, self, convert=True)
+        return logs
 
 
 class ExecuteAutoAdjustmentTransactionDynamicMulti(AutoAdjustmentTransactionDynamicMulti):
     def __init__(self, jct_portfolio: Dict[str, PortfolioWithPriorityItem], st_portfolio: Dict[str, PortfolioItem], start_date: date, end_date: date, options: TransactionOption) -> None:
         self.borrower = options['borrower'] if 'borrower' in options else "Borrower(A)"
         self.lender = options['lender'] if 'lender' in options else 'Lender(B)'
-        self.jct_portfolio = copy.deepcopy(jct_portfolio)
-        self.st_portfolio = copy.deepcopy(st_portfolio)
+        self.compact_portfolio = options['compact_portfolio'] if 'compact_portfolio' in options else False
+        self.fixed_point = options['fixed_point'] if 'fixed_point' in options else False
+        self.arith = get_arithmetic(self.fixed_point)
+        self.jct_portfolio = attach_portfolio(jct_portfolio, self.compact_portfolio, self.fixed_point)
+        self.st_portfolio = attach_portfolio(st_portfolio, self.compact_portfolio, self.fixed_point)
+        # 遅延を指定した場合は reference_delay 日前の価格で時価評価する
+        self.price_reference = LaggedPriceReference.create(options['reference_delay'] if 'reference_delay' in options else 0, (jct_portfolio, st_portfolio))
         self.borrower_loan_ratio = options['borrower_loan_ratio'] if 'borrower_loan_ratio' in options else 1.0
         self.lender_loan_ratio = options['lender_loan_ratio'] if 'lender_loan_ratio' in options else 1.0
         self.print_log = options['print_log'] if 'print_log' in options else False
@@ -230,36 +443,68 @@ class ExecuteAutoAdjustmentTransactionDynamicMulti(AutoAdjustmentTransactionDyna
         self.is_dummy_data = options['is_dummy_data'] if 'is_dummy_data' in options else False
         self.is_reverse = options['is_reverse'] if 'is_reverse' in options else False
         self.margin_call_threshold = options['margin_call_threshold'] if 'margin_call_threshold' in options else 0.0
-        self.collateral_portfolio: Dict[str, PortfolioWithPriorityItem] = {}
+        self.rebalance_band = options['rebalance_band'] if 'rebalance_band' in options else None
+        self.reference_delay = options['reference_delay'] if 'reference_delay' in options else 0
+        self.profile = options['profile'] if 'profile' in options else False
+        self.profiler = StepProfiler() if self.profile else NULL_PROFILER
+        # keep_logs が False の場合はステップごとのログを保持せず、集計値（logs['summary']）のみを残す
+        self.keep_logs = options['keep_logs'] if 'keep_logs' in options else True
+        online_stats = options['online_stats'] if 'online_stats' in options else False
+        self.online_stats = OnlineLogStats(self.arith.to_yen) if online_stats or not self.keep_logs else None
+        # トークン移動・価格更新を書き出す LedgerEventWriter（ledger.py）
+        self.ledger = options['ledger'] if 'ledger' in options else None
+        # price_band が True の場合は、価格がマージンコールの起こらないバンド内の日の評価を省略する（price_band.py）
+        self.price_band = options['price_band'] if 'price_band' in options else False
+        self.no_margin_call_band = None
+        self.deferred_steps: list = []
+        self.deferred_state = None
+        # memory_probe にステップ数を指定した場合は、そのステップごとにメモリ使用量を記録する（memory_probe.py）
+        memory_probe = options['memory_probe'] if 'memory_probe' in options else None
+        self.memory_probe = MemoryProbe(memory_probe) if memory_probe else None
+        # live_monitor にステップ数を指定した場合は、そのステップごとに新しいログを図に追加する（live_monitor.py）
+        live_monitor = options['live_monitor'] if 'live_monitor' in options else None
+        if live_monitor and not self.keep_logs:
+            raise ValueError('live_monitor requires keep_logs (the monitor reads the step logs).')
+        self.live_monitor = LiveMonitor(live_monitor) if live_monitor else None
+        self.collateral_portfolio: Dict[str, PortfolioWithPriorityItem] = CompactPortfolio(integer_prices=self.fixed_point) if self.compact_portfolio else {}  # type: ignore
         self.logs: Dict[str, list] = {}
         self.start_date = start_date
+        self.end_date = end_date
+        # 実行済みの最後の日付（execute(until) で途中まで実行した場合、続きはこの翌日から）
+        self.current_date = start_date
 
         pprint(f'JCT portfolio: {self.jct_portfolio}')
         pprint(f'ST portfolio: {self.st_portfolio}')
 
-        def date_range():
-            for n in range(int((end_date - start_date).days) - 1):
-                yield start_date + timedelta(n + 1)
+        self.initialize()
 
-        # 初日は初期化処理を含むため、2日目以降のgeneratorを作成
-        self.date_range = date_range
+    def date_range(self, until: Optional[date] = None):
+        # 初日は初期化処理を含むため、実行済みの日付の翌日から end_date の前日（until を指定した場合は until）まで
+        current_date = self.current_date
+        last_date = self.end_date - timedelta(1) if until is None else min(until, self.end_date - timedelta(1))
+        for n in range(int((last_date - current_date).days)):
+            yield current_date + timedelta(n + 1)
 
-        self.initialize()
+    def fork(self, options: Optional[TransactionOption] = None, end_date: Optional[date] = None):
+        """
+        実行済みの日付から分岐させた取引を返す（分岐時点までのログは copy-on-write で共有する）
+        """
+        return fork_transaction(self, options, end_date)
 
     def initialize(self):
-        st_total_value = update_portfolio_price(self.st_portfolio, self.start_date, self.print_log, is_dummy_data=self.is_dummy_data)
-        jct_total_value = update_portfolio_price(self.jct_portfolio, self.start_date, self.print_log, is_dummy_data=self.is_dummy_data)
-        necessary_collateral_value = st_total_value * self.lender_loan_ratio / self.borrower_loan_ratio
+        st_total_value = update_portfolio_price(self.st_portfolio, self.start_date, self.print_log, is_dummy_data=self.is_dummy_data, arith=self.arith, price_getter=self.price_reference)
+        jct_total_value = update_portfolio_price(self.jct_portfolio, self.start_date, self.print_log, is_dummy_data=self.is_dummy_data, arith=self.arith, price_getter=self.price_reference)
+        necessary_collateral_value = self.arith.necessary_value(st_total_value, self.lender_loan_ratio, self.borrower_loan_ratio)
         self.necessary_collateral_value = necessary_collateral_value
 
         # １トークンあたりの差し入れ必要金額
         collateral_type_num = len(self.jct_portfolio.keys())
-        necessary_each_collateral_value = math.ceil(necessary_collateral_value / collateral_type_num)
+        necessary_each_collateral_value = self.arith.ceil_div(necessary_collateral_value, collateral_type_num)
 
         # トークン毎に必要差し入れ金額になるように調整
         for code, collateral in self.jct_portfolio.items():
             pprint(f'{code}: {collateral}')
-            necessary_num = math.ceil(necessary_each_collateral_value / collateral['price'])
+            necessary_num = self.arith.ceil_div(necessary_each_collateral_value, collateral['price'])
             if (necessary_num > self.jct_portfolio[code]['num']):
                 # 不足
                 print("collateral num is short@@@@@@@@@")
@@ -272,10 +517,11 @@ class ExecuteAutoAdjustmentTransactionDynamicMulti(AutoAdjustmentTransactionDyna
                     'num': necessary_num,
                     'is_usd': collateral['is_usd'],
                     'price': collateral['price'],
-                    'priority': collateral['priority']
+                    'priority': collateral['priority'],
+                    **currency_item(collateral)
                 }
 
-        collateral_sum = update_portfolio_price(self.collateral_portfolio, self.start_date, self.print_log, is_dummy_data=self.is_dummy_data)
+        collateral_sum = update_portfolio_price(self.collateral_portfolio, self.start_date, self.print_log, is_dummy_data=self.is_dummy_data, arith=self.arith, price_getter=self.price_reference)
         self.logs['date'] = [self.start_date]
         self.logs['st_total_value'] = [st_total_value]
         self.logs['jct_total_value'] = [jct_total_value]
@@ -286,21 +532,82 @@ class ExecuteAutoAdjustmentTransactionDynamicMulti(AutoAdjustmentTransactionDyna
         self.logs['lender_additional_issue'] = [False]
         self.logs['borrower_additional_issue'] = [False]
         self.logs['has_done_margincall'] = [True]
+        self.logs['transfer_count'] = [len(self.collateral_portfolio)]
 
         self.initial_collateral_portfolio = copy.deepcopy(self.collateral_portfolio)
         self.logs['initial_collateral_portfolio'] = [copy.deepcopy(self.collateral_portfolio)]
+        self.update_online_stats()
+        if self.ledger is not None:
+            self.ledger.record_step(self, self.start_date, {})
 
         print('Transaction is created.')
         if self.print_log:
             pprint(self.logs)
 
-    def execute(self):
-        for _date in self.date_range():
-            print("@" * 80)
-            print(_date)
-            self.check_diff_and_margin_call(_date)
-            print("@" * 80)
+    def execute(self, until: Optional[date] = None):
+        """
+        until を指定した場合は until までを実行する（続きは再度 execute() を呼ぶか、fork() で分岐させて実行する）
+        """
+        if self.memory_probe is not None:
+            self.memory_probe.start()
+        with self.profiler.capture_print():
+            for _date in self.date_range(until):
+                self.profiler.start()
+                # 当日分（未取得の場合）と翌日分の価格取得を並行して開始しておく
+                portfolios = (self.st_portfolio, self.jct_portfolio, self.collateral_portfolio)
+                prefetch_portfolio_price(portfolios, _date)
+                prefetch_portfolio_price(portfolios, _date + timedelta(1))
+                print("@" * 80)
+                print(_date)
+                before = {code: collateral['num'] for code, collateral in self.collateral_portfolio.items()} if self.ledger is not None else None
+                if self.is_in_no_margin_call_band(_date):
+                    # バンド内の日は閾値内となるため評価を省略し、ログは参照された時点で埋める
+                    self.defer_step(_date)
+                else:
+                    self.check_diff_and_margin_call(_date)
+                    self.update_no_margin_call_band()
+                self.current_date = _date
+                if self.ledger is not None:
+                    self.ledger.record_step(self, _date, before)
+                print("@" * 80)
+                self.profiler.finish_step()
+                if self.memory_probe is not None:
+                    self.memory_probe.sample((_date - self.start_date).days, self.memory_structures())
+                if self.live_monitor is not None:
+                    self.live_monitor.update((_date - self.start_date).days, self.logs, self.arith.to_yen)
 
         print("Finished!!!!")
-
-        return self.logs
+        self.sync_deferred_state()
+        if self.live_monitor is not None:
+            # 評価を省略した日を含めて描き直すため、先にログを埋める
+            self.fill_deferred_logs()
+            self.live_monitor.finish(self.logs, self.arith.to_yen)
+
+        if self.memory_probe is not None:
+            # 終了時点の状態を記録し、ログに添付する
+            self.memory_probe.sample((self.current_date - self.start_date).days, self.memory_structures(), force=True)
+            self.memory_probe.stop()
+            self.logs['memory'] = self.memory_probe.summary()  # type: ignore
+
+        if self.profile:
+            # フェーズ別の計測結果をログに添付する（profiler.summarize_profiles で集計可能）
+            self.logs['profile'] = self.profiler.summary()  # type: ignore
+
+        if self.online_stats is not None:
+            # ステップごとに更新した集計値（LogVisualizer の calc_* と同じ値）
+            self.logs['summary'] = self.online_stats.summary()  # type: ignore
+
+        # 続きの実行や分岐ができるよう self.logs は内部の形式のまま残し、変換したコピーを返す
+        logs = materialize_logs(self.logs)
+
+        if self.compact_portfolio:
+            # 返り値のログは従来通り TypedDict 形式のポートフォリオとする
+            portfolio_logs_to_dict(logs)
+
+        if self.fixed_point:
+            # 0.1円単位の整数で記録した価格・価値を円に戻す
+            fixed_point_logs_to_yen(logs)
+
+        # 評価を省略した日のログは、返り値でその日を参照した時点で埋める（deferred_log.py）
+        defer_logs(logs, self, convert=True)
+        return logs
@@ -0,0 +1,305 @@
+"""
+実験結果（execute() の返り値のログ）の保存先
+各実行（run）をシナリオ・モデル・オプション・期間とともに SQLite の索引に登録し、ログは項目ごとの .npy（列）として保存する
+集計時は必要な列のみをメモリマップで読み込むため、モデル間の比較でもログ全体は読み込まない
+
+ex.)
+    store = ExperimentStore('./experiment_store')
+    store.import_legacy('./sandbox/experiments/data0117')
+    store.aggregate('price_diff', 'max', by='model', scenario=2)  # => {0: ..., 1: ..., ...}
+"""
+from datetime import date, datetime
+import json
+import os
+import re
+import shutil
+import sqlite3
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 日ごとの値のログ
+SERIES_KEYS = (
+    'date',
+    'st_total_value',
+    'jct_total_value',
+    'necessary_collateral_value',
+    'collateral_sum',
+    'lender_additional_issue',
+    'borrower_additional_issue',
+    'has_done_margincall',
+)
+# 日ごとのポートフォリオのログ（{key}.num, {key}.price の (日数 × 銘柄数) の列として保存する）
+PORTFOLIO_KEYS = ('jct_portfolio', 'collateral_portfolio', 'initial_collateral_portfolio')
+# 旧形式のファイル名（s{シナリオ}_m{モデル}.npy, s{シナリオ}_m{モデル}_{番号}.npy）
+LEGACY_FILE_PATTERN = re.compile(r'^s(\d+)_m(\d+)(?:_(\w+))?\.npy$')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    scenario INTEGER,
+    model INTEGER,
+    variant TEXT,
+    source TEXT,
+    options TEXT NOT NULL,
+    start_date TEXT,
+    end_date TEXT,
+    steps INTEGER NOT NULL,
+    codes TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_scenario_model ON runs (scenario, model);
+"""
+RUN_FIELDS = ('id', 'scenario', 'model', 'variant', 'source', 'options', 'start_date', 'end_date', 'steps', 'codes', 'created_at')
+
+
+def _portfolio_columns(portfolios: Sequence[dict]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """
+    ポートフォリオのリストを (銘柄コード, 数量の列, 価格の列) にする
+    途中で現れる銘柄があるため、銘柄コードは全日の和集合とし、保有していない日の数量は 0、価格は NaN とする
+    """
+    codes: List[str] = []
+    index: Dict[str, int] = {}
+    for portfolio in portfolios:
+        for code in portfolio:
+            if code not in index:
+                index[code] = len(codes)
+                codes.append(code)
+    nums = np.zeros((len(portfolios), len(codes)), dtype=np.float64)
+    prices = np.full((len(portfolios), len(codes)), np.nan, dtype=np.float64)
+    for i, portfolio in enumerate(portfolios):
+        for code, security in portfolio.items():
+            nums[i, index[code]] = security['num']
+            prices[i, index[code]] = security['price'] if 'price' in security else np.nan
+    return codes, nums, prices
+
+
+def _series_column(key: str, values: Sequence[Any]) -> np.ndarray:
+    if key == 'date':
+        return np.array(values, dtype='datetime64[D]')
+    if key in ('lender_additional_issue', 'borrower_additional_issue', 'has_done_margincall'):
+        return np.array(values, dtype=np.bool_)
+    return np.array(values, dtype=np.float64)
+
+
+def _price_diff(run: 'StoredRun') -> np.ndarray:
+    """
+    必要担保価値と差入担保価値の差の絶対値（LogVisualizer.collateral_price_diff_list と同じ値）
+    """
+    return np.abs(run['necessary_collateral_value'] - _collateral_value(run))
+
+
+def _collateral_value(run: 'StoredRun') -> np.ndarray:
+    nums = run['collateral_portfolio.num']
+    prices = np.nan_to_num(run['collateral_portfolio.price'])
+    return (nums * prices).sum(axis=1)
+
+
+def _token_diff(run: 'StoredRun') -> np.ndarray:
+    """
+    差入担保の数量合計の前日からの増減の絶対値（初日は 0。LogVisualizer.calc_token_diff と同じ値）
+    """
+    token_num = run['collateral_portfolio.num'].sum(axis=1)
+    return np.concatenate(([0.0], np.abs(np.diff(token_num)))) if len(token_num) else token_num
+
+
+# 保存した列から求める項目
+DERIVED_COLUMNS: Dict[str, Callable[['StoredRun'], np.ndarray]] = {
+    'price_diff': _price_diff,
+    'collateral_value': _collateral_value,
+    'token_diff': _token_diff,
+}
+
+REDUCERS: Dict[str, Callable[[np.ndarray], Any]] = {
+    'max': np.max,
+    'min': np.min,
+    'mean': np.mean,
+    'sum': np.sum,
+    'count': len,
+}
+
+
+class StoredRun(object):
+    """
+    保存した1回分の実行結果
+    列は初めて参照したときにメモリマップで開き、以降は同じ配列を返す
+    """
+
+    def __init__(self, record: Dict[str, Any], run_dir: str) -> None:
+        self.record = record
+        self.run_dir = run_dir
+        self.codes: Dict[str, List[str]] = record['codes']
+        self._columns: Dict[str, np.ndarray] = {}
+
+    def __getitem__(self, field: str) -> np.ndarray:
+        if field in DERIVED_COLUMNS:
+            return DERIVED_COLUMNS[field](self)
+        if field not in self._columns:
+            path = os.path.join(self.run_dir, f'{field}.npy')
+            if not os.path.exists(path):
+                raise KeyError(f'{field} is not stored in run {self.record["id"]}.')
+            self._columns[field] = np.load(path, mmap_mode='r')
+        return self._columns[field]
+
+    def loaded_columns(self) -> List[str]:
+        return list(self._columns)
+
+    def to_logs(self) -> Dict[str, list]:
+        """
+        execute() の返り値と同じ形式のログに戻す（価格のない銘柄は除く）
+        """
+        logs: Dict[str, list] = {}
+        for key in SERIES_KEYS:
+            if not os.path.exists(os.path.join(self.run_dir, f'{key}.npy')):
+                continue
+            values = self[key]
+            logs[key] = [value.astype(date) for value in values] if key == 'date' else values.tolist()
+        for key in PORTFOLIO_KEYS:
+            if key not in self.codes:
+                continue
+            nums, prices = self[f'{key}.num'], self[f'{key}.price']
+            logs[key] = [
+                {code: {'num': nums[i, j].item(), 'price': prices[i, j].item()} for j, code in enumerate(self.codes[key]) if not np.isnan(prices[i, j])}
+                for i in range(len(nums))
+            ]
+        return logs
+
+
+class ExperimentStore(object):
+    """
+    root 以下に索引（index.sqlite）と各実行の列（runs/{id}/{項目}.npy）を保存する
+    """
+
+    def __init__(self, root: str = 'experiment_store') -> None:
+        self.root = root
+        os.makedirs(os.path.join(root, 'runs'), exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(root, 'index.sqlite'))
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def _run_dir(self, run_id: int) -> str:
+        return os.path.join(self.root, 'runs', str(run_id))
+
+    def add_run(self, logs: Dict[str, Any], scenario: Optional[int] = None, model: Optional[int] = None, options: Optional[dict] = None,
+                variant: Optional[str] = None, source: Optional[str] = None) -> int:
+        """
+        ログを列に分けて保存し、索引に登録した実行の id を返す
+        """
+        dates = logs['date'] if 'date' in logs else []
+        portfolio_columns = {key: _portfolio_columns(logs[key]) for key in PORTFOLIO_KEYS if key in logs}
+        codes = {key: columns[0] for key, columns in portfolio_columns.items()}
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO runs (scenario, model, variant, source, options, start_date, end_date, steps, codes, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (scenario, model, variant, source, json.dumps(options or {}, sort_keys=True, default=str),
+                 dates[0].isoformat() if dates else None, dates[-1].isoformat() if dates else None, len(dates),
+                 json.dumps(codes), datetime.now().isoformat()))
+            run_id = cursor.lastrowid
+            run_dir = self._run_dir(run_id)
+            os.makedirs(run_dir, exist_ok=True)
+            try:
+                for key in SERIES_KEYS:
+                    if key in logs:
+                        np.save(os.path.join(run_dir, f'{key}.npy'), _series_column(key, logs[key]))
+                for key, (_, nums, prices) in portfolio_columns.items():
+                    np.save(os.path.join(run_dir, f'{key}.num.npy'), nums)
+                    np.save(os.path.join(run_dir, f'{key}.price.npy'), prices)
+            except Exception:
+                # 索引の登録は取り消されるため、書きかけの列も削除する
+                shutil.rmtree(run_dir, ignore_errors=True)
+                raise
+        return run_id
+
+    def import_legacy(self, dir_path: str, source: Optional[str] = None) -> List[int]:
+        """
+        旧形式の s{n}_m{k}.npy（np.save したログの dict）を読み込んで登録する
+        source は既定でディレクトリ名（data0117 など）とし、同じ source が登録済みのファイルは読み込まない
+        """
+        source = source or os.path.basename(os.path.normpath(dir_path))
+        imported = {row['variant'] for row in self.runs(source=source)}
+        run_ids = []
+        for filename in sorted(os.listdir(dir_path)):
+            if not filename.endswith('.npy'):
+                continue
+            match = LEGACY_FILE_PATTERN.match(filename)
+            variant = filename[:-4]
+            if variant in imported:
+                continue
+            logs = np.load(os.path.join(dir_path, filename), allow_pickle=True).item()
+            if match:
+                scenario, model = int(match.group(1)), int(match.group(2))
+            else:
+                # all_term.npy など、シナリオ・モデルを含まないファイル
+                scenario, model = None, None
+            run_ids.append(self.add_run(logs, scenario=scenario, model=model, variant=variant, source=source))
+        return run_ids
+
+    def runs(self, run_id: Optional[int] = None, scenario: Optional[int] = None, model: Optional[int] = None, source: Optional[str] = None,
+             variant: Optional[str] = None, options: Optional[dict] = None, start_date: Optional[date] = None,
+             end_date: Optional[date] = None) -> List[Dict[str, Any]]:
+        """
+        条件に合う実行の索引の一覧
+        options は指定した項目がすべて一致するもの、start_date, end_date は期間が重なるものを返す
+        """
+        conditions, params = [], []
+        for column, value in (('id', run_id), ('scenario', scenario), ('model', model), ('source', source), ('variant', variant)):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        if start_date is not None:
+            conditions.append('end_date >= ?')
+            params.append(start_date.isoformat())
+        if end_date is not None:
+            conditions.append('start_date <= ?')
+            params.append(end_date.isoformat())
+        query = f'SELECT {", ".join(RUN_FIELDS)} FROM runs'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY id'
+
+        records = []
+        for row in self.connection.execute(query, params):
+            record = dict(zip(RUN_FIELDS, row))
+            record['options'] = json.loads(record['options'])
+            record['codes'] = json.loads(record['codes'])
+            if options and any(record['options'].get(key) != value for key, value in options.items()):
+                continue
+            records.append(record)
+        return records
+
+    def open(self, run_id: int) -> StoredRun:
+        records = self.runs(run_id=run_id)
+        if not records:
+            raise ValueError(f'Run {run_id} does not exist.')
+        return StoredRun(records[0], self._run_dir(run_id))
+
+    def select(self, **conditions) -> List[StoredRun]:
+        return [StoredRun(record, self._run_dir(record['id'])) for record in self.runs(**conditions)]
+
+    def aggregate(self, field: str, reducer: str = 'max', by: str = 'model', **conditions) -> Dict[Any, Any]:
+        """
+        条件に合う実行の field を by（scenario, model, source, variant など）ごとに連結し、reducer（max, min, mean, sum, count）で集計する
+        ex.) store.aggregate('price_diff', 'max', by='model', scenario=2)
+        """
+        if reducer not in REDUCERS:
+            raise ValueError(f'reducer must be one of {list(REDUCERS)}: {reducer}')
+        if by not in RUN_FIELDS:
+            raise ValueError(f'by must be one of {RUN_FIELDS}: {by}')
+        groups: Dict[Any, List[np.ndarray]] = {}
+        for run in self.select(**conditions):
+            groups.setdefault(run.record[by], []).append(np.asarray(run[field]))
+        result = {}
+        for key, columns in groups.items():
+            values = np.concatenate(columns) if len(columns) > 1 else columns[0]
+            reduced = REDUCERS[reducer](values)
+            result[key] = reduced.item() if isinstance(reduced, np.generic) else reduced
+        return result
+
+    def delete(self, run_ids: Iterable[int]) -> None:
+        with self.connection:
+            for run_id in run_ids:
+                self.connection.execute('DELETE FROM runs WHERE id = ?', (run_id,))
+                shutil.rmtree(self._run_dir(run_id), ignore_errors=True)
@@ -0,0 +1,124 @@
+"""
+価格・価値を整数の固定小数点で扱うための演算
+option['fixed_point'] が True の場合、価格と価値は 0.1円単位の整数（ticks）、JCT の価格は 1e-6円単位の整数で計算する
+浮動小数点の丸め誤差による計算順序への依存がなくなり、ベクトル化した実装と結果を完全に一致させて比較できる
+ログの価格・価値は取引の内部では ticks のまま記録し、取引の外に返す時点（execute() の返り値・JCTVariableTransaction.get_logs()）でのみ円に戻す
+"""
+import math
+from typing import Dict, List, Optional, Union
+
+from .lazy_module import LazyModule
+
+# to_prices（配列での価格更新）を使うまで numpy は読み込まない
+np = LazyModule('numpy')
+
+# 1円あたりの ticks（価格は 0.1円単位で切り捨てる）
+PRICE_SCALE = 10
+# JCT の価格の単位（1e-6円単位で切り捨てる）
+JCT_PRICE_SCALE = 1000000
+# 貸付比率・閾値の単位（1e-6 単位に丸める）
+RATIO_SCALE = 1000000
+
+# 価値（ticks）として記録されるログの項目
+VALUE_LOG_KEYS = ['st_total_value', 'jct_total_value', 'collateral_sum', 'necessary_collateral_value']
+PORTFOLIO_LOG_KEYS = ['jct_portfolio', 'collateral_portfolio', 'initial_collateral_portfolio']
+
+
+def ceil_div(numerator, denominator):
+    """
+    整数の切り上げ除算（int と numpy の整数配列のどちらにも使える）
+    """
+    return -((-numerator) // denominator)
+
+
+def ratio_to_ppm(ratio: float) -> int:
+    return round(ratio * RATIO_SCALE)
+
+
+class FloatArithmetic(object):
+    """
+    従来通りの浮動小数点での計算
+    """
+    is_fixed_point = False
+
+    def to_price(self, raw_price: float) -> float:
+        return math.floor(raw_price * 10) / 10
+
+    def to_prices(self, raw_prices: 'np.ndarray') -> 'np.ndarray':
+        """
+        to_price の配列版（要素ごとに to_price と同じ値になる）
+        """
+        return np.floor(raw_prices * 10) / 10
+
+    def ceil_div(self, value, price) -> int:
+        return math.ceil(value / price)
+
+    def necessary_value(self, st_total_value, lender_loan_ratio: float, borrower_loan_ratio: float):
+        return st_total_value * lender_loan_ratio / borrower_loan_ratio
+
+    def is_within_threshold(self, collateral_diff, necessary_collateral_value, margin_call_threshold: float) -> bool:
+        return abs(collateral_diff) < necessary_collateral_value * margin_call_threshold
+
+    def to_yen(self, value) -> float:
+        return value
+
+
+class FixedPointArithmetic(object):
+    """
+    価格・価値を 0.1円単位の整数（ticks）で計算する
+    必要担保額は貸し手が不足しないよう切り上げる
+    """
+    is_fixed_point = True
+
+    def to_price(self, raw_price: float) -> int:
+        return math.floor(raw_price * PRICE_SCALE)
+
+    def to_prices(self, raw_prices: 'np.ndarray') -> 'np.ndarray':
+        return np.floor(raw_prices * PRICE_SCALE).astype(np.int64)
+
+    def ceil_div(self, value: int, price: int) -> int:
+        return ceil_div(value, price)
+
+    def necessary_value(self, st_total_value: int, lender_loan_ratio: float, borrower_loan_ratio: float) -> int:
+        return ceil_div(st_total_value * ratio_to_ppm(lender_loan_ratio), ratio_to_ppm(borrower_loan_ratio))
+
+    def is_within_threshold(self, collateral_diff: int, necessary_collateral_value: int, margin_call_threshold: float) -> bool:
+        return abs(collateral_diff) * RATIO_SCALE < necessary_collateral_value * ratio_to_ppm(margin_call_threshold)
+
+    def to_yen(self, value: int) -> float:
+        return value / PRICE_SCALE
+
+
+Arithmetic = Union[FloatArithmetic, FixedPointArithmetic]
+
+FLOAT_ARITHMETIC = FloatArithmetic()
+FIXED_POINT_ARITHMETIC = FixedPointArithmetic()
+
+
+def get_arithmetic(fixed_point: Optional[bool]) -> Arithmetic:
+    return FIXED_POINT_ARITHMETIC if fixed_point else FLOAT_ARITHMETIC
+
+
+def ticks_to_yen_portfolio(portfolio: dict) -> dict:
+    return {code: dict(item, price=item['price'] / PRICE_SCALE) for code, item in portfolio.items()}
+
+
+def fixed_point_logs_to_yen(logs: Dict[str, list]) -> Dict[str, list]:
+    """
+    ticks で記録したログの価格・価値を円に戻す（ログ自体を書き換えて返す）
+    評価を省略した日の値（None）はそのままとする（deferred_log.py で埋める際に変換する）
+    """
+    for key in VALUE_LOG_KEYS:
+        if key in logs:
+            logs[key] = [value / PRICE_SCALE if value is not None else None for value in logs[key]]
+    for key in PORTFOLIO_LOG_KEYS:
+        if key in logs:
+            logs[key] = [ticks_to_yen_portfolio(portfolio) if portfolio is not None else None for portfolio in logs[key]]
+    return logs
+
+
+def fixed_point_rows_to_yen(rows: List[dict]) -> List[dict]:
+    """
+    fixed_point_logs_to_yen の1日1行（dict のリスト）のログ版（元のログは書き換えず、変換した複製を返す）
+    """
+    return [dict(row, **{key: row[key] / PRICE_SCALE for key in VALUE_LOG_KEYS if key in row}) for row in rows]
@@ -0,0 +1,188 @@
+"""
+取引の状態を途中から分岐（fork）させるための処理
+分岐時点までのログは親子で共有し（copy-on-write）、分岐後に追加したログのみを各取引が保持する
+
+ex.)
+    transaction = ExecuteAutoAdjustmentTransactionMulti(jct_portfolio, st_portfolio, start_date, end_date, {})
+    transaction.execute(until=date(2022, 6, 1))
+    reverse = transaction.fork({'is_reverse': True})
+    logs = transaction.execute()
+    reverse_logs = reverse.execute()
+"""
+from collections.abc import MutableSequence
+import copy
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from .inventory import InventoryPortfolio
+from .live_monitor import LiveMonitor
+from .memory_probe import MemoryProbe
+from .profiler import NULL_PROFILER, StepProfiler
+from .types import TransactionOption
+
+# 分岐時に変更できるオプション（ポートフォリオの表現や価格の参照方法に関わるものは変更できない）
+FORKABLE_OPTIONS = (
+    'borrower_loan_ratio',
+    'lender_loan_ratio',
+    'print_log',
+    'auto_deposit',
+    'is_dummy_data',
+    'is_reverse',
+    'is_manual',
+    'margin_call_threshold',
+    'rebalance_band',
+)
+
+# 取引ごとに複製する状態（小さいポートフォリオのため分岐時にコピーする）
+STATE_PORTFOLIOS = ('jct_portfolio', 'st_portfolio', 'collateral_portfolio', 'initial_collateral_portfolio')
+
+
+class CowLog(MutableSequence):
+    """
+    分岐時点までの要素（prefix）を他の取引と共有し、以降に追加した要素（tail）のみを保持するリスト
+    prefix の要素を書き換える場合は、その時点で prefix を複製する
+    """
+    __slots__ = ('_prefix', '_prefix_len', '_tail')
+
+    def __init__(self, prefix: Union[List[Any], 'CowLog'], prefix_len: Optional[int] = None) -> None:
+        self._prefix = prefix
+        self._prefix_len = len(prefix) if prefix_len is None else prefix_len
+        self._tail: List[Any] = []
+
+    def __len__(self) -> int:
+        return self._prefix_len + len(self._tail)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('CowLog index out of range')
+        if i < self._prefix_len:
+            return self._prefix[i]
+        return self._tail[i - self._prefix_len]
+
+    def __setitem__(self, i, value) -> None:
+        if isinstance(i, int):
+            if i < 0:
+                i += len(self)
+            if self._prefix_len <= i < len(self):
+                # 分岐後に追加した要素は共有していないため、そのまま書き換える
+                self._tail[i - self._prefix_len] = value
+                return
+        items = self.to_list()
+        items[i] = value
+        self._prefix, self._prefix_len, self._tail = items, len(items), []
+
+    def __delitem__(self, i) -> None:
+        items = self.to_list()
+        del items[i]
+        self._prefix, self._prefix_len, self._tail = items, len(items), []
+
+    def insert(self, i: int, value) -> None:
+        if i >= len(self):
+            self._tail.append(value)
+            return
+        items = self.to_list()
+        items.insert(i, value)
+        self._prefix, self._prefix_len, self._tail = items, len(items), []
+
+    def append(self, value) -> None:
+        self._tail.append(value)
+
+    def __iter__(self):
+        for i in range(self._prefix_len):
+            yield self._prefix[i]
+        yield from self._tail
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (list, CowLog)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        return repr(self.to_list())
+
+    def to_list(self) -> List[Any]:
+        items = self._prefix[:self._prefix_len]
+        items.extend(self._tail)
+        return items
+
+    def shared_len(self) -> int:
+        """
+        他の取引と共有している要素数
+        """
+        return self._prefix_len
+
+
+def fork_logs(logs: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    ログを親と子の2つに分ける
+    各リストはそのまま共有の prefix とし、以降の追加は親子それぞれの CowLog に記録する
+    """
+    parent: Dict[str, Any] = {}
+    child: Dict[str, Any] = {}
+    for key, values in logs.items():
+        if isinstance(values, (list, CowLog)):
+            # 親が追加を続けても prefix が変わらないよう、親も CowLog に置き換える
+            parent[key] = CowLog(values)
+            child[key] = CowLog(values)
+        else:
+            parent[key] = values
+            child[key] = values
+    return parent, child
+
+
+def materialize_logs(logs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    CowLog を通常の list に戻したログを返す（execute() の返り値用。元のログは変更しない）
+    """
+    return {key: values.to_list() if isinstance(values, CowLog) else values for key, values in logs.items()}
+
+
+def fork_transaction(transaction, options: Optional[TransactionOption] = None, end_date: Optional[date] = None):
+    """
+    transaction を実行済みの日付（current_date）から分岐させた取引を返す
+    options で FORKABLE_OPTIONS の値を、end_date で終了日を変更できる
+    """
+    if options is None:
+        options = {}
+    invalid = [key for key in options if key not in FORKABLE_OPTIONS]
+    if invalid:
+        raise ValueError(f'{invalid} cannot be changed by fork(). Available options: {FORKABLE_OPTIONS}')
+    if isinstance(transaction.jct_portfolio, InventoryPortfolio):
+        raise ValueError('A transaction sharing an inventory (TransactionBook) cannot be forked.')
+    if end_date is not None and end_date <= transaction.current_date:
+        raise ValueError(f'end_date must be after the current date: {end_date} <= {transaction.current_date}')
+
+    # 評価を省略した日のログは分岐前に埋めておく
+    transaction.fill_deferred_logs()
+    child = copy.copy(transaction)
+    transaction.logs, child.logs = fork_logs(transaction.logs)
+    for name in STATE_PORTFOLIOS:
+        setattr(child, name, copy.deepcopy(getattr(transaction, name)))
+    if transaction.price_reference is not None:
+        child.price_reference = transaction.price_reference.copy()
+    child.profiler = StepProfiler() if child.profile else NULL_PROFILER
+    if transaction.online_stats is not None:
+        child.online_stats = copy.deepcopy(transaction.online_stats)
+    # 分岐した取引の移動は実際には行われないため、ledger には書き出さない
+    child.ledger = None
+    # 分岐後はオプションが変わりうるため、バンドは次の評価で求め直す
+    child.no_margin_call_band = None
+    child.deferred_steps = []
+    child.deferred_state = None
+    if transaction.memory_probe is not None:
+        child.memory_probe = MemoryProbe(transaction.memory_probe.interval)
+    if transaction.live_monitor is not None:
+        # 分岐した取引は別の図に描画する（初回の更新で分岐前のログも含めて描画する）
+        child.live_monitor = LiveMonitor(transaction.live_monitor.interval)
+
+    for key, value in options.items():
+        setattr(child, key, value)
+    if end_date is not None:
+        child.end_date = end_date
+    return child
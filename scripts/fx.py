@@ -0,0 +1,130 @@
+"""
+保有有価証券の通貨と、(通貨 × 日付) の対円レート
+- 通貨は保有有価証券の 'currency'（'EUR' など）で指定する。省略した場合は従来通り is_usd から USD / JPY とする
+- 通貨はプロセス内で登録順の id（JPY=0, USD=1, 以降は初めて現れた順）を持ち、CompactPortfolio などは id の配列で保持する
+- レートは株価取得クラスごとの FXTable に日付単位でキャッシュし、1日につき通貨ごとに1回だけ取得する
+  株価取得クラスの返す価格は日付ごとに不変とみなす（価格を差し替えた場合は clear_fx_tables() で破棄する）
+  USD は get_usdjpy_close、それ以外は '{通貨}JPY=X'（EURJPY=X など）の終値を用いる
+
+ex.)
+    jct_portfolio = {'SAP.DE': {'num': 100, 'priority': 1, 'is_usd': False, 'currency': 'EUR'}, ...}
+"""
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+import weakref
+
+CURRENCY_JPY = 0
+CURRENCY_USD = 1
+USDJPY_CODE = 'JPY=X'
+
+# id 順の通貨コード
+CURRENCIES: List[str] = ['JPY', 'USD']
+_currency_ids: Dict[str, int] = {'JPY': CURRENCY_JPY, 'USD': CURRENCY_USD}
+
+
+def currency_id(currency: str) -> int:
+    """
+    通貨の id（未登録の通貨は登録する）
+    """
+    cid = _currency_ids.get(currency)
+    if cid is None:
+        if len(currency) != 3 or not currency.isalpha() or not currency.isupper():
+            raise ValueError(f'currency must be an ISO 4217 code such as "EUR": {currency}')
+        cid = len(CURRENCIES)
+        CURRENCIES.append(currency)
+        _currency_ids[currency] = cid
+    return cid
+
+
+def currency_of(item: Mapping) -> str:
+    """
+    保有有価証券の通貨（'currency' がない、または None の場合は is_usd から決める）
+    """
+    currency = item['currency'] if 'currency' in item else None
+    if currency is not None:
+        return currency
+    return 'USD' if item['is_usd'] else 'JPY'
+
+
+def currency_item(item: Mapping) -> Dict[str, str]:
+    """
+    item を元に新しい保有有価証券を作る際に引き継ぐ 'currency'
+    is_usd で表せる通貨（JPY / USD）の場合は従来の形式のまま（空の dict）とする
+    """
+    currency = currency_of(item)
+    return {} if currency in ('JPY', 'USD') else {'currency': currency}
+
+
+def fx_code(currency: str) -> Optional[str]:
+    """
+    通貨の対円レートの銘柄コード（JPY は None）
+    """
+    if currency == 'JPY':
+        return None
+    if currency == 'USD':
+        return USDJPY_CODE
+    return f'{currency}JPY=X'
+
+
+def fx_codes(currencies=None) -> List[str]:
+    """
+    登録済み（または currencies で指定した）通貨の対円レートの銘柄コード
+    """
+    return [code for code in (fx_code(currency) for currency in (currencies if currencies is not None else CURRENCIES)) if code is not None]
+
+
+class FXTable(object):
+    """
+    株価取得クラス price_getter から取得した (日付 × 通貨 id) の対円レート
+    rates(date) は id 順のレートのリストで、その日に初めて参照した時点で登録済みの全通貨を1回ずつ取得する
+    """
+
+    def __init__(self, price_getter) -> None:
+        self.price_getter = price_getter
+        self._rates: Dict[Tuple[Any, bool], List[float]] = {}
+
+    def _fetch(self, currency: str, date, is_local: bool) -> float:
+        if currency == 'JPY':
+            return 1.0
+        if currency == 'USD':
+            return self.price_getter.get_usdjpy_close(date, is_local=is_local)
+        return self.price_getter.get_close_price(fx_code(currency), date, is_local=is_local)
+
+    def rates(self, date, is_local: bool = False) -> List[float]:
+        key = (date, is_local)
+        rates = self._rates.get(key)
+        if rates is None:
+            rates = []
+            self._rates[key] = rates
+        # 前回の参照以降に登録された通貨のみ追加で取得する
+        for cid in range(len(rates), len(CURRENCIES)):
+            rates.append(self._fetch(CURRENCIES[cid], date, is_local))
+        return rates
+
+    def rate(self, currency: str, date, is_local: bool = False) -> float:
+        cid = currency_id(currency)
+        return self.rates(date, is_local)[cid]
+
+
+_fx_tables: 'weakref.WeakKeyDictionary[Any, FXTable]' = weakref.WeakKeyDictionary()
+
+
+def get_fx_table(price_getter) -> FXTable:
+    """
+    price_getter の FXTable（株価取得クラスごとに1つ作成し、株価取得クラスが破棄されると破棄される）
+    """
+    try:
+        table = _fx_tables.get(price_getter)
+    except TypeError:
+        # 弱参照・ハッシュに対応しない株価取得クラスはキャッシュしない
+        return FXTable(price_getter)
+    if table is None:
+        table = FXTable(price_getter)
+        _fx_tables[price_getter] = table
+    return table
+
+
+def clear_fx_tables() -> None:
+    """
+    キャッシュした対円レートを全て破棄する（set_price_getter で株価取得クラスを差し替えた場合にも呼ばれる）
+    """
+    _fx_tables.clear()
@@ -0,0 +1,320 @@
+"""
+分足を用いた日中（高頻度）のマージンコール
+AutoAdjustmentTransactionMulti と同じ優先度順の価格調整を、IntradayPriceData の各足（または interval ごと）に行う
+- 閾値内に収まるステップは配列演算でまとめて判定し、価格調整が必要なステップのみ逐次処理する
+- ログは直近 log_size ステップ分のリングバッファと集計値のみを保持し、ステップ数によらずメモリは一定
+"""
+from collections import deque
+from datetime import datetime, timedelta
+import math
+from operator import mul
+from typing import Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .fixed_point import PRICE_SCALE, get_arithmetic
+from .fx import currency_of, fx_code
+from .price_data.intraday_price import IntradayPriceData, Timestamp
+from .types import PortfolioItem, PortfolioWithPriorityItem, TransactionOption
+
+
+class IntradayRingLog(object):
+    """
+    直近 size ステップ分のログを保持するリングバッファ
+    """
+    VALUE_KEYS = ('st_total_value', 'collateral_sum', 'necessary_collateral_value')
+    FLAG_KEYS = ('has_done_margincall', 'borrower_additional_issue')
+
+    def __init__(self, size: int, value_dtype) -> None:
+        if size <= 0:
+            raise ValueError(f'log_size must be positive: {size}')
+        self.size = size
+        self.count = 0
+        self.timestamps = np.zeros(size, dtype='datetime64[s]')
+        self.values = {key: np.zeros(size, dtype=value_dtype) for key in self.VALUE_KEYS}
+        self.flags = {key: np.zeros(size, dtype=bool) for key in self.FLAG_KEYS}
+
+    def extend(self, timestamps: np.ndarray, st_total_value: np.ndarray, collateral_sum: np.ndarray, necessary_collateral_value: np.ndarray,
+               has_done_margincall: np.ndarray, borrower_additional_issue: np.ndarray) -> None:
+        n = len(timestamps)
+        if n == 0:
+            return
+        # 保持できる分（末尾の size ステップ）のみ書き込む
+        skip = max(0, n - self.size)
+        positions = (self.count + skip + np.arange(n - skip)) % self.size
+        self.timestamps[positions] = timestamps[skip:]
+        self.values['st_total_value'][positions] = st_total_value[skip:]
+        self.values['collateral_sum'][positions] = collateral_sum[skip:]
+        self.values['necessary_collateral_value'][positions] = necessary_collateral_value[skip:]
+        self.flags['has_done_margincall'][positions] = has_done_margincall[skip:]
+        self.flags['borrower_additional_issue'][positions] = borrower_additional_issue[skip:]
+        self.count += n
+
+    def to_dict(self, to_yen) -> Dict[str, list]:
+        """
+        古い順に並べたログを Execute* の logs と同じ項目名で返す
+        """
+        n = min(self.count, self.size)
+        order = (self.count - n + np.arange(n)) % self.size
+        logs: Dict[str, list] = {'date': self.timestamps[order].astype(datetime).tolist()}
+        for key in self.VALUE_KEYS:
+            logs[key] = [to_yen(value) for value in self.values[key][order].tolist()]
+        for key in self.FLAG_KEYS:
+            logs[key] = self.flags[key][order].tolist()
+        return logs
+
+
+class IntradayMarginCall(object):
+    """
+    分足の各ステップで AutoAdjustmentTransactionMulti と同じ価格調整を行う
+    ex.)
+        price_data = IntradayPriceData.from_csv_dir('./minute_bars')
+        engine = IntradayMarginCall(jct_portfolio, st_portfolio, {'margin_call_threshold': 0.01}, price_data)
+        result = engine.run(datetime(2022, 1, 1), datetime(2023, 1, 1))
+        result['margin_call_count'], result['logs']['collateral_sum'][-10:]
+    """
+    # 閾値判定をまとめて行う最初のステップ数（価格調整のないステップが続く間は倍々に広げる）
+    INITIAL_WINDOW = 16
+    # 価格を円換算しておくステップ数
+    CHUNK_SIZE = 8192
+
+    def __init__(self, jct_portfolio: Dict[str, PortfolioWithPriorityItem], st_portfolio: Dict[str, PortfolioItem], options: TransactionOption,
+                 price_data: IntradayPriceData, log_size: int = 10000) -> None:
+        self.borrower_loan_ratio = options['borrower_loan_ratio'] if 'borrower_loan_ratio' in options else 1.0
+        self.lender_loan_ratio = options['lender_loan_ratio'] if 'lender_loan_ratio' in options else 1.0
+        self.is_reverse = options['is_reverse'] if 'is_reverse' in options else False
+        self.margin_call_threshold = options['margin_call_threshold'] if 'margin_call_threshold' in options else 0.0
+        self.fixed_point = options['fixed_point'] if 'fixed_point' in options else False
+        self.lender = options['lender'] if 'lender' in options else 'Lender(B)'
+        self.arith = get_arithmetic(self.fixed_point)
+        self.price_data = price_data
+        self.log_size = log_size
+
+        # 担保は優先度の高い順に並べておく
+        jct_items = sorted(jct_portfolio.items(), key=lambda x: x[1]['priority'], reverse=True)  # type: ignore
+        self.jct_codes = [code for code, _ in jct_items]
+        self.initial_jct_nums = [item['num'] for _, item in jct_items]
+        self.st_codes = list(st_portfolio.keys())
+        self.st_nums = np.array([item['num'] for item in st_portfolio.values()], dtype=np.int64)
+
+        # 外貨建ての銘柄は通貨ごとの対円レート（USD は JPY=X、EUR は EURJPY=X など）の列で円換算する
+        self.jct_columns, self.jct_fx_columns = self._columns(self.jct_codes, jct_portfolio)
+        self.st_columns, self.st_fx_columns = self._columns(self.st_codes, st_portfolio)
+
+        # 返還時（lender -> borrower）の順序
+        priorities = [item['priority'] for _, item in jct_items]
+        self.return_order = sorted(range(len(self.jct_codes)), key=lambda i: priorities[i], reverse=self.is_reverse)  # type: ignore
+
+    def _columns(self, codes: List[str], portfolio: dict) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        銘柄ごとの価格の列と、対円レートの列（JPY 建ては -1）
+        """
+        missing = [code for code in codes if code != 'JPY' and code not in self.price_data.code_index]
+        if missing:
+            raise ValueError(f'Intraday prices of {missing} are not included in the price data.')
+        columns = np.array([self.price_data.code_index[code] if code != 'JPY' else -1 for code in codes], dtype=np.int64)
+        fx_codes = [fx_code(currency_of(portfolio[code])) for code in codes]
+        missing_fx = sorted({code for code in fx_codes if code is not None and code not in self.price_data.code_index})
+        if missing_fx:
+            raise ValueError(f'{missing_fx} must be included in the intraday price data for foreign currency securities.')
+        fx_columns = np.array([self.price_data.code_index[code] if code is not None else -1 for code in fx_codes], dtype=np.int64)
+        return columns, fx_columns
+
+    def _prices(self, raw_prices: np.ndarray, columns: np.ndarray, fx_columns: np.ndarray) -> np.ndarray:
+        """
+        update_portfolio_price と同様に円換算し、0.1円単位で切り捨てる（固定小数点モードでは 0.1円単位の整数）
+        """
+        prices = np.where(columns >= 0, raw_prices[:, columns], 1.0)
+        if (fx_columns >= 0).any():
+            prices = np.where(fx_columns >= 0, prices * raw_prices[:, fx_columns], prices)
+        if self.fixed_point:
+            return np.floor(prices * PRICE_SCALE).astype(np.int64)
+        return np.floor(prices * 10) / 10
+
+    def _initial_allocation(self, jct_prices: list, necessary_value) -> Tuple[List[int], List[int]]:
+        """
+        AutoAdjustmentTransactionBase の初期差し入れと同じ手順
+        """
+        jct_nums = list(self.initial_jct_nums)
+        collateral_nums = [0] * len(jct_nums)
+        remaining = necessary_value
+        for k, price in enumerate(jct_prices):
+            if price * jct_nums[k] >= remaining:
+                num = self.arith.ceil_div(remaining, price)
+                if num > jct_nums[k]:
+                    continue
+                collateral_nums[k] = num
+                jct_nums[k] -= num
+                remaining = 0
+                break
+            collateral_nums[k] = jct_nums[k]
+            remaining -= price * jct_nums[k]
+            jct_nums[k] = 0
+
+        if remaining > 0:
+            raise ValueError(f'Initial JCT is insufficient!! {dict(zip(self.jct_codes, self.initial_jct_nums))}')
+        return jct_nums, collateral_nums
+
+    def _margin_call(self, jct_nums: List[int], collateral_nums: List[int], jct_prices: list, collateral_diff) -> bool:
+        """
+        1ステップ分の価格調整（AutoAdjustmentTransactionMulti.check_diff_and_margin_call と同じ手順）
+        jct_nums, collateral_nums を更新し、borrower が追加発行したかを返す
+        """
+        ceil_div = self.arith.ceil_div
+        if collateral_diff > 0:
+            # borrower -> lender: 優先度の高い順に差し入れ
+            for k, price in enumerate(jct_prices):
+                if jct_nums[k] == 0 and collateral_diff > 0:
+                    # 移動する数量がない銘柄（元の処理でも数量・差分は変わらない）
+                    continue
+                if math.floor(price * jct_nums[k]) >= collateral_diff:
+                    num = ceil_div(collateral_diff, price)
+                    collateral_nums[k] += num
+                    jct_nums[k] -= num
+                    return False
+                collateral_nums[k] += jct_nums[k]
+                collateral_diff -= price * jct_nums[k]
+                jct_nums[k] = 0
+            if collateral_diff > 0:
+                # 足りない場合は最優先の担保を borrower が追加発行する
+                collateral_nums[0] += ceil_div(collateral_diff, jct_prices[0])
+                return True
+            return False
+
+        # lender -> borrower: 優先度の低い順に返還（is_reverse で逆順）
+        collateral_diff = -collateral_diff
+        for k in self.return_order:
+            if collateral_nums[k] == 0 and collateral_diff > 0:
+                continue
+            price = jct_prices[k]
+            if math.floor(price * collateral_nums[k]) >= collateral_diff:
+                num = ceil_div(collateral_diff, price)
+                jct_nums[k] += num
+                collateral_nums[k] -= num
+                return False
+            jct_nums[k] += collateral_nums[k]
+            collateral_diff -= price * collateral_nums[k]
+            collateral_nums[k] = 0
+        if collateral_diff > 0:
+            raise ValueError(f'{self.lender} does not have enough collaterals. Bugs exist.')
+        return False
+
+    def run(self, start: Timestamp, end: Timestamp, interval: Optional[timedelta] = None) -> dict:
+        """
+        start の足で初期差し入れを行い、以降 end 未満の各ステップ（interval を指定した場合は interval ごと）で価格調整を行う
+        """
+        step_timestamps, rows = self.price_data.steps(start, end, interval)
+        if len(rows) == 0:
+            raise ValueError(f'No intraday price data between {start} and {end}.')
+        values = self.price_data.values
+        value_dtype = np.int64 if self.fixed_point else np.float64
+        logs = IntradayRingLog(self.log_size, value_dtype)
+        events: Deque[tuple] = deque(maxlen=self.log_size)
+        lender_loan_ratio = self.lender_loan_ratio
+        borrower_loan_ratio = self.borrower_loan_ratio
+        margin_call_threshold = self.margin_call_threshold
+        arith = self.arith
+
+        # 初期差し入れ
+        raw = values[rows[:1]]
+        st_total_value = (self._prices(raw, self.st_columns, self.st_fx_columns) @ self.st_nums)
+        necessary = arith.necessary_value(st_total_value, lender_loan_ratio, borrower_loan_ratio)
+        jct_prices = self._prices(raw, self.jct_columns, self.jct_fx_columns)
+        jct_nums, collateral_nums = self._initial_allocation(jct_prices[0].tolist(), necessary[0].item())
+        collateral_vector = np.array(collateral_nums, dtype=np.int64)
+        logs.extend(step_timestamps[:1], st_total_value, jct_prices @ collateral_vector, necessary, np.ones(1, dtype=bool), np.zeros(1, dtype=bool))
+
+        margin_call_count = 0
+        issue_count = 0
+        max_price_diff = 0
+        for chunk_start in range(1, len(rows), self.CHUNK_SIZE):
+            chunk_rows = rows[chunk_start:chunk_start + self.CHUNK_SIZE]
+            chunk_timestamps = step_timestamps[chunk_start:chunk_start + self.CHUNK_SIZE]
+            raw = values[chunk_rows]
+            st_total_value = self._prices(raw, self.st_columns, self.st_fx_columns) @ self.st_nums
+            necessary = arith.necessary_value(st_total_value, lender_loan_ratio, borrower_loan_ratio)
+            jct_prices = self._prices(raw, self.jct_columns, self.jct_fx_columns)
+
+            n_steps = len(chunk_rows)
+            # ログはチャンク単位でまとめてリングバッファに書き込む
+            chunk_collateral_sum = np.zeros(n_steps, dtype=value_dtype)
+            chunk_has_done = np.zeros(n_steps, dtype=bool)
+            chunk_issue = np.zeros(n_steps, dtype=bool)
+            # 価格調整が連続する間は1ステップずつ list 上で処理する（配列演算の呼び出しの方が高くつくため）
+            jct_price_rows: Optional[list] = None
+            necessary_list: Optional[list] = None
+            i = 0
+            window = self.INITIAL_WINDOW
+            while i < n_steps:
+                if window == 1:
+                    if jct_price_rows is None:
+                        jct_price_rows = jct_prices.tolist()
+                        necessary_list = necessary.tolist()
+                    step_prices = jct_price_rows[i]
+                    step_necessary = necessary_list[i]  # type: ignore
+                    step_collateral_sum = sum(map(mul, step_prices, collateral_nums))
+                    step_diff = step_necessary - step_collateral_sum
+                    chunk_collateral_sum[i] = step_collateral_sum
+                    if arith.is_within_threshold(step_diff, step_necessary, margin_call_threshold):
+                        max_price_diff = max(max_price_diff, abs(step_diff))
+                        window = self.INITIAL_WINDOW
+                    else:
+                        borrower_issue = self._margin_call(jct_nums, collateral_nums, step_prices, step_diff)
+                        chunk_has_done[i] = True
+                        chunk_issue[i] = borrower_issue
+                        events.append((chunk_timestamps[i], tuple(collateral_nums), borrower_issue))
+                        max_price_diff = max(max_price_diff, abs(step_necessary - sum(map(mul, step_prices, collateral_nums))))
+                        collateral_vector = None
+                    i += 1
+                    continue
+
+                if collateral_vector is None:
+                    collateral_vector = np.array(collateral_nums, dtype=np.int64)
+                j = min(n_steps, i + window)
+                collateral_sum = jct_prices[i:j] @ collateral_vector
+                collateral_diff = necessary[i:j] - collateral_sum
+                is_active = ~arith.is_within_threshold(collateral_diff, necessary[i:j], margin_call_threshold)
+                k = int(is_active.argmax())
+                if not is_active[k]:
+                    k = j - i
+
+                # 閾値内のステップ
+                chunk_collateral_sum[i:i + k] = collateral_sum[:k]
+                if k > 0:
+                    max_price_diff = max(max_price_diff, np.abs(collateral_diff[:k]).max().item())
+                if i + k == j:
+                    i = j
+                    window = min(window * 2, self.CHUNK_SIZE)
+                    continue
+
+                # 価格調整が必要なステップ
+                t = i + k
+                step_prices = jct_prices[t]
+                borrower_issue = self._margin_call(jct_nums, collateral_nums, step_prices.tolist(), collateral_diff[k].item())
+                collateral_vector = np.array(collateral_nums, dtype=np.int64)
+                chunk_collateral_sum[t] = collateral_sum[k]
+                chunk_has_done[t] = True
+                chunk_issue[t] = borrower_issue
+                events.append((chunk_timestamps[t], tuple(collateral_nums), borrower_issue))
+                # LogVisualizer と同じく、調整後の差入担保価値と必要担保価値の差
+                max_price_diff = max(max_price_diff, abs(necessary[t].item() - (step_prices @ collateral_vector).item()))
+                i = t + 1
+                window = self.INITIAL_WINDOW if k > 0 else 1
+
+            logs.extend(chunk_timestamps, st_total_value, chunk_collateral_sum, necessary, chunk_has_done, chunk_issue)
+            margin_call_count += int(chunk_has_done.sum())
+            issue_count += int(chunk_issue.sum())
+
+        return {
+            'steps': len(rows) - 1,
+            'margin_call_count': margin_call_count,
+            'borrower_additional_issue_count': issue_count,
+            'max_price_diff': arith.to_yen(max_price_diff),
+            'jct_portfolio': dict(zip(self.jct_codes, jct_nums)),
+            'collateral_portfolio': dict(zip(self.jct_codes, collateral_nums)),
+            'logs': logs.to_dict(arith.to_yen),
+            'margin_call_events': [
+                {'date': timestamp.astype(datetime), 'collateral_portfolio': dict(zip(self.jct_codes, nums)), 'borrower_additional_issue': issue}
+                for timestamp, nums, issue in events
+            ],
+        }
@@ -0,0 +1,159 @@
+"""
+参加者単位で保有有価証券（在庫）を管理するためのクラス
+同一の借り手が複数の取引を持つ場合でも、保有量は参加者ごとに一つだけ持つ
+"""
+import copy
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Union
+
+from .compact_portfolio import CompactPortfolio
+from .fx import CURRENCIES, CURRENCY_USD, currency_id, currency_of
+from .lazy_module import LazyModule
+from .types import PortfolioWithPriorityItem
+
+# 取引単体の実行では在庫を使わないため、numpy は在庫を作成するまで読み込まない
+np = LazyModule('numpy')
+
+
+class ParticipantInventory(object):
+    """
+    参加者ごとの有価証券在庫（配列で保持）
+    - 同一参加者の全取引はこの在庫から担保を差し入れ、返還を受ける
+    - 当日中の増減は pending に積み、commit() で一括反映する
+    - 参照時は pending を含めた数量を返すため、同日の取引同士でも在庫の取り合いが発生する
+    """
+
+    def __init__(self, owner: str, portfolio: Dict[str, PortfolioWithPriorityItem]) -> None:
+        self.owner = owner
+        self.codes: List[str] = list(portfolio.keys())
+        self.index: Dict[str, int] = {code: i for i, code in enumerate(self.codes)}
+        self.nums = np.array([item['num'] for item in portfolio.values()], dtype=np.int64)
+        self.prices = np.array([item['price'] if 'price' in item else 0.0 for item in portfolio.values()], dtype=np.float64)
+        # 通貨は fx.CURRENCIES の id で保持する
+        self.currency_ids = np.array([currency_id(currency_of(item)) for item in portfolio.values()], dtype=np.int8)
+        self.priorities: List[Optional[int]] = [item['priority'] if 'priority' in item else None for item in portfolio.values()]
+        self.pending = np.zeros(len(self.codes), dtype=np.int64)
+
+    def view(self, codes: Optional[Iterable[str]] = None) -> 'InventoryPortfolio':
+        """
+        取引に渡すための dict 互換のビューを返す
+        codes を指定した場合はその銘柄のみを取引から見えるようにする
+        """
+        return InventoryPortfolio(self, self.codes if codes is None else list(codes))
+
+    def current_num(self, code: str) -> int:
+        idx = self.index[code]
+        return int(self.nums[idx] + self.pending[idx])
+
+    def commit(self) -> None:
+        """
+        当日分の増減を在庫に一括で反映する
+        """
+        self.nums += self.pending
+        self.pending[:] = 0
+
+    def total_value(self) -> float:
+        return float(np.dot(self.nums + self.pending, self.prices))
+
+    def to_dict(self, codes: Optional[Iterable[str]] = None) -> Dict[str, PortfolioWithPriorityItem]:
+        return {code: self._item_dict(self.index[code]) for code in (self.codes if codes is None else codes)}
+
+    def _item_dict(self, idx: int) -> PortfolioWithPriorityItem:
+        item = {
+            'num': int(self.nums[idx] + self.pending[idx]),
+            'price': float(self.prices[idx]),
+            'priority': self.priorities[idx],
+            'is_usd': bool(self.currency_ids[idx] == CURRENCY_USD)
+        }
+        if self.currency_ids[idx] > CURRENCY_USD:
+            item['currency'] = CURRENCIES[self.currency_ids[idx]]
+        return item  # type: ignore
+
+
+class InventoryItem(object):
+    """
+    在庫の1銘柄分を PortfolioWithPriorityItem と同じ添字アクセスで扱うためのビュー
+    """
+    __slots__ = ('_inventory', '_idx')
+
+    def __init__(self, inventory: ParticipantInventory, idx: int) -> None:
+        self._inventory = inventory
+        self._idx = idx
+
+    def __getitem__(self, key: str) -> Union[int, float, bool, None]:
+        inventory = self._inventory
+        idx = self._idx
+        if key == 'num':
+            return int(inventory.nums[idx] + inventory.pending[idx])
+        if key == 'price':
+            return float(inventory.prices[idx])
+        if key == 'priority':
+            return inventory.priorities[idx]
+        if key == 'is_usd':
+            return bool(inventory.currency_ids[idx] == CURRENCY_USD)
+        if key == 'currency' and inventory.currency_ids[idx] > CURRENCY_USD:
+            return CURRENCIES[inventory.currency_ids[idx]]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value) -> None:
+        inventory = self._inventory
+        idx = self._idx
+        if key == 'num':
+            # 直接書き換えず、差分を当日分の pending に積む
+            inventory.pending[idx] += value - (inventory.nums[idx] + inventory.pending[idx])
+        elif key == 'price':
+            inventory.prices[idx] = value
+        else:
+            raise KeyError(f'{key} of shared inventory is read-only')
+
+    def __contains__(self, key: str) -> bool:
+        if key == 'currency':
+            return bool(self._inventory.currency_ids[self._idx] > CURRENCY_USD)
+        return key in ('num', 'price', 'priority', 'is_usd')
+
+    def __repr__(self) -> str:
+        return repr(self._inventory._item_dict(self._idx))
+
+    def __deepcopy__(self, memo) -> PortfolioWithPriorityItem:
+        return self._inventory._item_dict(self._idx)
+
+    def copy(self) -> PortfolioWithPriorityItem:
+        return self._inventory._item_dict(self._idx)
+
+
+class InventoryPortfolio(Mapping):
+    """
+    ParticipantInventory を Dict[str, PortfolioWithPriorityItem] として扱うためのビュー
+    deepcopy（ログ保存）時はその時点の dict のスナップショットを返す
+    """
+
+    def __init__(self, inventory: ParticipantInventory, codes: List[str]) -> None:
+        self.inventory = inventory
+        self.codes = codes
+        self._items = {code: InventoryItem(inventory, inventory.index[code]) for code in codes}
+
+    def __getitem__(self, code: str) -> InventoryItem:
+        return self._items[code]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.codes)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __repr__(self) -> str:
+        return repr(self.inventory.to_dict(self.codes))
+
+    def __deepcopy__(self, memo) -> Dict[str, PortfolioWithPriorityItem]:
+        return self.inventory.to_dict(self.codes)
+
+
+def attach_portfolio(portfolio: Union[Dict[str, PortfolioWithPriorityItem], InventoryPortfolio], compact: bool = False, integer_prices: bool = False):
+    """
+    共有在庫のビューであればそのまま、通常の dict であれば取引固有のコピーを返す
+    compact が True の場合、コピーは CompactPortfolio として作成する（integer_prices は固定小数点モード用）
+    """
+    if isinstance(portfolio, InventoryPortfolio):
+        return portfolio
+    if compact:
+        return CompactPortfolio.from_dict(portfolio, integer_prices)
+    return copy.deepcopy(portfolio)
@@ -0,0 +1,222 @@
+"""
+価格参照の遅延（タイムラグ）を扱うためのクラス
+日ごとの価格ベクトルをリングバッファに保持し、d日前の価格を再取得せずに参照する
+
+- LaggedPriceReference: option['reference_delay'] を指定した取引が、reference_delay 日前の価格で時価評価するための株価取得クラス
+- LagEngine: 複数の遅延日数（0..k日）について、価格パネルを1回走査するだけで評価額の誤差を算出する
+"""
+import copy
+from datetime import date, timedelta
+import math
+from typing import Dict, Iterable, List, Optional, Sequence, Union
+
+from .fx import USDJPY_CODE, currency_of, fx_code
+from .lazy_module import LazyModule
+from .types import PortfolioItem
+from .utils import get_price_getter
+
+# 遅延を指定しない取引では使わないため、numpy は初めて使うときに読み込む
+np = LazyModule('numpy')
+
+
+def fetch_price_vector(price_getter, codes: Sequence[str], _date: date, is_local: bool = False) -> 'np.ndarray':
+    """
+    codes の終値を並べたベクトルを返す（get_close_prices を持つ株価取得クラスであれば一括で取得する）
+    is_local は update_portfolio_price の is_dummy_data と同様に、ローカルのデータから取得するかどうか
+    （get_close_prices を持つ株価取得クラスはローカルのデータのみを扱う）
+    """
+    get_close_prices = getattr(price_getter, 'get_close_prices', None)
+    if get_close_prices is not None:
+        return np.asarray(get_close_prices(codes, _date), dtype=np.float64)
+    return np.array([price_getter.get_close_price(code, _date, is_local=is_local) for code in codes], dtype=np.float64)
+
+
+class PriceRingBuffer(object):
+    """
+    直近 size 日分の価格ベクトルを保持するリングバッファ
+    """
+
+    def __init__(self, size: int, n_codes: int) -> None:
+        self.size = size
+        self.values = np.zeros((size, n_codes), dtype=np.float64)
+        self.ordinals = np.full(size, -1, dtype=np.int64)
+        self.head = -1
+
+    def push(self, _date: date, vector: 'np.ndarray') -> None:
+        self.head = (self.head + 1) % self.size
+        self.values[self.head] = vector
+        self.ordinals[self.head] = _date.toordinal()
+
+    def lagged(self, delay: int) -> 'np.ndarray':
+        if delay >= self.size:
+            raise ValueError(f'delay must be less than the buffer size: {delay} >= {self.size}')
+        return self.values[(self.head - delay) % self.size]
+
+    def copy(self) -> 'PriceRingBuffer':
+        new = PriceRingBuffer.__new__(PriceRingBuffer)
+        new.size = self.size
+        new.values = self.values.copy()
+        new.ordinals = self.ordinals.copy()
+        new.head = self.head
+        return new
+
+    def latest_date(self) -> Optional[date]:
+        if self.head < 0:
+            return None
+        return date.fromordinal(int(self.ordinals[self.head]))
+
+
+class LaggedPriceReference(object):
+    """
+    reference_delay 日前の価格を返す株価取得クラス（update_portfolio_price の price_getter として用いる）
+    日付が進むたびに当日の価格ベクトルのみを取得し、遅延分はリングバッファから参照する
+    """
+
+    def __init__(self, codes: Iterable[str], reference_delay: int, price_getter=None) -> None:
+        if reference_delay < 0:
+            raise ValueError(f'reference_delay must be non-negative: {reference_delay}')
+        self.price_getter = price_getter
+        self.codes: List[str] = [code for code in dict.fromkeys(codes) if code != 'JPY']
+        if USDJPY_CODE not in self.codes:
+            self.codes.append(USDJPY_CODE)
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        self.reference_delay = reference_delay
+        self.buffer = PriceRingBuffer(reference_delay + 1, len(self.codes))
+
+    @classmethod
+    def create(cls, reference_delay: int, portfolios: Iterable[dict]) -> Optional['LaggedPriceReference']:
+        """
+        遅延がない場合は None（通常の株価取得クラスを用いる）を返す
+        """
+        if not reference_delay:
+            return None
+        codes: List[str] = []
+        fx_codes: List[str] = []
+        for portfolio in portfolios:
+            codes.extend(portfolio.keys())
+            # JPY / USD 以外の通貨の対円レートも遅延させて参照する
+            fx_codes.extend(fx_code(currency_of(item)) for item in portfolio.values() if currency_of(item) not in ('JPY', 'USD'))
+        return cls(codes + fx_codes, reference_delay)
+
+    def copy(self) -> 'LaggedPriceReference':
+        """
+        取引の分岐（fork）用に、株価取得クラスは共有したままバッファのみを複製する
+        """
+        new = copy.copy(self)
+        new.buffer = self.buffer.copy()
+        return new
+
+    def _advance_to(self, _date: Union[str, date], is_local: bool = False) -> None:
+        if isinstance(_date, str):
+            _date = date.fromisoformat(_date)
+        latest = self.buffer.latest_date()
+        if latest is None:
+            # 初回は遅延分の過去の価格から埋める
+            latest = _date - timedelta(self.reference_delay + 1)
+        elif _date < latest:
+            raise ValueError(f'Dates must not go backwards: {_date} < {latest}')
+        price_getter = self.price_getter if self.price_getter is not None else get_price_getter()
+        # 休日等で日付が飛んだ場合も、カレンダー日ごとにバッファを進める
+        first_ordinal = max(latest.toordinal() + 1, _date.toordinal() - self.reference_delay)
+        for ordinal in range(first_ordinal, _date.toordinal() + 1):
+            _day = date.fromordinal(ordinal)
+            self.buffer.push(_day, fetch_price_vector(price_getter, self.codes, _day, is_local))
+
+    def _lagged_vector(self, _date: Union[str, date], is_local: bool = False) -> 'np.ndarray':
+        if self.buffer.latest_date() != (date.fromisoformat(_date) if isinstance(_date, str) else _date):
+            self._advance_to(_date, is_local)
+        return self.buffer.lagged(self.reference_delay)
+
+    def get_close_price(self, code: str, date: Union[str, date], is_local: bool = False) -> float:
+        if code == 'JPY':
+            return 1.0
+        return float(self._lagged_vector(date, is_local)[self.index[code]])
+
+    def get_usdjpy_close(self, date: Union[str, date], is_local: bool = False) -> float:
+        return self.get_close_price(USDJPY_CODE, date, is_local)
+
+
+class LagEngine(object):
+    """
+    ポートフォリオの評価額について、遅延日数 delays ごとの誤差（遅延価格での評価額 - 当日価格での評価額）を1回の走査で算出する
+    ex.)
+        engine = LagEngine({'NVDA': {'num': 100, 'is_usd': True}}, delays=[0, 1, 3])
+        result = engine.run(date(2022, 4, 1), date(2022, 6, 1))
+        result['summary'][3]['mean_abs_error_ratio']
+    """
+
+    def __init__(self, portfolio: Dict[str, PortfolioItem], delays: Sequence[int] = (0, 1, 3), price_getter=None, is_dummy_data: bool = False) -> None:
+        if not delays or min(delays) < 0:
+            raise ValueError(f'delays must be non-negative: {delays}')
+        self.delays = sorted(set(delays))
+        self.price_getter = price_getter
+        self.is_dummy_data = is_dummy_data
+        self.portfolio_codes = list(portfolio.keys())
+        self.nums = np.array([portfolio[code]['num'] for code in self.portfolio_codes], dtype=np.float64)
+        self.is_jpy = np.array([code == 'JPY' for code in self.portfolio_codes], dtype=bool)
+        # 円換算に用いる通貨（USD は常に含める）と、銘柄ごとの通貨の添字（0 は JPY）
+        currencies = [currency_of(portfolio[code]) for code in self.portfolio_codes]
+        self.fx_currencies = ['USD'] + [currency for currency in dict.fromkeys(currencies) if currency not in ('JPY', 'USD')]
+        self.currency_index = np.array([self.fx_currencies.index(currency) + 1 if currency != 'JPY' else 0 for currency in currencies], dtype=np.int64)
+        # 取得する銘柄（為替を末尾に追加）
+        self.codes = [code for code in self.portfolio_codes if code != 'JPY'] + [fx_code(currency) for currency in self.fx_currencies]
+        self.columns = np.array([self.codes.index(code) if code != 'JPY' else 0 for code in self.portfolio_codes], dtype=np.int64)
+
+    def _yen_prices(self, vector: 'np.ndarray') -> 'np.ndarray':
+        """
+        update_portfolio_price と同様に円換算し、0.1円単位で切り捨てる
+        """
+        prices = np.where(self.is_jpy, 1.0, vector[self.columns])
+        rates = np.concatenate(([1.0], vector[len(vector) - len(self.fx_currencies):]))
+        prices = prices * rates[self.currency_index]
+        return np.floor(prices * 10) / 10
+
+    def run(self, start_date: date, end_date: date) -> dict:
+        """
+        start_date から end_date の前日までの各日について、遅延日数ごとの評価額の誤差を返す
+        """
+        price_getter = self.price_getter if self.price_getter is not None else get_price_getter()
+        max_delay = self.delays[-1]
+        buffer = PriceRingBuffer(max_delay + 1, len(self.portfolio_codes))
+
+        # 最大遅延日数分の過去の価格から埋めておく
+        for n in range(max_delay, 0, -1):
+            _day = start_date - timedelta(n)
+            buffer.push(_day, self._yen_prices(fetch_price_vector(price_getter, self.codes, _day, self.is_dummy_data)))
+
+        dates: List[date] = []
+        true_values: List[float] = []
+        errors: Dict[int, List[float]] = {delay: [] for delay in self.delays}
+        price_diff_ratios: Dict[int, List['np.ndarray']] = {delay: [] for delay in self.delays}
+        for ordinal in range(start_date.toordinal(), end_date.toordinal()):
+            _day = date.fromordinal(ordinal)
+            buffer.push(_day, self._yen_prices(fetch_price_vector(price_getter, self.codes, _day, self.is_dummy_data)))
+            current = buffer.lagged(0)
+            true_value = float(self.nums @ current)
+            dates.append(_day)
+            true_values.append(true_value)
+            for delay in self.delays:
+                lagged = buffer.lagged(delay)
+                errors[delay].append(float(self.nums @ lagged) - true_value)
+                # 銘柄ごとの価格差（%）
+                price_diff_ratios[delay].append(np.abs(current - lagged) / current * 100)
+
+        summary = {}
+        for delay in self.delays:
+            error = np.array(errors[delay])
+            abs_ratio = np.abs(error) / np.array(true_values) * 100 if dates else error
+            summary[delay] = {
+                'mean_abs_error': float(np.mean(np.abs(error))) if dates else math.nan,
+                'max_abs_error': float(np.max(np.abs(error))) if dates else math.nan,
+                'mean_abs_error_ratio': float(np.mean(abs_ratio)) if dates else math.nan,
+                'max_abs_error_ratio': float(np.max(abs_ratio)) if dates else math.nan,
+            }
+
+        return {
+            'date': dates,
+            'codes': self.portfolio_codes,
+            'true_value': true_values,
+            'error': {delay: np.array(errors[delay]) for delay in self.delays},
+            'price_diff_ratio': {delay: np.array(price_diff_ratios[delay]) for delay in self.delays},
+            'summary': summary,
+        }
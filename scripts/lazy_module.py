@@ -0,0 +1,29 @@
+"""
+重いモジュール（pandas, yfinance, matplotlib 等）を初回の属性アクセス時まで読み込まないためのラッパー
+シミュレーション本体のみを使うワーカーや CLI の起動時間を短くするために用いる
+"""
+import importlib
+from types import ModuleType
+from typing import Any, Optional
+
+
+class LazyModule(object):
+    """
+    np = LazyModule('numpy') のように用い、np.array などに初めてアクセスした時点で import する
+    """
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._module: Optional[ModuleType] = None
+
+    def _load(self) -> ModuleType:
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._load(), attr)
+
+    def __repr__(self) -> str:
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f'<LazyModule {self._name!r} ({state})>'
@@ -0,0 +1,175 @@
+"""
+シミュレーション中のトークン移動・価格更新を、オンチェーン取引の負荷試験用の CSV（data/data202212 の形式）として書き出す
+- create_token.csv: トークンの作成（total_create_token.csv と同じ列）
+- update_token.csv: 価格更新（total_update_token.csv と同じ列）
+- transfer_token.csv: トークン移動（tokenId, tokenName, amount, from, to, updateTime）
+行はバッファに溜めて batch_size 行ごとにまとめて書き込む
+
+ex.)
+    with LedgerEventWriter('./data/ledger') as ledger:
+        logs = ExecuteAutoAdjustmentTransactionMulti(jct_portfolio, st_portfolio, start_date, end_date, {'ledger': ledger}).execute()
+"""
+import calendar
+import csv
+from datetime import date
+import os
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from .netting import Transfer
+
+CREATE_TOKEN_COLUMNS = ('tokenId', 'tokenName', 'price', 'tokenTypeId', 'updateTime')
+UPDATE_TOKEN_COLUMNS = ('tokenId', 'tokenName', 'price', 'tokenTypeId', 'updateTime')
+TRANSFER_TOKEN_COLUMNS = ('tokenId', 'tokenName', 'amount', 'from', 'to', 'updateTime')
+
+# sandbox/create_additional_dataset.ipynb と同じ tokenId の初期値と tokenTypeId
+INITIAL_TOKEN_ID = 0x2023010917021000000000000000000000000000000000000000000000000001
+DEFAULT_TOKEN_TYPE_ID = '0x3078303030303100000000000000000000000000000000000000000000000000'
+
+
+class TokenRegistry(object):
+    """
+    銘柄コードと tokenId の対応
+    token_ids で指定しなかった銘柄には、初めて現れた順に INITIAL_TOKEN_ID からの連番を割り当てる
+    """
+
+    def __init__(self, token_ids: Optional[Dict[str, str]] = None, initial_token_id: int = INITIAL_TOKEN_ID) -> None:
+        self.token_ids: Dict[str, str] = dict(token_ids) if token_ids else {}
+        self._used_token_ids = set(self.token_ids.values())
+        self.next_token_id = initial_token_id
+        # 作成時の (価格, updateTime)（create_token.csv 用）
+        self.created: Dict[str, Tuple[float, int]] = {}
+
+    def token_id(self, code: str) -> str:
+        token_id = self.token_ids.get(code)
+        if token_id is None:
+            while hex(self.next_token_id) in self._used_token_ids:
+                self.next_token_id += 1
+            token_id = hex(self.next_token_id)
+            self.next_token_id += 1
+            self.token_ids[code] = token_id
+            self._used_token_ids.add(token_id)
+        return token_id
+
+
+class LedgerEventWriter(object):
+    """
+    トークン移動・価格更新の行を directory 以下の CSV に書き出す
+    価格更新は同じ日付・銘柄につき1行のみとする（複数の取引が同じ銘柄を保有していても重複させない）
+    """
+
+    def __init__(self, directory: str, registry: Optional[TokenRegistry] = None, token_type_id: str = DEFAULT_TOKEN_TYPE_ID,
+                 batch_size: int = 100000) -> None:
+        if batch_size <= 0:
+            raise ValueError(f'batch_size must be positive: {batch_size}')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.registry = registry if registry is not None else TokenRegistry()
+        self.token_type_id = token_type_id
+        self.batch_size = batch_size
+        self.update_rows: List[tuple] = []
+        self.transfer_rows: List[tuple] = []
+        self.update_count = 0
+        self.transfer_count = 0
+        self._last_price_time: Dict[str, int] = {}
+        self._timestamps: Dict[date, int] = {}
+        self._files = {}
+        self._writers = {}
+        for name, columns in (('update_token', UPDATE_TOKEN_COLUMNS), ('transfer_token', TRANSFER_TOKEN_COLUMNS)):
+            f = open(os.path.join(directory, f'{name}.csv'), 'w', newline='')
+            self._files[name] = f
+            self._writers[name] = csv.writer(f)
+            self._writers[name].writerow(columns)
+
+    def update_time(self, _date: date) -> int:
+        """
+        日付の 0:00（UTC）の UNIX 時刻
+        """
+        timestamp = self._timestamps.get(_date)
+        if timestamp is None:
+            timestamp = calendar.timegm(_date.timetuple())
+            self._timestamps[_date] = timestamp
+        return timestamp
+
+    def price_update(self, code: str, price, _date: date) -> None:
+        update_time = self.update_time(_date)
+        if self._last_price_time.get(code) == update_time:
+            return
+        self._last_price_time[code] = update_time
+        if code not in self.registry.created:
+            self.registry.created[code] = (price, update_time)
+        self.update_rows.append((self.registry.token_id(code), code, price, self.token_type_id, update_time))
+        if len(self.update_rows) >= self.batch_size:
+            self.flush()
+
+    def transfer(self, code: str, amount, sender: str, receiver: str, _date: date) -> None:
+        if amount == 0:
+            return
+        if amount < 0:
+            amount, sender, receiver = -amount, receiver, sender
+        self.transfer_rows.append((self.registry.token_id(code), code, amount, sender, receiver, self.update_time(_date)))
+        if len(self.transfer_rows) >= self.batch_size:
+            self.flush()
+
+    def record_prices(self, portfolio: Mapping[str, Mapping], _date: date, to_yen: Callable = float) -> None:
+        for code, security in portfolio.items():
+            if 'price' in security:
+                self.price_update(code, to_yen(security['price']), _date)
+
+    def record_transfers(self, transfers: Iterable[Transfer], _date: date) -> None:
+        """
+        TransferNetter.net() の結果（ネッティング後の移動）を記録する
+        """
+        for transfer in transfers:
+            self.transfer(transfer['code'], transfer['num'], transfer['from'], transfer['to'], _date)
+
+    def record_portfolio_diff(self, borrower: str, lender: str, before: Mapping[str, int], after: Mapping[str, int], _date: date) -> None:
+        """
+        担保ポートフォリオの前後の数量の差を移動として記録する（増加は借り手 -> 貸し手）
+        """
+        for code, num in after.items():
+            self.transfer(code, num - before.get(code, 0), borrower, lender, _date)
+        for code, num in before.items():
+            if code not in after:
+                self.transfer(code, -num, borrower, lender, _date)
+
+    def record_step(self, transaction, _date: date, before: Mapping[str, int]) -> None:
+        """
+        取引の1日分（価格更新と担保移動）を記録する
+        before は当日の価格調整前の担保ポートフォリオの数量
+        """
+        to_yen = transaction.arith.to_yen
+        for portfolio in (transaction.st_portfolio, transaction.jct_portfolio, transaction.collateral_portfolio):
+            self.record_prices(portfolio, _date, to_yen)
+        after = {code: security['num'] for code, security in transaction.collateral_portfolio.items()}
+        self.record_portfolio_diff(transaction.borrower, transaction.lender, before, after, _date)
+
+    def flush(self) -> None:
+        if self.update_rows:
+            self._writers['update_token'].writerows(self.update_rows)
+            self.update_count += len(self.update_rows)
+            self.update_rows = []
+        if self.transfer_rows:
+            self._writers['transfer_token'].writerows(self.transfer_rows)
+            self.transfer_count += len(self.transfer_rows)
+            self.transfer_rows = []
+
+    def close(self) -> None:
+        """
+        残りの行を書き込み、記録したトークンの create_token.csv を書き出す
+        """
+        self.flush()
+        for f in self._files.values():
+            f.close()
+        with open(os.path.join(self.directory, 'create_token.csv'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(CREATE_TOKEN_COLUMNS)
+            for code, token_id in self.registry.token_ids.items():
+                if code in self.registry.created:
+                    price, update_time = self.registry.created[code]
+                    writer.writerow((token_id, code, price, self.token_type_id, update_time))
+
+    def __enter__(self) -> 'LedgerEventWriter':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
@@ -0,0 +1,253 @@
+"""
+execute() の実行中に結果を描画するライブモニタ
+option['live_monitor'] にステップ数を指定した場合、そのステップごとに前回の更新以降に追加されたログのみを図に追加する
+- 上段: 実質差入担保価値と必要担保価値の価格差と、貸し手・借り手の追加発行のマーカー
+- 下段: 実質差入担保価値と必要担保価値（LogVisualizer.plt_collateral_price_diff と同じ値）
+
+描画は blitting で行う。系列ごとに1つの artist を持ち、更新時は前回の更新以降の区間のみを artist のデータとして保存した背景に重ねて描き、
+描いた後の画像を次の更新の背景として保存し直す（描画済みの点は背景に含まれるため、1回の更新の描画コストはログの長さによらない）
+値が軸の範囲を超えた場合のみ範囲を広げ、全ての点を artist のデータに戻して全体を描き直す（範囲は2倍以上に広げるため、描き直しは数回で済む）
+価格バンド（price_band）で評価を省略した日は実行中は描画せず、finish() で全体を描き直す際に含める
+図を表示していない（非 GUI のバックエンドの）場合は、finish() で保存した後に図を閉じる
+
+ex.)
+    logs = ExecuteAutoAdjustmentTransactionMulti(jct_portfolio, st_portfolio, start_date, end_date, {'live_monitor': 20}).execute()
+"""
+from datetime import date
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .lazy_module import LazyModule
+
+# matplotlib の読み込みには時間がかかるため、初めて描画するときに import する
+plt = LazyModule('matplotlib.pyplot')
+mdates = LazyModule('matplotlib.dates')
+
+# 系列ごとの描画先（'diff': 上段, 'value': 下段）とスタイル
+SERIES_STYLES: Dict[str, Tuple[str, dict]] = {
+    'price_diff': ('diff', {'color': 'green', 'label': 'Collateral Price Diff'}),
+    'lender_additional_issue': ('diff', {'color': 'orange', 'linestyle': 'none', 'marker': 'v', 'markersize': 8, 'label': 'Lender Additional Issue'}),
+    'borrower_additional_issue': ('diff', {'color': 'cyan', 'linestyle': 'none', 'marker': '^', 'markersize': 8, 'label': 'Borrower Additional Issue'}),
+    'collateral_sum': ('value', {'color': 'red', 'label': 'Actual Collateral Value'}),
+    'necessary_collateral_value': ('value', {'color': 'blue', 'label': 'Necessary Collateral Value'}),
+}
+# 前の区間の最後の点とつなげる（マーカー以外の）系列
+LINE_SERIES = ('price_diff', 'collateral_sum', 'necessary_collateral_value')
+# 初回の x 軸の幅（日数）
+MIN_X_SPAN = 30
+
+Points = Dict[str, Tuple[List[float], List[float]]]
+
+
+def _expand_limits(limits: Optional[Tuple[float, float]], low: float, high: float) -> Tuple[float, float]:
+    """
+    [low, high] が収まるように limits を広げる（広げる場合は値の幅の半分の余白をとる）
+    """
+    if limits is not None and limits[0] <= low and high <= limits[1]:
+        return limits
+    width = max(high - low, limits[1] - limits[0] if limits is not None else 0.0) or abs(high) or 1.0
+    if limits is None:
+        return (low - width / 2, high + width / 2)
+    return (min(limits[0], low - width / 2), max(limits[1], high + width / 2))
+
+
+class LiveMonitor(object):
+    """
+    update(step, logs, to_yen) を interval ステップごとに反映する（それ以外のステップでは何もしない）
+    save_path を指定した場合は finish() で図を保存する
+    """
+
+    def __init__(self, interval: int = 1, save_path: Optional[str] = None) -> None:
+        if interval <= 0:
+            raise ValueError(f'interval must be positive: {interval}')
+        self.interval = interval
+        self.save_path = save_path
+        self.fig = None
+        self.axes: Dict[str, object] = {}
+        # 系列ごとの artist と、描画済みの全ての点
+        self.lines: Dict[str, object] = {}
+        self.points: Points = {name: ([], []) for name in SERIES_STYLES}
+        self.updates = 0
+        self.full_redraws = 0
+        self.draw_seconds = 0.0
+        # 読み込み済みのログの長さ
+        self._read = 0
+        self._xlim: Optional[Tuple[float, float]] = None
+        self._ylim: Dict[str, Optional[Tuple[float, float]]] = {'diff': None, 'value': None}
+        # 描画済みの点を含む背景（None の場合は次の更新で全体を描き直す）
+        self._background = None
+
+    @staticmethod
+    def read_points(logs: Dict[str, list], to_yen: Callable, start: int = 0) -> Points:
+        """
+        logs の start 以降の各系列の点（x は matplotlib の日付）。評価を省略した（値が None の）日は含めない
+        """
+        # visualizer は numpy を読み込むため、描画する場合のみ import する
+        from .visualizer import LogVisualizer
+
+        dates: List[date] = []
+        points: Dict[str, List[float]] = {name: [] for name in SERIES_STYLES}
+        markers: Dict[str, List[int]] = {'lender_additional_issue': [], 'borrower_additional_issue': []}
+        for i in range(start, len(logs['date'])):
+            necessary_collateral_value = logs['necessary_collateral_value'][i]
+            if necessary_collateral_value is None:
+                continue
+            _date = logs['date'][i]
+            dates.append(date.fromisoformat(_date) if isinstance(_date, str) else _date)
+            collateral_sum = to_yen(LogVisualizer.portfolio_sum(logs['collateral_portfolio'][i]))
+            necessary_collateral_value = to_yen(necessary_collateral_value)
+            points['collateral_sum'].append(collateral_sum)
+            points['necessary_collateral_value'].append(necessary_collateral_value)
+            points['price_diff'].append(abs(necessary_collateral_value - collateral_sum))
+            for name, indices in markers.items():
+                if logs[name][i]:
+                    indices.append(len(dates) - 1)
+
+        xs = [float(x) for x in mdates.date2num(dates)] if dates else []
+        result: Points = {name: (xs, points[name]) for name in LINE_SERIES}
+        for name, indices in markers.items():
+            result[name] = ([xs[idx] for idx in indices], [points['price_diff'][idx] for idx in indices])
+        return result
+
+    def update(self, step: int, logs: Dict[str, list], to_yen: Callable, force: bool = False) -> None:
+        if not force and step % self.interval != 0:
+            return
+        started = time.perf_counter()
+        points = self.read_points(logs, to_yen, self._read)
+        self._read = len(logs['date'])
+        if not points['price_diff'][0]:
+            return
+
+        if self.fig is None:
+            self._create_figure()
+        segments: Points = {}
+        for name, (xs, ys) in points.items():
+            if not xs:
+                continue
+            buffer_xs, buffer_ys = self.points[name]
+            if name in LINE_SERIES and buffer_xs:
+                # 線の系列は前回の最後の点からつなげる
+                segments[name] = ([buffer_xs[-1]] + xs, [buffer_ys[-1]] + ys)
+            else:
+                segments[name] = (xs, ys)
+            buffer_xs.extend(xs)
+            buffer_ys.extend(ys)
+        if self._update_limits(points) or self._background is None:
+            # 範囲が変わった場合は全ての点で描き直す
+            self._redraw()
+        else:
+            self._blit(segments)
+        self.updates += 1
+        self.draw_seconds += time.perf_counter() - started
+
+    def finish(self, logs: Dict[str, list], to_yen: Callable) -> None:
+        """
+        評価を省略した日を埋めた後のログ全体で描き直し、save_path を指定した場合は保存する
+        図を表示していない場合は保存した後に閉じる（以降に update() された場合は図を作り直す）
+        """
+        points = self.read_points(logs, to_yen)
+        self._read = len(logs['date'])
+        if not points['price_diff'][0]:
+            return
+        # 線の系列は x の list を共有しているため、以降の update() で個別に伸ばせるように複製する
+        self.points = {name: (list(xs), list(ys)) for name, (xs, ys) in points.items()}
+        if self.fig is None:
+            self._create_figure()
+        self._xlim = None
+        self._ylim = {'diff': None, 'value': None}
+        self._update_limits(points)
+        # 実行後は x 軸をログの期間に合わせる
+        xs = points['price_diff'][0]
+        self._xlim = (xs[0], max(xs[-1], xs[0] + 1))
+        self.axes['value'].set_xlim(*self._xlim)
+        self._redraw()
+        if self.save_path:
+            self.fig.savefig(self.save_path)
+        if not self._is_shown():
+            # パラメータスイープ等で多数の実行を行っても図が残らないように閉じる
+            plt.close(self.fig)
+            self.fig = None
+            self.axes = {}
+            self._background = None
+
+    def summary(self) -> dict:
+        return {
+            'interval': self.interval,
+            'updates': self.updates,
+            'full_redraws': self.full_redraws,
+            'draw_seconds': self.draw_seconds,
+            'artists': len(self.lines),
+        }
+
+    def _is_shown(self) -> bool:
+        return self.fig is not None and type(self.fig.canvas).required_interactive_framework is not None
+
+    def _create_figure(self) -> None:
+        """
+        図と系列ごとの artist を作成する（描画済みの点がある場合はそれも描く）
+        """
+        self.fig, (ax_diff, ax_value) = plt.subplots(2, 1, figsize=(20, 12), sharex=True)
+        self.axes = {'diff': ax_diff, 'value': ax_value}
+        ax_diff.set_ylabel('Collateral Price Diff', fontsize=16)
+        ax_value.set_ylabel('Collateral Value', fontsize=16)
+        ax_value.xaxis_date()
+        for name, (axis, style) in SERIES_STYLES.items():
+            self.lines[name], = self.axes[axis].plot(*self.points[name], **style)
+        for ax in self.axes.values():
+            ax.legend(loc=2, fontsize=14)
+        self._background = None
+        if self._xlim is not None:
+            ax_value.set_xlim(*self._xlim)
+        for axis, limits in self._ylim.items():
+            if limits is not None:
+                self.axes[axis].set_ylim(*limits)
+        if self._is_shown():
+            # GUI のバックエンドでは実行を止めずにウィンドウを表示する
+            plt.show(block=False)
+
+    def _update_limits(self, points: Points) -> bool:
+        """
+        新しい点が収まるように軸の範囲を広げ、広げた場合は True を返す
+        x 軸は先頭の日付から、最後の日付までの幅の2倍まで広げる
+        """
+        changed = False
+        xs = points['price_diff'][0]
+        if self._xlim is None or xs[-1] > self._xlim[1]:
+            start = self._xlim[0] if self._xlim is not None else xs[0]
+            self._xlim = (start, start + max(2 * (xs[-1] - start), MIN_X_SPAN))
+            self.axes['value'].set_xlim(*self._xlim)
+            changed = True
+        for axis, names in (('diff', ('price_diff',)), ('value', ('collateral_sum', 'necessary_collateral_value'))):
+            values = [y for name in names for y in points[name][1]]
+            limits = _expand_limits(self._ylim[axis], min(values), max(values))
+            if limits != self._ylim[axis]:
+                self._ylim[axis] = limits
+                self.axes[axis].set_ylim(*limits)
+                changed = True
+        return changed
+
+    def _redraw(self) -> None:
+        """
+        全ての点を artist のデータに戻して図全体を描き直し、背景として保存する
+        """
+        for name, line in self.lines.items():
+            line.set_data(*self.points[name])
+        canvas = self.fig.canvas
+        canvas.draw()
+        self._background = canvas.copy_from_bbox(self.fig.bbox)
+        canvas.flush_events()
+        self.full_redraws += 1
+
+    def _blit(self, segments: Points) -> None:
+        """
+        保存した背景（描画済みの点を含む）に新しい区間のみを重ねて描き、描いた後の画像を背景として保存し直す
+        """
+        canvas = self.fig.canvas
+        canvas.restore_region(self._background)
+        for name, (xs, ys) in segments.items():
+            line = self.lines[name]
+            line.set_data(xs, ys)
+            line.axes.draw_artist(line)
+        canvas.blit(self.fig.bbox)
+        self._background = canvas.copy_from_bbox(self.fig.bbox)
+        canvas.flush_events()
@@ -0,0 +1,152 @@
+"""
+長時間の実行でのメモリ使用量の計測
+interval ステップごとに RSS と tracemalloc の割り当て量を記録し、ログの項目・ポートフォリオなどの構造ごとのバイト数を概算する
+option['memory_probe'] にステップ数を指定した場合のみ計測し、結果は logs['memory'] に添付する
+LogVisualizer(logs, memory_probe=True) では record_memory() を呼ぶたびに記録する（描画した図の分も含む）
+
+ex.)
+    logs = ExecuteAutoAdjustmentTransactionMulti(jct_portfolio, st_portfolio, start_date, end_date, {'memory_probe': 100}).execute()
+    print(logs['memory']['peak_rss'], logs['memory']['samples'][-1]['structures'])
+"""
+import os
+import sys
+import tracemalloc
+from typing import Any, Dict, List, Mapping, Optional
+
+try:
+    import resource
+except ImportError:
+    # Windows では resource が使えないため、ピークの RSS は記録しない
+    resource = None  # type: ignore
+
+
+def current_rss() -> Optional[int]:
+    """
+    現在の RSS（バイト）。/proc が使えない環境では None
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss() -> Optional[int]:
+    """
+    プロセス開始からのピークの RSS（バイト）
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS はバイト、Linux は KB 単位
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def deep_sizeof(obj: Any, seen: Optional[set] = None) -> int:
+    """
+    obj から辿れるオブジェクトの合計バイト数の概算
+    numpy 配列はデータ部分、pandas の DataFrame / Series は memory_usage(deep=True) を用いる
+    同じオブジェクトは seen で1度だけ数える（複数の構造で共有するオブジェクトは先に数えた方に計上される）
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    # numpy を読み込んでいなければ numpy 配列は存在しないため、計測のために import はしない
+    numpy = sys.modules.get('numpy')
+    if numpy is not None and isinstance(obj, numpy.ndarray):
+        # ビューの場合は元の配列に計上する
+        return sys.getsizeof(obj) if obj.base is not None else obj.nbytes + sys.getsizeof(obj)
+    memory_usage = getattr(obj, 'memory_usage', None)
+    if memory_usage is not None and type(obj).__module__.startswith('pandas'):
+        usage = memory_usage(deep=True)
+        return int(usage.sum()) if hasattr(usage, 'sum') else int(usage)
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, int, float, bool, type(None))):
+        return size
+    if isinstance(obj, Mapping):
+        for key, value in obj.items():
+            size += deep_sizeof(key, seen) + deep_sizeof(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += deep_sizeof(item, seen)
+    else:
+        # CowLog など __slots__ を持つクラスと通常のクラスの属性
+        for name in getattr(type(obj), '__slots__', ()):
+            if hasattr(obj, name):
+                size += deep_sizeof(getattr(obj, name), seen)
+        if hasattr(obj, '__dict__'):
+            size += deep_sizeof(vars(obj), seen)
+    return size
+
+
+def figure_memory() -> Dict[str, int]:
+    """
+    開いている matplotlib の図の数と、描画バッファ（RGBA）の概算バイト数
+    matplotlib を読み込んでいない場合は読み込まずに 0 を返す
+    """
+    if 'matplotlib.pyplot' not in sys.modules:
+        return {'figures': 0, 'bytes': 0}
+    # plt.figure(num) は現在の図を切り替えてしまうため、図の管理クラスから参照する
+    managers = sys.modules['matplotlib._pylab_helpers'].Gcf.get_all_fig_managers()
+    size = 0
+    for manager in managers:
+        fig = manager.canvas.figure
+        width, height = fig.get_size_inches() * fig.dpi
+        size += int(width) * int(height) * 4
+    return {'figures': len(managers), 'bytes': size}
+
+
+class MemoryProbe(object):
+    """
+    sample(step, structures) を interval ステップごとに記録する（それ以外のステップでは何もしない）
+    tracemalloc が開始されていない場合は start() で開始し、stop() で停止する
+    """
+
+    def __init__(self, interval: int = 1) -> None:
+        if interval <= 0:
+            raise ValueError(f'interval must be positive: {interval}')
+        self.interval = interval
+        self.samples: List[dict] = []
+        self._started_tracing = False
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def stop(self) -> None:
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def sample(self, step: int, structures: Mapping[str, Any], force: bool = False) -> None:
+        if not force and step % self.interval != 0:
+            return
+        traced_current, traced_peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (None, None)
+        # 構造ごとの概算は共有するオブジェクトを重複して数えないよう、同じ seen を用いる
+        seen: set = set()
+        self.samples.append({
+            'step': step,
+            'rss': current_rss(),
+            'peak_rss': peak_rss(),
+            'traced_current': traced_current,
+            'traced_peak': traced_peak,
+            'structures': {name: deep_sizeof(obj, seen) for name, obj in structures.items()},
+            'figures': figure_memory()
+        })
+
+    def summary(self) -> dict:
+        rss_list = [sample['rss'] for sample in self.samples if sample['rss'] is not None]
+        traced_list = [sample['traced_peak'] for sample in self.samples if sample['traced_peak'] is not None]
+        return {
+            'interval': self.interval,
+            'samples': self.samples,
+            'max_rss': max(rss_list) if rss_list else None,
+            'peak_rss': peak_rss(),
+            'traced_peak': max(traced_list) if traced_list else None,
+            'structures': self.samples[-1]['structures'] if self.samples else {}
+        }
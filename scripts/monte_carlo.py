@@ -0,0 +1,359 @@
+"""
+モンテカルロ法によるマージンコールのリスク評価
+- 過去の価格推移（キャッシュ）からファクターモデルを推定し、相関を持った価格・為替のパスを多数生成する
+- AutoAdjustmentTransactionMulti と同じ優先度順の価格調整を全パスに対して一括で行う
+- 結果はパスを保存せず、追加発行確率と最大価格差の分位点を逐次的に集計する
+"""
+from datetime import date
+import math
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from . import utils
+from .fixed_point import PRICE_SCALE, ceil_div, get_arithmetic
+from .fx import currency_of, fx_code
+from .types import PortfolioItem, PortfolioWithPriorityItem, TransactionOption
+
+
+def load_price_history(codes: Sequence[str], start_date: date, end_date: date, cache_path: Optional[str] = None) -> pd.DataFrame:
+    """
+    各銘柄の終値を (日付 × 銘柄) の DataFrame で返す
+    cache_path が指定されていれば CSV にキャッシュし、2回目以降はそこから読み込む
+    """
+    if cache_path is not None and os.path.exists(cache_path):
+        history = pd.read_csv(cache_path, index_col=0, parse_dates=True)
+        if all(code in history.columns for code in codes):
+            return history[list(codes)]
+
+    series_list = []
+    for code in codes:
+        series = utils.price_getter.get_close_price_all(code, start_date, end_date)
+        if isinstance(series, pd.DataFrame):
+            series = series.iloc[:, 0]
+        series_list.append(series.rename(code))
+    history = pd.concat(series_list, axis=1).sort_index().ffill().dropna()
+
+    if cache_path is not None:
+        history.to_csv(cache_path)
+    return history
+
+
+class FactorModel(object):
+    """
+    対数収益率に対する主成分ファクターモデル
+    r_t = mu + B f_t + e_t,  f_t ~ N(0, I),  e_t ~ N(0, diag(idio_var))
+    """
+
+    def __init__(self, codes: List[str], mu: np.ndarray, loadings: np.ndarray, idio_var: np.ndarray, last_prices: np.ndarray) -> None:
+        self.codes = codes
+        self.mu = mu
+        self.loadings = loadings
+        self.idio_std = np.sqrt(idio_var)
+        self.last_prices = last_prices
+
+    @classmethod
+    def fit(cls, history: pd.DataFrame, n_factors: int = 3) -> 'FactorModel':
+        log_returns = np.diff(np.log(history.to_numpy(dtype=np.float64)), axis=0)
+        if len(log_returns) < 2:
+            raise ValueError('Price history is too short to fit a factor model.')
+
+        mu = log_returns.mean(axis=0)
+        cov = np.atleast_2d(np.cov(log_returns, rowvar=False))
+        eigen_values, eigen_vectors = np.linalg.eigh(cov)
+        # 固有値の大きい順に n_factors 個をファクターとする
+        order = np.argsort(eigen_values)[::-1][:min(n_factors, len(eigen_values))]
+        loadings = eigen_vectors[:, order] * np.sqrt(np.clip(eigen_values[order], 0.0, None))
+        idio_var = np.clip(np.diag(cov) - np.sum(loadings ** 2, axis=1), 0.0, None)
+        return cls(list(history.columns), mu, loadings, idio_var, history.to_numpy(dtype=np.float64)[-1])
+
+    def sample_log_returns(self, rng: np.random.Generator, n_paths: int) -> np.ndarray:
+        factors = rng.standard_normal((n_paths, self.loadings.shape[1]))
+        noise = rng.standard_normal((n_paths, len(self.codes))) * self.idio_std
+        return self.mu + factors @ self.loadings.T + noise
+
+
+class P2Quantile(object):
+    """
+    P² アルゴリズム（Jain & Chlamtac）による分位点の逐次推定
+    観測値を保存せずに定数メモリで分位点を推定する
+    """
+
+    def __init__(self, q: float) -> None:
+        self.q = q
+        self.count = 0
+        self.heights: List[float] = []
+        self.positions = [1.0, 2.0, 3.0, 4.0, 5.0]
+        self.desired = [1.0, 1.0 + 2 * q, 1.0 + 4 * q, 3.0 + 2 * q, 5.0]
+        self.increments = [0.0, q / 2, q, (1 + q) / 2, 1.0]
+
+    def update(self, x: float) -> None:
+        self.count += 1
+        if self.count <= 5:
+            self.heights.append(x)
+            self.heights.sort()
+            return
+
+        heights = self.heights
+        positions = self.positions
+        if x < heights[0]:
+            heights[0] = x
+            k = 0
+        elif x >= heights[4]:
+            heights[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= heights[k + 1]:
+                k += 1
+
+        for i in range(k + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in range(1, 4):
+            d = self.desired[i] - positions[i]
+            if (d >= 1 and positions[i + 1] - positions[i] > 1) or (d <= -1 and positions[i - 1] - positions[i] < -1):
+                sign = 1 if d > 0 else -1
+                new_height = self._parabolic(i, sign)
+                if not heights[i - 1] < new_height < heights[i + 1]:
+                    new_height = heights[i] + sign * (heights[i + sign] - heights[i]) / (positions[i + sign] - positions[i])
+                heights[i] = new_height
+                positions[i] += sign
+
+    def _parabolic(self, i: int, sign: int) -> float:
+        heights = self.heights
+        positions = self.positions
+        upper = (positions[i] - positions[i - 1] + sign) * (heights[i + 1] - heights[i]) / (positions[i + 1] - positions[i])
+        lower = (positions[i + 1] - positions[i] - sign) * (heights[i] - heights[i - 1]) / (positions[i] - positions[i - 1])
+        return heights[i] + sign / (positions[i + 1] - positions[i - 1]) * (upper + lower)
+
+    def value(self) -> float:
+        if self.count == 0:
+            return math.nan
+        if self.count <= 5:
+            # 観測数が少ない場合は保持している値から直接求める
+            idx = min(int(round(self.q * (self.count - 1))), self.count - 1)
+            return sorted(self.heights)[idx]
+        return self.heights[2]
+
+
+class StreamingQuantiles(object):
+    def __init__(self, quantiles: Sequence[float] = (0.5, 0.9, 0.95, 0.99)) -> None:
+        self.estimators = {q: P2Quantile(q) for q in quantiles}
+        self.count = 0
+        self.mean = 0.0
+        self.max = -math.inf
+
+    def update_many(self, values: np.ndarray) -> None:
+        for x in values.tolist():
+            self.count += 1
+            self.mean += (x - self.mean) / self.count
+            if x > self.max:
+                self.max = x
+            for estimator in self.estimators.values():
+                estimator.update(x)
+
+    def result(self) -> Dict[str, float]:
+        result = {f'q{int(q * 100)}': estimator.value() for q, estimator in self.estimators.items()}
+        result['mean'] = self.mean
+        result['max'] = self.max
+        return result
+
+
+class MonteCarloMarginCall(object):
+    """
+    AutoAdjustmentTransactionMulti の価格調整を、価格パスを並べた配列上で一括して行う
+    ex.)
+        history = load_price_history(codes, date(2008, 9, 1), date(2009, 9, 1), cache_path='./history.csv')
+        engine = MonteCarloMarginCall(jct_portfolio, st_portfolio, options, FactorModel.fit(history), seed=0, worker_id=0)
+        result = engine.run(n_paths=10000, horizon=250)
+    """
+
+    def __init__(self, jct_portfolio: Dict[str, PortfolioWithPriorityItem], st_portfolio: Dict[str, PortfolioItem], options: TransactionOption,
+                 model: FactorModel, seed: int = 0, worker_id: int = 0) -> None:
+        self.borrower_loan_ratio = options['borrower_loan_ratio'] if 'borrower_loan_ratio' in options else 1.0
+        self.lender_loan_ratio = options['lender_loan_ratio'] if 'lender_loan_ratio' in options else 1.0
+        self.is_reverse = options['is_reverse'] if 'is_reverse' in options else False
+        self.margin_call_threshold = options['margin_call_threshold'] if 'margin_call_threshold' in options else 0.0
+        self.fixed_point = options['fixed_point'] if 'fixed_point' in options else False
+        self.arith = get_arithmetic(self.fixed_point)
+        self.model = model
+        # ワーカーごとに独立した乱数列になるように seed を分岐させる
+        self.rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(worker_id,)))
+
+        # 担保は優先度の高い順に並べておく
+        jct_items = sorted(jct_portfolio.items(), key=lambda x: x[1]['priority'], reverse=True)  # type: ignore
+        self.jct_codes = [code for code, _ in jct_items]
+        self.jct_nums = np.array([item['num'] for _, item in jct_items], dtype=np.int64)
+        self.st_codes = list(st_portfolio.keys())
+        self.st_nums = np.array([item['num'] for item in st_portfolio.values()], dtype=np.int64)
+
+        # 外貨建ての銘柄は通貨ごとの対円レート（USD は JPY=X、EUR は EURJPY=X など）の列で円換算する
+        self.jct_columns, self.jct_fx_columns = self._columns(self.jct_codes, jct_portfolio)
+        self.st_columns, self.st_fx_columns = self._columns(self.st_codes, st_portfolio)
+
+        # 返還時（lender -> borrower）の順序
+        priorities = [item['priority'] for _, item in jct_items]
+        self.return_order = sorted(range(len(self.jct_codes)), key=lambda i: priorities[i], reverse=self.is_reverse)  # type: ignore
+
+    def _columns(self, codes: List[str], portfolio: dict) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        銘柄ごとの価格の列と、対円レートの列（JPY 建ては -1）
+        """
+        missing = [code for code in codes if code != 'JPY' and code not in self.model.codes]
+        if missing:
+            raise ValueError(f'Price history of {missing} is not included in the factor model.')
+        columns = np.array([self.model.codes.index(code) if code != 'JPY' else -1 for code in codes], dtype=np.int64)
+        fx_codes = [fx_code(currency_of(portfolio[code])) for code in codes]
+        missing_fx = sorted({code for code in fx_codes if code is not None and code not in self.model.codes})
+        if missing_fx:
+            raise ValueError(f'{missing_fx} must be included in the factor model for foreign currency securities.')
+        fx_columns = np.array([self.model.codes.index(code) if code is not None else -1 for code in fx_codes], dtype=np.int64)
+        return columns, fx_columns
+
+    def _prices(self, raw_prices: np.ndarray, columns: np.ndarray, fx_columns: np.ndarray) -> np.ndarray:
+        """
+        update_portfolio_price と同様に円換算し、0.1円単位で切り捨てる（固定小数点モードでは 0.1円単位の整数）
+        """
+        prices = np.where(columns >= 0, raw_prices[:, columns], 1.0)
+        if (fx_columns >= 0).any():
+            prices = np.where(fx_columns >= 0, prices * raw_prices[:, fx_columns], prices)
+        if self.fixed_point:
+            return np.floor(prices * PRICE_SCALE).astype(np.int64)
+        return np.floor(prices * 10) / 10
+
+    def _lots(self, value: np.ndarray, price: np.ndarray) -> np.ndarray:
+        if self.fixed_point:
+            return ceil_div(value, price)
+        return np.ceil(value / price).astype(np.int64)
+
+    def _floor_value(self, price: np.ndarray, nums: np.ndarray) -> np.ndarray:
+        if self.fixed_point:
+            return price * nums
+        return np.floor(price * nums)
+
+    def _initial_allocation(self, jct_prices: np.ndarray, necessary_value: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        AutoAdjustmentTransactionBase の初期差し入れと同じ手順
+        """
+        jct_nums = self.jct_nums.copy()
+        collateral_nums = np.zeros_like(jct_nums)
+        remaining = necessary_value
+        for k in range(len(self.jct_codes)):
+            price = jct_prices[k]
+            if price * jct_nums[k] >= remaining:
+                num = self.arith.ceil_div(remaining, price)
+                if num > jct_nums[k]:
+                    continue
+                collateral_nums[k] = num
+                jct_nums[k] -= num
+                remaining = 0
+                break
+            collateral_nums[k] = jct_nums[k]
+            remaining -= price * jct_nums[k]
+            jct_nums[k] = 0
+
+        if remaining > 0:
+            raise ValueError(f'Initial JCT is insufficient!! {dict(zip(self.jct_codes, self.jct_nums.tolist()))}')
+        return jct_nums, collateral_nums
+
+    def _margin_call(self, jct_nums: np.ndarray, collateral_nums: np.ndarray, jct_prices: np.ndarray, collateral_diff: np.ndarray,
+                     is_active: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        全パスについて一括で価格調整を行い、(borrower の追加発行, lender の不足) のフラグを返す
+        """
+        # borrower -> lender: 優先度の高い順に差し入れ
+        remaining = np.where(is_active & (collateral_diff > 0), collateral_diff, 0)
+        for k in range(len(self.jct_codes)):
+            moving = remaining > 0
+            if not moving.any():
+                break
+            price = jct_prices[:, k]
+            value = self._floor_value(price, jct_nums[:, k])
+            is_last = moving & (value >= remaining)
+            num = np.where(is_last, self._lots(remaining, price), np.where(moving, jct_nums[:, k], 0))
+            collateral_nums[:, k] += num
+            jct_nums[:, k] -= num
+            remaining = np.where(is_last, 0, np.where(moving, remaining - price * num, remaining))
+        borrower_issue = remaining > 0
+        if borrower_issue.any():
+            # 足りない場合は最優先の担保を borrower が追加発行する
+            collateral_nums[:, 0] += np.where(borrower_issue, self._lots(remaining, jct_prices[:, 0]), 0)
+
+        # lender -> borrower: 優先度の低い順に返還（is_reverse で逆順）
+        remaining = np.where(is_active & (collateral_diff < 0), -collateral_diff, 0)
+        for k in self.return_order:
+            moving = remaining > 0
+            if not moving.any():
+                break
+            price = jct_prices[:, k]
+            value = self._floor_value(price, collateral_nums[:, k])
+            is_last = moving & (value >= remaining)
+            num = np.where(is_last, self._lots(remaining, price), np.where(moving, collateral_nums[:, k], 0))
+            jct_nums[:, k] += num
+            collateral_nums[:, k] -= num
+            remaining = np.where(is_last, 0, np.where(moving, remaining - price * num, remaining))
+        lender_shortage = remaining > 0
+
+        return borrower_issue, lender_shortage
+
+    def run(self, n_paths: int = 10000, horizon: int = 250, batch_size: int = 2000,
+            quantiles: Sequence[float] = (0.5, 0.9, 0.95, 0.99)) -> dict:
+        max_price_diff = StreamingQuantiles(quantiles)
+        issue_path_num = 0
+        lender_shortage_path_num = 0
+        issue_step_num = 0
+        initial_raw_prices = self.model.last_prices[np.newaxis, :]
+
+        st_prices = self._prices(initial_raw_prices, self.st_columns, self.st_fx_columns)[0]
+        jct_prices = self._prices(initial_raw_prices, self.jct_columns, self.jct_fx_columns)[0]
+        st_total_value = int(st_prices @ self.st_nums) if self.fixed_point else float(st_prices @ self.st_nums)
+        necessary_value = self.arith.necessary_value(st_total_value, self.lender_loan_ratio, self.borrower_loan_ratio)
+        initial_jct_nums, initial_collateral_nums = self._initial_allocation(jct_prices, necessary_value)
+
+        done_paths = 0
+        while done_paths < n_paths:
+            paths = min(batch_size, n_paths - done_paths)
+            jct_nums = np.tile(initial_jct_nums, (paths, 1))
+            collateral_nums = np.tile(initial_collateral_nums, (paths, 1))
+            log_prices = np.tile(np.log(self.model.last_prices), (paths, 1))
+            path_max_diff = np.zeros(paths)
+            path_issue = np.zeros(paths, dtype=bool)
+            path_shortage = np.zeros(paths, dtype=bool)
+
+            for _ in range(horizon):
+                log_prices += self.model.sample_log_returns(self.rng, paths)
+                raw_prices = np.exp(log_prices)
+                st_prices = self._prices(raw_prices, self.st_columns, self.st_fx_columns)
+                jct_prices = self._prices(raw_prices, self.jct_columns, self.jct_fx_columns)
+
+                necessary = self.arith.necessary_value(st_prices @ self.st_nums, self.lender_loan_ratio, self.borrower_loan_ratio)
+                collateral_diff = necessary - np.sum(jct_prices * collateral_nums, axis=1)
+                is_active = ~self.arith.is_within_threshold(collateral_diff, necessary, self.margin_call_threshold)
+
+                borrower_issue, lender_shortage = self._margin_call(jct_nums, collateral_nums, jct_prices, collateral_diff, is_active)
+                issue_step_num += int(borrower_issue.sum())
+                path_issue |= borrower_issue
+                path_shortage |= lender_shortage
+
+                # LogVisualizer と同じく、調整後の差入担保価値と必要担保価値の差
+                price_diff = self.arith.to_yen(np.abs(necessary - np.sum(jct_prices * collateral_nums, axis=1)))
+                np.maximum(path_max_diff, price_diff, out=path_max_diff)
+
+            max_price_diff.update_many(path_max_diff)
+            issue_path_num += int(path_issue.sum())
+            lender_shortage_path_num += int(path_shortage.sum())
+            done_paths += paths
+
+        return {
+            'n_paths': n_paths,
+            'horizon': horizon,
+            'additional_issue_probability': issue_path_num / n_paths,
+            'additional_issue_step_ratio': issue_step_num / (n_paths * horizon) if horizon > 0 else 0.0,
+            'lender_shortage_probability': lender_shortage_path_num / n_paths,
+            'max_price_diff': max_price_diff.result()
+        }
@@ -0,0 +1,71 @@
+"""
+ブック全体の担保移動を (借り手, 貸し手, 銘柄) ごとにネッティングするためのクラス
+"""
+from typing import Dict, List, Tuple, TypedDict
+
+Transfer = TypedDict('Transfer', {
+    'from': str,
+    'to': str,
+    'code': str,
+    'num': int
+})
+
+NettingReport = TypedDict('NettingReport', {
+    'gross_transfer_num': int,
+    'net_transfer_num': int,
+    'gross_token_num': int,
+    'net_token_num': int,
+    'transfers': List[Transfer]
+})
+
+
+class TransferNetter(object):
+    """
+    1日分の担保移動の意図を集め、同一の (借り手, 貸し手, 銘柄) で相殺した上で
+    最小限の移動（各キーにつき高々1回）のみを出力する
+    num は借り手 -> 貸し手 方向を正とする
+    """
+
+    def __init__(self) -> None:
+        self.net_nums: Dict[Tuple[str, str, str], int] = {}
+        self.gross_transfer_num = 0
+        self.gross_token_num = 0
+
+    def record(self, borrower: str, lender: str, code: str, num: int) -> None:
+        if num == 0:
+            return
+        key = (borrower, lender, code)
+        self.net_nums[key] = self.net_nums.get(key, 0) + num
+        self.gross_transfer_num += 1
+        self.gross_token_num += abs(num)
+
+    def record_portfolio_diff(self, borrower: str, lender: str, before: Dict[str, int], after: Dict[str, int]) -> None:
+        """
+        取引の担保ポートフォリオの前後の数量から移動を記録する
+        """
+        for code, num in after.items():
+            self.record(borrower, lender, code, num - before.get(code, 0))
+        for code, num in before.items():
+            if code not in after:
+                self.record(borrower, lender, code, -num)
+
+    def net(self) -> NettingReport:
+        transfers: List[Transfer] = []
+        for (borrower, lender, code), num in self.net_nums.items():
+            if num > 0:
+                transfers.append({'from': borrower, 'to': lender, 'code': code, 'num': num})
+            elif num < 0:
+                transfers.append({'from': lender, 'to': borrower, 'code': code, 'num': -num})
+
+        return {
+            'gross_transfer_num': self.gross_transfer_num,
+            'net_transfer_num': len(transfers),
+            'gross_token_num': self.gross_token_num,
+            'net_token_num': sum(transfer['num'] for transfer in transfers),
+            'transfers': transfers
+        }
+
+    def reset(self) -> None:
+        self.net_nums = {}
+        self.gross_transfer_num = 0
+        self.gross_token_num = 0
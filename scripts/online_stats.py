@@ -0,0 +1,128 @@
+"""
+execute() 中にステップごとに更新する集計値
+LogVisualizer の calc_price_diff_result, calc_token_diff, calc_portfolio_credit_diff と同じ値を、ログを保持せずに O(1) で求める
+"""
+from fractions import Fraction
+import math
+from typing import Callable, Dict, Mapping, Optional, Union
+
+Number = Union[int, float]
+
+
+class RunningStats(object):
+    """
+    逐次的に与えられる値の合計・平均・最大・最小・分散
+    分散は Welford のアルゴリズムで更新し、平均は statistics.mean と一致するよう合計を有理数で厳密に保持する
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.accumulation: Number = 0
+        self.max: Optional[Number] = None
+        self.min: Optional[Number] = None
+        self._exact_total = Fraction(0)
+        self._is_int = True
+        self._welford_mean = 0.0
+        self._m2 = 0.0
+
+    def update(self, x: Number) -> None:
+        self.count += 1
+        self.accumulation += x
+        if self.max is None or x > self.max:
+            self.max = x
+        if self.min is None or x < self.min:
+            self.min = x
+        self._exact_total += Fraction(x)
+        self._is_int = self._is_int and isinstance(x, int)
+        delta = x - self._welford_mean
+        self._welford_mean += delta / self.count
+        self._m2 += delta * (x - self._welford_mean)
+
+    def mean(self) -> Number:
+        """
+        statistics.mean と同じく、全て整数で平均も整数の場合は int を返す
+        """
+        if self.count == 0:
+            return math.nan
+        mean = self._exact_total / self.count
+        if self._is_int and mean.denominator == 1:
+            return int(mean)
+        return float(mean)
+
+    def variance(self) -> float:
+        """
+        標本分散（statistics.variance 相当）
+        """
+        return self._m2 / (self.count - 1) if self.count > 1 else math.nan
+
+    def result(self) -> Dict[str, Number]:
+        return {
+            'accumulation': self.accumulation,
+            'mean': self.mean(),
+            '_mean': self.accumulation / self.count if self.count else math.nan,
+            'max': self.max if self.max is not None else math.nan,
+            'min': self.min if self.min is not None else math.nan,
+            'variance': self.variance(),
+        }
+
+
+class OnlineLogStats(object):
+    """
+    価格調整後の担保ポートフォリオを毎ステップ受け取り、LogVisualizer と同じ集計値を更新する
+    - price_diff: 必要担保価値と差入担保価値の差の絶対値（calc_price_diff_result）
+    - token_diff: 差入担保の数量合計の前日からの増減の絶対値（calc_token_diff）
+    - credit_diff: 前日の数量を当日の価格で評価した差入担保価値と必要担保価値の差の絶対値（calc_portfolio_credit_diff）
+    """
+
+    def __init__(self, to_yen: Callable[[Number], Number]) -> None:
+        self.to_yen = to_yen
+        self.price_diff = RunningStats()
+        self.token_diff = RunningStats()
+        self.credit_diff = RunningStats()
+        self.margin_call_count = 0
+        self.borrower_additional_issue_count = 0
+        self.lender_additional_issue_count = 0
+        self._prev_nums: Optional[Dict[str, int]] = None
+        self._prev_token_num = 0
+
+    def update(self, collateral_portfolio: Mapping[str, Mapping], necessary_collateral_value: Number, has_done_margincall: bool,
+               borrower_additional_issue: bool, lender_additional_issue: bool) -> None:
+        to_yen = self.to_yen
+        collateral_sum = 0
+        token_num = 0
+        nums = {}
+        for code, security in collateral_portfolio.items():
+            num = security['num']
+            collateral_sum += num * security['price']
+            token_num += num
+            nums[code] = num
+        self.price_diff.update(to_yen(abs(necessary_collateral_value - collateral_sum)))
+
+        if self._prev_nums is None:
+            self.token_diff.update(0)
+            self.credit_diff.update(0)
+        else:
+            self.token_diff.update(abs(token_num - self._prev_token_num))
+            credit_sum = 0
+            for code, security in collateral_portfolio.items():
+                credit_sum += security['price'] * self._prev_nums.get(code, 0)
+            self.credit_diff.update(to_yen(abs(necessary_collateral_value - credit_sum)))
+        self._prev_nums = nums
+        self._prev_token_num = token_num
+
+        self.margin_call_count += bool(has_done_margincall)
+        self.borrower_additional_issue_count += bool(borrower_additional_issue)
+        self.lender_additional_issue_count += bool(lender_additional_issue)
+
+    def summary(self) -> dict:
+        token_diff = self.token_diff.result()
+        credit_diff = self.credit_diff.result()
+        return {
+            'steps': self.price_diff.count,
+            'price_diff': self.price_diff.result(),
+            'token_diff': {'mean': token_diff['mean'], 'max': token_diff['max']},
+            'credit_diff': {'mean': credit_diff['mean'], 'max': credit_diff['max']},
+            'margin_call_count': self.margin_call_count,
+            'borrower_additional_issue_count': self.borrower_additional_issue_count,
+            'lender_additional_issue_count': self.lender_additional_issue_count,
+        }
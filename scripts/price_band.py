@@ -0,0 +1,87 @@
+"""
+マージンコールが起こらない価格の範囲（バンド）
+価格調整後の st・担保の数量と当日の価格から、各銘柄の価格が全て ±delta の範囲に収まる限り
+必要担保額と差入担保額の差が閾値内に収まる（マージンコールが起こらない）delta を保守的に求める
+バンド内の日は銘柄ごとの価格の比較のみで閾値内と判定でき、時価評価・価格調整を省略できる
+
+必要担保額 N = S * r（S: st の評価額）、差入担保額 C とすると、各価格が ±delta に収まれば
+S' と C' もそれぞれ ±delta に収まるため、閾値 t に対して次の2つを満たす delta であればよい
+    N'(1 - t) < C'  ->  delta * (N(1 - t) + C) < C - N(1 - t)
+    C' < N'(1 + t)  ->  delta * (C + N(1 + t)) < N(1 + t) - C
+"""
+from datetime import date
+from typing import List, Optional, Tuple
+
+from .fixed_point import RATIO_SCALE, ratio_to_ppm
+from .fx import currency_id, currency_of, get_fx_table
+
+# 浮動小数点の丸め誤差に対する余裕（delta をこの割合だけ狭め、MIN_DELTA 未満のバンドは用いない）
+DELTA_MARGIN = 1e-3
+MIN_DELTA = 1e-9
+
+
+class NoMarginCallBand(object):
+    """
+    銘柄ごとの価格（円換算・丸め後）の下限と上限
+    """
+
+    def __init__(self, bounds: List[Tuple[str, int, float, float]], delta: float) -> None:
+        # (銘柄コード, 通貨 id, 下限, 上限)
+        self.bounds = bounds
+        self.delta = delta
+
+    @classmethod
+    def create(cls, transaction) -> Optional['NoMarginCallBand']:
+        """
+        transaction の現在の数量・価格（価格調整後）に対するバンド
+        数量が負の銘柄がある場合やバンドが空になる場合は None
+        """
+        arith = transaction.arith
+        st_total_value = 0
+        for security in transaction.st_portfolio.values():
+            if security['num'] < 0:
+                return None
+            st_total_value += security['price'] * security['num']
+        collateral_sum = 0
+        for security in transaction.collateral_portfolio.values():
+            if security['num'] < 0:
+                return None
+            collateral_sum += security['price'] * security['num']
+
+        if arith.is_fixed_point:
+            # 必要担保額の切り上げ（最大 1 tick）と、ppm に丸めた貸付比率・閾値で判定する
+            ratio = ratio_to_ppm(transaction.lender_loan_ratio) / ratio_to_ppm(transaction.borrower_loan_ratio)
+            threshold = ratio_to_ppm(transaction.margin_call_threshold) / RATIO_SCALE
+            rounding = 1
+        else:
+            ratio = transaction.lender_loan_ratio / transaction.borrower_loan_ratio
+            threshold = transaction.margin_call_threshold
+            rounding = 0
+        necessary_value = st_total_value * ratio
+        lower = (necessary_value + rounding) * (1 - threshold)
+        upper = necessary_value * (1 + threshold)
+        if lower <= 0 or collateral_sum <= lower or collateral_sum >= upper:
+            return None
+        delta = min((collateral_sum - lower) / (lower + collateral_sum), (upper - collateral_sum) / (upper + collateral_sum))
+        delta *= 1 - DELTA_MARGIN
+        if delta < MIN_DELTA:
+            return None
+        # 数量が 0 の銘柄の価格は評価額に影響しない
+        bounds = [
+            (code, currency_id(currency_of(security)), security['price'] * (1 - delta), security['price'] * (1 + delta))
+            for portfolio in (transaction.st_portfolio, transaction.collateral_portfolio)
+            for code, security in portfolio.items() if security['num'] != 0
+        ]
+        return cls(bounds, delta)
+
+    def contains(self, _date: date, price_getter, arith, is_local: bool = False) -> bool:
+        """
+        _date の全ての銘柄の価格がバンド内か（update_portfolio_price と同じく円換算・丸めた価格で比較する）
+        """
+        rates = get_fx_table(price_getter).rates(_date, is_local=is_local)
+        for code, cid, lower, upper in self.bounds:
+            price = price_getter.get_close_price(code, _date, is_local=is_local) * rates[cid]
+            price = arith.to_price(price)
+            if price < lower or price > upper:
+                return False
+        return True
@@ -1,8 +1,15 @@
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import date, datetime as dt
-from sre_compile import isstring
+import threading
+from typing import TYPE_CHECKING, Dict, Iterable, Optional, Tuple
 
-import pandas as pd
-import yfinance as yf
+from ..lazy_module import LazyModule
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# yfinance（pandas を含む）の読み込みには時間がかかるため、実際に価格を取得するまで import しない
+yf = LazyModule('yfinance')
 
 
 class GetPriceData(object):
@@ -11,12 +18,83 @@ class GetPriceData(object):
     現状 Yahoo! Finance から価格データを取得
     """
 
-    def __init__(self) -> None:
-        pass
+    # 1回の取得でまとめて取得する日数（銘柄ごとにこの単位で期間を区切って取得する）
+    FETCH_BLOCK_DAYS = 30
+    # 期間末尾が休日の場合に備えて余分に取得する日数
+    FETCH_MARGIN_DAYS = 10
+
+    def __init__(self, max_in_flight: int = 8) -> None:
+        # 同一ステップ内で同じ銘柄・日付の価格を何度も取得しないようにキャッシュする
+        self.close_price_cache: Dict[Tuple[str, date], float] = {}
+        self.cache_hits = 0
+        # 取得中の (銘柄, 期間) ごとの Future。同じ期間への同時リクエストは一つの取得にまとめる
+        self.max_in_flight = max_in_flight
+        self._in_flight: Dict[Tuple[str, int], Future] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @staticmethod
+    def _download_close(code: str, start_date: date, end_date: Optional[date] = None) -> 'pd.Series':
+        # yf.download はモジュール共有の状態を持ちスレッドセーフでないため、Ticker ごとに取得する
+        price_df = yf.Ticker(code).history(start=start_date, end=end_date, auto_adjust=False)
+        return price_df['Close']
+
+    def _fetch_block(self, code: str, block: int) -> Dict[date, float]:
+        """
+        block の期間内の各日付について、その日以降で最初の終値（yf.download(start=date) の先頭行と同じ）を返す
+        """
+        first_ordinal = block * self.FETCH_BLOCK_DAYS
+        start_date = date.fromordinal(first_ordinal)
+        end_date = date.fromordinal(first_ordinal + self.FETCH_BLOCK_DAYS + self.FETCH_MARGIN_DAYS)
+        price_series = self._download_close(code, start_date, end_date)
+        trade_dates = [timestamp.date() for timestamp in price_series.index]
+        values = [float(value) for value in price_series.values]
+
+        prices = {}
+        i = 0
+        for ordinal in range(first_ordinal, first_ordinal + self.FETCH_BLOCK_DAYS):
+            _date = date.fromordinal(ordinal)
+            while i < len(trade_dates) and trade_dates[i] < _date:
+                i += 1
+            if i < len(trade_dates):
+                prices[_date] = values[i]
+        return prices
 
-    def get_close_price_all(self, code: str, start_date: date = None, end_date: date = None, is_local: bool = False) -> pd.core.series.Series:
+    def _on_fetched(self, code: str, key: Tuple[str, int], future: Future) -> None:
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if future.exception() is None:
+                for _date, price in future.result().items():
+                    self.close_price_cache[(code, _date)] = price
+
+    def fetch_async(self, code: str, date: date) -> Future:
+        """
+        date を含む期間の価格取得をスレッドプールで開始する
+        同じ (銘柄, 期間) の取得が既に進行中であれば、その Future を返す
+        """
+        key = (code, date.toordinal() // self.FETCH_BLOCK_DAYS)
+        with self._lock:
+            if key in self._in_flight:
+                return self._in_flight[key]
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='price-fetch')
+            future = self._executor.submit(self._fetch_block, code, key[1])
+            self._in_flight[key] = future
+        future.add_done_callback(lambda f: self._on_fetched(code, key, f))
+        return future
+
+    def prefetch(self, codes: Iterable[str], date: date) -> None:
+        """
+        翌日分などの価格を先読みする（計算と並行して取得させるため、完了は待たない）
+        """
+        for code in codes:
+            if code == 'JPY' or (code, date) in self.close_price_cache:
+                continue
+            self.fetch_async(code, date)
+
+    def get_close_price_all(self, code: str, start_date: date = None, end_date: date = None, is_local: bool = False) -> 'pd.Series':
         # initialize start_date_str if None
-        if start_date is None or isstring(start_date):
+        if start_date is None or isinstance(start_date, str):
             start_date = dt.today()
 
         if is_local:
@@ -34,9 +112,21 @@ class GetPriceData(object):
             print("get data from local csv.")
             return 500.0
 
-        price_df = yf.download(code, start=date, progress=False)
-        price_series = price_df['Close']
-        return price_series[0]
+        key = (code, date)
+        if key in self.close_price_cache:
+            self.cache_hits += 1
+            return self.close_price_cache[key]
+
+        if hasattr(date, 'toordinal'):
+            prices = self.fetch_async(code, date).result()
+            if date in prices:
+                self.close_price_cache[key] = prices[date]
+                return prices[date]
+
+        # 期間内に取引日がない場合（直近の日付など）は従来通り date 以降を全て取得する
+        price_series = self._download_close(code, date)
+        self.close_price_cache[key] = float(price_series.iloc[0])
+        return self.close_price_cache[key]
 
     def get_today_close_price(self, code: str, is_local: bool = False) -> float:
         if code == 'JPY':
@@ -49,7 +139,7 @@ class GetPriceData(object):
         return price_series[0]
 
     @staticmethod
-    def get_weekly_close(code: str) -> pd.core.series.Series:
+    def get_weekly_close(code: str) -> 'pd.Series':
         return yf.download(code, period='7d', interbal='1d', progress=False)['Close']
 
     def get_usdjpy_close(self, date: date, is_local: bool = False):
@@ -62,5 +152,5 @@ class GetPriceData(object):
         return price_series[0]
 
     @staticmethod
-    def get_usdjpy_weekly_close() -> pd.core.series.Series:
+    def get_usdjpy_weekly_close() -> 'pd.Series':
         return yf.download('JPY=X', period='7d', interbal='1d', progress=False)['Close']
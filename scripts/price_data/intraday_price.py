@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+import hashlib
+import os
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+import zlib
+
+import numpy as np
+import pandas as pd
+
+Timestamp = Union[datetime, np.datetime64]
+
+
+class IntradayPriceData(object):
+    """
+    ローカルに保持した (時刻 × 銘柄) の分足の終値テーブルから株価を返すクラス
+    指定時刻の価格は、その時刻以前で最後の足の終値とする（先の価格を参照しない）
+    get_close_price 等は LocalPriceData と同じインターフェースで、date の代わりに時刻を受け取る
+    """
+
+    def __init__(self, panel: pd.DataFrame) -> None:
+        panel = panel.sort_index()
+        self.codes: List[str] = [str(code) for code in panel.columns]
+        self.code_index: Dict[str, int] = {code: i for i, code in enumerate(self.codes)}
+        self.timestamps = pd.DatetimeIndex(panel.index).to_numpy(dtype='datetime64[s]')
+        self.values = panel.to_numpy(dtype=np.float64)
+        self._fingerprint: Optional[str] = None
+
+    @classmethod
+    def from_csv_dir(cls, dir_path: str) -> 'IntradayPriceData':
+        """
+        {銘柄コード}.csv（時刻, 終値 のヘッダなしCSV）が置かれたディレクトリから読み込む
+        銘柄ごとに足がない時刻は直前の終値で埋める
+        """
+        series_list = []
+        for filename in sorted(os.listdir(dir_path)):
+            if not filename.endswith('.csv'):
+                continue
+            series = pd.read_csv(os.path.join(dir_path, filename), header=None, index_col=0, parse_dates=True).iloc[:, 0]
+            series_list.append(series.rename(filename[:-4]))
+        return cls(pd.concat(series_list, axis=1).sort_index().ffill().dropna())
+
+    @classmethod
+    def synthetic(cls, codes: Sequence[str], start: datetime, days: int, bars_per_day: int = 1440, seed: int = 0,
+                  volatility: float = 0.02) -> 'IntradayPriceData':
+        """
+        LocalPriceData.synthetic と同様の幾何ブラウン運動による分足（volatility は日次の値）
+        ブロックチェーン上の取引を想定し、既定では24時間分（1440本/日）の足を生成する
+        """
+        n_bars = days * bars_per_day
+        step = timedelta(days=1) / bars_per_day
+        index = pd.date_range(start, periods=n_bars, freq=step)
+        columns = {}
+        for code in codes:
+            rng = np.random.default_rng([seed, zlib.crc32(code.encode())])
+            if code.endswith('JPY=X'):
+                # 対円レート（JPY=X, EURJPY=X など）
+                initial_price = 130.0
+                sigma = volatility / 4
+            else:
+                initial_price = float(rng.integers(100, 5000))
+                sigma = volatility
+            log_returns = rng.normal(0.0, sigma / np.sqrt(bars_per_day), n_bars)
+            log_returns[0] = 0.0
+            columns[code] = initial_price * np.exp(np.cumsum(log_returns))
+        return cls(pd.DataFrame(columns, index=index))
+
+    def _row(self, timestamp: Timestamp) -> int:
+        row = int(np.searchsorted(self.timestamps, np.datetime64(timestamp, 's'), side='right')) - 1
+        if row < 0:
+            raise ValueError(f'No intraday price data at or before {timestamp}.')
+        return row
+
+    def steps(self, start: Timestamp, end: Timestamp, interval: Optional[timedelta] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        start 以上 end 未満の各ステップの時刻と、そのステップで参照する行番号を返す
+        interval を指定した場合は start から interval ごとの時刻について、その時刻以前で最後の足を参照する
+        """
+        start64 = np.datetime64(start, 's')
+        end64 = np.datetime64(end, 's')
+        if interval is None:
+            first = int(np.searchsorted(self.timestamps, start64, side='left'))
+            last = int(np.searchsorted(self.timestamps, end64, side='left'))
+            return self.timestamps[first:last], np.arange(first, last, dtype=np.int64)
+        grid = np.arange(start64, end64, np.timedelta64(int(interval.total_seconds()), 's'))
+        rows = np.searchsorted(self.timestamps, grid, side='right') - 1
+        if len(rows) > 0 and rows[0] < 0:
+            raise ValueError(f'No intraday price data at or before {start}.')
+        return grid, rows.astype(np.int64)
+
+    def get_close_price(self, code: str, timestamp: Timestamp, is_local: bool = True) -> float:
+        if code == 'JPY':
+            return 1.0
+        return float(self.values[self._row(timestamp), self.code_index[code]])
+
+    def get_close_prices(self, codes: Sequence[str], timestamp: Timestamp) -> np.ndarray:
+        row = self.values[self._row(timestamp)]
+        return np.array([row[self.code_index[code]] if code != 'JPY' else 1.0 for code in codes], dtype=np.float64)
+
+    def get_usdjpy_close(self, timestamp: Timestamp, is_local: bool = True) -> float:
+        return self.get_close_price('JPY=X', timestamp)
+
+    def time_range(self) -> Tuple[datetime, datetime]:
+        return self.timestamps[0].astype(datetime), self.timestamps[-1].astype(datetime)
+
+    def fingerprint(self) -> str:
+        """
+        価格データの内容のハッシュ（ResultCache のキーに用いる）
+        """
+        if self._fingerprint is None:
+            digest = hashlib.sha256()
+            digest.update('\n'.join(self.codes).encode())
+            digest.update(np.ascontiguousarray(self.timestamps).tobytes())
+            digest.update(np.ascontiguousarray(self.values).tobytes())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
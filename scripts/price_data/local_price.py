@@ -0,0 +1,98 @@
+from datetime import date, timedelta
+import hashlib
+import os
+from typing import Dict, List, Optional, Sequence
+import zlib
+
+import numpy as np
+import pandas as pd
+
+
+class LocalPriceData(object):
+    """
+    ローカルに保持した (日付 × 銘柄) の終値テーブルから株価を返すクラス
+    GetPriceData と同じインターフェースを持ち、ネットワークアクセスを行わない
+    """
+
+    def __init__(self, panel: pd.DataFrame) -> None:
+        panel = panel.sort_index()
+        self.codes: List[str] = [str(code) for code in panel.columns]
+        self.code_index: Dict[str, int] = {code: i for i, code in enumerate(self.codes)}
+        self.dates = np.array([pd.Timestamp(d).date().toordinal() for d in panel.index], dtype=np.int64)
+        self.values = panel.to_numpy(dtype=np.float64)
+        self._fingerprint: Optional[str] = None
+
+    @classmethod
+    def from_csv_dir(cls, dir_path: str) -> 'LocalPriceData':
+        """
+        {銘柄コード}.csv（日付, 終値 のヘッダなしCSV）が置かれたディレクトリから読み込む
+        notebook で get_close_price_all(...).to_csv(path, header=False) した形式
+        """
+        series_list = []
+        for filename in sorted(os.listdir(dir_path)):
+            if not filename.endswith('.csv'):
+                continue
+            series = pd.read_csv(os.path.join(dir_path, filename), header=None, index_col=0, parse_dates=True).iloc[:, 0]
+            series_list.append(series.rename(filename[:-4]))
+        return cls(pd.concat(series_list, axis=1).sort_index().ffill())
+
+    @classmethod
+    def synthetic(cls, codes: Sequence[str], start_date: date, days: int, seed: int = 0, volatility: float = 0.02) -> 'LocalPriceData':
+        """
+        銘柄コードと seed から決まる再現可能な価格推移（幾何ブラウン運動）を生成する
+        """
+        index = [start_date + timedelta(n) for n in range(days)]
+        columns = {}
+        for code in codes:
+            rng = np.random.default_rng([seed, zlib.crc32(code.encode())])
+            if code.endswith('JPY=X'):
+                # 対円レート（JPY=X, EURJPY=X など）
+                initial_price = 130.0
+                sigma = volatility / 4
+            else:
+                initial_price = float(rng.integers(100, 5000))
+                sigma = volatility
+            log_returns = rng.normal(0.0, sigma, days)
+            log_returns[0] = 0.0
+            columns[code] = initial_price * np.exp(np.cumsum(log_returns))
+        return cls(pd.DataFrame(columns, index=index))
+
+    def _row(self, _date: date) -> int:
+        # yf.download(code, start=date) の先頭行と同じく、指定日以降で最初の日付の行
+        row = int(np.searchsorted(self.dates, _date.toordinal(), side='left'))
+        if row >= len(self.dates):
+            raise ValueError(f'No local price data on or after {_date}.')
+        return row
+
+    def get_close_price_all(self, code: str, start_date: date = None, end_date: date = None, is_local: bool = True) -> pd.Series:
+        start = 0 if start_date is None else int(np.searchsorted(self.dates, start_date.toordinal(), side='left'))
+        end = len(self.dates) if end_date is None else int(np.searchsorted(self.dates, end_date.toordinal(), side='left'))
+        index = pd.DatetimeIndex([date.fromordinal(int(d)) for d in self.dates[start:end]])
+        return pd.Series(self.values[start:end, self.code_index[code]], index=index, name=code)
+
+    def get_close_price(self, code: str, date: date, is_local: bool = True) -> float:
+        if code == 'JPY':
+            return 1.0
+        return float(self.values[self._row(date), self.code_index[code]])
+
+    def get_close_prices(self, codes: Sequence[str], date: date) -> np.ndarray:
+        """
+        複数銘柄の終値を一括で返す（LagEngine などで価格ベクトルとして用いる）
+        """
+        row = self.values[self._row(date)]
+        return np.array([row[self.code_index[code]] if code != 'JPY' else 1.0 for code in codes], dtype=np.float64)
+
+    def get_usdjpy_close(self, date: date, is_local: bool = True) -> float:
+        return self.get_close_price('JPY=X', date)
+
+    def fingerprint(self) -> str:
+        """
+        価格データの内容のハッシュ（ResultCache のキーに用いる）
+        """
+        if self._fingerprint is None:
+            digest = hashlib.sha256()
+            digest.update('\n'.join(self.codes).encode())
+            digest.update(np.ascontiguousarray(self.dates).tobytes())
+            digest.update(np.ascontiguousarray(self.values).tobytes())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
@@ -0,0 +1,110 @@
+"""
+複数プロセスで共有する (日付 × 銘柄) の終値テーブル
+親プロセスで一度だけ共有メモリに配置し、各ワーカーはコピーせずに参照する（ワーカー数によらずデータは1つ）
+
+ex.)
+    with SharedPricePanel.publish(LocalPriceData.from_csv_dir('./data/prices')) as panel:
+        with multiprocessing.Pool(32, initializer=attach_price_getter, initargs=(panel.handle,)) as pool:
+            results = pool.map(run_scenario, scenarios)
+"""
+from multiprocessing import shared_memory
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from .. import utils
+from .local_price import LocalPriceData
+
+
+class SharedPanelHandle(NamedTuple):
+    """
+    ワーカーに渡す共有メモリの情報（pickle して渡すため、価格の配列自体は含まない）
+    """
+    name: str
+    codes: Tuple[str, ...]
+    n_dates: int
+    fingerprint: str
+
+
+def _panel_arrays(buffer, n_dates: int, n_codes: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    共有メモリ上の配列（先頭に日付の序数 int64、続いて終値 float64 の (日付 × 銘柄) の行列）
+    """
+    dates = np.ndarray((n_dates,), dtype=np.int64, buffer=buffer)
+    values = np.ndarray((n_dates, n_codes), dtype=np.float64, buffer=buffer, offset=dates.nbytes)
+    return dates, values
+
+
+class SharedPriceData(LocalPriceData):
+    """
+    共有メモリ上の終値テーブルを参照する LocalPriceData
+    配列は読み取り専用で、銘柄・日付の索引も作成後は変更しない
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, handle: SharedPanelHandle) -> None:
+        self._shm = shm
+        self.handle = handle
+        self.codes: List[str] = list(handle.codes)
+        self.code_index = {code: i for i, code in enumerate(self.codes)}
+        self.dates, self.values = _panel_arrays(shm.buf, handle.n_dates, len(self.codes))
+        self.dates.flags.writeable = False
+        self.values.flags.writeable = False
+        self._fingerprint: Optional[str] = handle.fingerprint
+
+    @classmethod
+    def attach(cls, handle: SharedPanelHandle) -> 'SharedPriceData':
+        return cls(shared_memory.SharedMemory(name=handle.name), handle)
+
+    def close(self) -> None:
+        """
+        このプロセスでの参照をやめる（共有メモリ自体は SharedPricePanel.close() まで残る）
+        """
+        self.dates = self.values = None  # type: ignore
+        self._shm.close()
+
+
+class SharedPricePanel(object):
+    """
+    共有メモリに配置した終値テーブルの所有者（親プロセス側）
+    close() で共有メモリを解放する（with 文の終了時にも解放する）
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, handle: SharedPanelHandle) -> None:
+        self.shm = shm
+        self.handle = handle
+        self.price_data = SharedPriceData(shm, handle)
+
+    @classmethod
+    def publish(cls, price_data: LocalPriceData, name: Optional[str] = None) -> 'SharedPricePanel':
+        dates = np.ascontiguousarray(price_data.dates, dtype=np.int64)
+        values = np.ascontiguousarray(price_data.values, dtype=np.float64)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=max(dates.nbytes + values.nbytes, 1))
+        shared_dates, shared_values = _panel_arrays(shm.buf, len(dates), len(price_data.codes))
+        shared_dates[:] = dates
+        shared_values[:] = values
+        handle = SharedPanelHandle(shm.name, tuple(price_data.codes), len(dates), price_data.fingerprint())
+        return cls(shm, handle)
+
+    def close(self) -> None:
+        self.price_data.close()
+        self.shm.unlink()
+
+    def __enter__(self) -> 'SharedPricePanel':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+_attached: Optional[SharedPriceData] = None
+
+
+def attach_price_getter(handle: SharedPanelHandle) -> SharedPriceData:
+    """
+    ワーカープロセスで共有メモリの終値テーブルを株価取得クラスに設定する（Pool の initializer 用）
+    """
+    global _attached
+    if _attached is None or _attached.handle != handle:
+        _attached = SharedPriceData.attach(handle)
+    utils.set_price_getter(_attached)
+    return _attached
@@ -0,0 +1,158 @@
+"""
+取引のステップ処理のフェーズ別計測
+option['profile'] が True の場合のみ計測し、それ以外は何もしない NULL_PROFILER を用いる
+"""
+from collections import defaultdict
+import contextlib
+import sys
+import time
+from typing import Dict, Iterator, List, Mapping
+
+from . import utils
+
+
+class _TimedStream(object):
+    """
+    標準出力への書き込み時間を計測するためのラッパー
+    """
+
+    def __init__(self, stream) -> None:
+        self.stream = stream
+        self.seconds = 0.0
+
+    def write(self, text: str) -> int:
+        started = time.perf_counter()
+        written = self.stream.write(text)
+        self.seconds += time.perf_counter() - started
+        return written
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+    def __getattr__(self, name: str):
+        return getattr(self.stream, name)
+
+
+class StepProfiler(object):
+    """
+    lap(phase) を呼ぶたびに、直前の lap からの経過時間を phase に加算する
+    capture_print() の中では print にかかった時間を各フェーズから差し引き、'print' として別に集計する
+    """
+
+    def __init__(self) -> None:
+        self.phase_seconds: Dict[str, float] = defaultdict(float)
+        self.counters: Dict[str, int] = defaultdict(int)
+        self._stream = None
+        self._last = time.perf_counter()
+        self._print_mark = 0.0
+        self._cache_hits_mark = 0
+        self._collateral_nums: Dict[str, int] = {}
+
+    def _print_seconds(self) -> float:
+        return self._stream.seconds if self._stream is not None else 0.0
+
+    @contextlib.contextmanager
+    def capture_print(self) -> Iterator[None]:
+        original_stdout = sys.stdout
+        self._stream = _TimedStream(original_stdout)
+        sys.stdout = self._stream  # type: ignore
+        try:
+            yield
+        finally:
+            sys.stdout = original_stdout
+            self._stream = None
+
+    def start(self) -> None:
+        self._last = time.perf_counter()
+        self._print_mark = self._print_seconds()
+        self._cache_hits_mark = getattr(utils.price_getter, 'cache_hits', 0)
+
+    def lap(self, phase: str) -> None:
+        now = time.perf_counter()
+        print_seconds = self._print_seconds()
+        printed = print_seconds - self._print_mark
+        self.phase_seconds[phase] += (now - self._last) - printed
+        if printed > 0:
+            self.phase_seconds['print'] += printed
+        self._last = now
+        self._print_mark = print_seconds
+
+    def count(self, name: str, num: int = 1) -> None:
+        self.counters[name] += num
+
+    def begin_moves(self, portfolio: Mapping) -> None:
+        self._collateral_nums = {code: item['num'] for code, item in portfolio.items()}
+
+    def end_moves(self, portfolio: Mapping) -> None:
+        moved = 0
+        for code, item in portfolio.items():
+            moved += abs(item['num'] - self._collateral_nums.get(code, 0))
+        self.counters['tokens_moved'] += moved
+        self._collateral_nums = {code: item['num'] for code, item in portfolio.items()}
+
+    def finish_step(self) -> None:
+        self.lap('other')
+        self.counters['steps'] += 1
+        self.counters['price_cache_hits'] += getattr(utils.price_getter, 'cache_hits', 0) - self._cache_hits_mark
+
+    def summary(self) -> dict:
+        return {
+            'phase_seconds': dict(self.phase_seconds),
+            'counters': dict(self.counters)
+        }
+
+
+class _NullProfiler(object):
+    """
+    計測を行わない場合のプロファイラ（全て何もしない）
+    """
+
+    def capture_print(self):
+        return contextlib.nullcontext()
+
+    def start(self) -> None:
+        pass
+
+    def lap(self, phase: str) -> None:
+        pass
+
+    def count(self, name: str, num: int = 1) -> None:
+        pass
+
+    def begin_moves(self, portfolio: Mapping) -> None:
+        pass
+
+    def end_moves(self, portfolio: Mapping) -> None:
+        pass
+
+    def finish_step(self) -> None:
+        pass
+
+    def summary(self) -> dict:
+        return {}
+
+
+NULL_PROFILER = _NullProfiler()
+
+
+def summarize_profiles(logs_list: List[dict]) -> dict:
+    """
+    複数の実行結果（execute() の返り値）の計測結果を合算し、フェーズごとの割合を付けて返す
+    """
+    phase_seconds: Dict[str, float] = defaultdict(float)
+    counters: Dict[str, int] = defaultdict(int)
+    for logs in logs_list:
+        if 'profile' not in logs:
+            continue
+        for phase, seconds in logs['profile']['phase_seconds'].items():
+            phase_seconds[phase] += seconds
+        for name, num in logs['profile']['counters'].items():
+            counters[name] += num
+
+    total_seconds = sum(phase_seconds.values())
+    return {
+        'total_seconds': total_seconds,
+        'phase_seconds': dict(sorted(phase_seconds.items(), key=lambda x: x[1], reverse=True)),
+        'phase_ratio': {phase: seconds / total_seconds for phase, seconds in phase_seconds.items()} if total_seconds > 0 else {},
+        'counters': dict(counters)
+    }
@@ -0,0 +1,200 @@
+"""
+シミュレーション結果（execute() の返り値のログ）のキャッシュ
+取引クラス・オプション・ポートフォリオ・期間・価格データ・シミュレータのソースから求めたハッシュをキーとし、
+いずれかが変われば別のエントリとなる。キャッシュの合計サイズが上限を超えた場合は最後に使われた時刻が古いものから削除する
+
+ex.)
+    cache = ResultCache('./.simulation_cache')
+    logs = cached_execute(ExecuteAutoAdjustmentTransactionMulti, jct_portfolio, st_portfolio, start_date, end_date, options, cache)
+"""
+from datetime import date
+import glob
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .types import TransactionOption
+from .utils import get_price_getter
+
+# 各取引クラスのオプションの既定値（指定なしと既定値の指定を同じキーにする）
+OPTION_DEFAULTS: Dict[str, Any] = {
+    'borrower': 'Borrower(A)',
+    'lender': 'Lender(B)',
+    'borrower_loan_ratio': 1.0,
+    'lender_loan_ratio': 1.0,
+    'auto_deposit': True,
+    'is_dummy_data': False,
+    'is_reverse': False,
+    'margin_call_threshold': 0.0,
+    'is_manual': False,
+    'compact_portfolio': False,
+    'fixed_point': False,
+    'rebalance_band': None,
+    'reference_delay': 0,
+    'online_stats': False,
+    'keep_logs': True,
+}
+# 返り値のログに影響しないオプション
+IGNORED_OPTIONS = ('print_log', 'price_band', 'live_monitor')
+# 結果に影響するシミュレータのソースのディレクトリ（配下の *.py のいずれかが変更されるとキャッシュは無効になる）
+SIMULATOR_SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_simulator_version: Optional[str] = None
+
+
+def simulator_version() -> str:
+    """
+    SIMULATOR_SOURCE_DIR 配下の全ての *.py の内容のハッシュ
+    """
+    global _simulator_version
+    if _simulator_version is None:
+        digest = hashlib.sha256()
+        paths = glob.glob(os.path.join(SIMULATOR_SOURCE_DIR, '**', '*.py'), recursive=True)
+        for path in sorted(paths):
+            with open(path, 'rb') as f:
+                digest.update(os.path.relpath(path, SIMULATOR_SOURCE_DIR).encode())
+                digest.update(f.read())
+        _simulator_version = digest.hexdigest()
+    return _simulator_version
+
+
+def normalize_options(options: TransactionOption) -> Dict[str, Any]:
+    normalized = dict(OPTION_DEFAULTS)
+    for key, value in options.items():
+        if key not in IGNORED_OPTIONS:
+            normalized[key] = value
+    return normalized
+
+
+def normalize_portfolio(portfolio: dict) -> Dict[str, dict]:
+    """
+    price は取引開始時に更新されるため、キーには含めない
+    """
+    return {code: {key: value for key, value in item.items() if key != 'price'} for code, item in portfolio.items()}
+
+
+def price_data_fingerprint(price_getter) -> Optional[str]:
+    """
+    fingerprint() を持つ株価取得クラス（LocalPriceData など）であればその値、それ以外は None（キャッシュしない）
+    """
+    fingerprint = getattr(price_getter, 'fingerprint', None)
+    return fingerprint() if fingerprint is not None else None
+
+
+def cache_key(transaction_class, jct_portfolio: dict, st_portfolio: dict, start_date: date, end_date: date, options: TransactionOption,
+              price_fingerprint: str) -> str:
+    payload = {
+        'class': f'{transaction_class.__module__}.{transaction_class.__qualname__}',
+        'options': normalize_options(options),
+        'jct_portfolio': normalize_portfolio(jct_portfolio),
+        'st_portfolio': normalize_portfolio(st_portfolio),
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'price_data': price_fingerprint,
+        'version': simulator_version(),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ResultCache(object):
+    """
+    {キー}.pkl としてログを保存するディレクトリ
+    読み込みのたびにファイルの更新時刻を現在時刻にし、合計サイズが max_bytes を超えたら更新時刻の古い順に削除する（LRU）
+    """
+
+    def __init__(self, cache_dir: str = '.simulation_cache', max_bytes: int = 512 * 1024 * 1024) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.pkl')
+
+    def get(self, key: str) -> Optional[Dict[str, list]]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                logs = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return logs
+
+    def put(self, key: str, logs: Dict[str, list]) -> None:
+        # 書き込み途中のファイルを読まないよう、一時ファイルに書いてから置き換える
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(logs, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(key))
+        self.evict()
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        """
+        (最終使用時刻, サイズ, パス) のリスト
+        """
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith('.pkl'):
+                continue
+            path = os.path.join(self.cache_dir, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self) -> int:
+        """
+        合計サイズが max_bytes 以下になるまで古いエントリを削除し、削除した数を返す
+        """
+        entries = sorted(self.entries())
+        total_bytes = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+            removed += 1
+        return removed
+
+    def clear(self) -> None:
+        for _, _, path in self.entries():
+            os.remove(path)
+
+
+def cached_execute(transaction_class, jct_portfolio: dict, st_portfolio: dict, start_date: date, end_date: date, options: TransactionOption,
+                   cache: ResultCache) -> Dict[str, list]:
+    """
+    キャッシュにあればそのログを、なければ transaction_class(...).execute() を実行して保存したログを返す
+    価格データの fingerprint が得られない場合（ネットワークから取得する場合など）と、
+    実行時間を記録する profile オプション、イベントを書き出す ledger オプション、メモリ使用量を記録する memory_probe オプションの場合はキャッシュしない
+    """
+    fingerprint = price_data_fingerprint(get_price_getter())
+    if fingerprint is None or ('profile' in options and options['profile']) or ('ledger' in options and options['ledger'] is not None) \
+            or ('memory_probe' in options and options['memory_probe']):
+        return transaction_class(jct_portfolio, st_portfolio, start_date, end_date, options).execute()
+
+    key = cache_key(transaction_class, jct_portfolio, st_portfolio, start_date, end_date, options, fingerprint)
+    logs = cache.get(key)
+    if logs is not None:
+        print(f'Loaded cached result: {key[:12]}')
+        return logs
+
+    started = time.perf_counter()
+    logs = transaction_class(jct_portfolio, st_portfolio, start_date, end_date, options).execute()
+    cache.put(key, logs)
+    print(f'Cached result: {key[:12]} ({time.perf_counter() - started:.2f}s)')
+    return logs
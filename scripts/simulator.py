@@ -12,6 +12,8 @@ GlobalJCT()
     - 参加者が担保に入れた有価証券全てからその価値を算出し、全員が同じものを共有
     - 全体でのポートフォリオを把握したうえで時価を更新
     - 参加者ごとには数量を把握
+ArrayGlobalJCT()
+    - GlobalJCT を参加者数・移動数が多い場合に対応させたもの（参加者を整数 id、数量を NumPy の配列で管理）
 1-b.
 VariableLocalTransaction()
     - JCT は取引ごとに独立のもの
@@ -33,25 +35,27 @@ VariableRespectiveTransaction()
 import copy
 import math
 from pprint import pprint
+from typing import Dict, List, Sequence, Union
 
-from .price_data.get_price import GetPriceData
+import numpy as np
 
-price_getter = GetPriceData()
+from .fx import CURRENCIES, CURRENCY_USD, currency_id, currency_of, get_fx_table
+from .lag import fetch_price_vector
+from .utils import get_price_getter
 
 
 def update_portfolio_price(portfolio, date, print_log=False):
     """
     ポートフォリオに含まれる各有価証券について時価を更新し、トータルの価値を返す
     """
-    usdjpy = price_getter.get_usdjpy_close(date)
+    price_getter = get_price_getter()
+    fx_table = get_fx_table(price_getter)
     total_value = 0
     if print_log:
         print(f'{date}: Price updating...')
 
     for code in list(portfolio.keys()):
-        new_price = price_getter.get_close_price(code, date)
-        if portfolio[code]['is_usd']:
-            new_price *= usdjpy
+        new_price = price_getter.get_close_price(code, date) * fx_table.rate(currency_of(portfolio[code]), date)
         new_price = math.floor(new_price * 10) / 10
         portfolio[code]['price'] = new_price
 
@@ -294,12 +298,11 @@ class VariableGlobalTransaction(object):
         """
         STのポートフォリオに含まれる各有価証券について時価を更新する
         """
-        usdjpy = price_getter.get_usdjpy_close(date_str)
+        price_getter = get_price_getter()
+        fx_table = get_fx_table(price_getter)
         st_total = 0
         for code in list(self.st_portfolio.keys()):
-            new_price = price_getter.get_close_price(code, date_str)
-            if self.st_portfolio[code]['is_usd']:
-                new_price *= usdjpy
+            new_price = price_getter.get_close_price(code, date_str) * fx_table.rate(currency_of(self.st_portfolio[code]), date_str)
             self.st_portfolio[code]['price'] = new_price
             # print(code, ': ', new_price)
             st_total += new_price * self.st_portfolio[code]['num']
@@ -368,7 +371,8 @@ class VariableGlobalJCT(object):
                     },
                 }
         """
-        usdjpy = price_getter.get_usdjpy_close(date_str)
+        price_getter = get_price_getter()
+        fx_table = get_fx_table(price_getter)
         add_jct_portfolio_total = 0
 
         for code in jct_portfolio:
@@ -378,9 +382,7 @@ class VariableGlobalJCT(object):
             else:
                 self.jct_portfolio[code] = jct_portfolio[code].copy()
 
-            price = price_getter.get_close_price(code, date_str)
-            if jct_portfolio[code]['is_usd']:
-                price *= usdjpy
+            price = price_getter.get_close_price(code, date_str) * fx_table.rate(currency_of(jct_portfolio[code]), date_str)
             add_jct_portfolio_total += price * num
 
         if self.jct_num == 0:
@@ -406,14 +408,13 @@ class VariableGlobalJCT(object):
         """
         JCTのポートフォリオに含まれる各有価証券について時価を更新する
         """
-        usdjpy = price_getter.get_usdjpy_close(date_str)
+        price_getter = get_price_getter()
+        fx_table = get_fx_table(price_getter)
         new_jct_total_value = 0
 
         for code in self.jct_portfolio:
             num = self.jct_portfolio[code]['num']
-            new_price = price_getter.get_close_price(code, date_str)
-            if self.jct_portfolio[code]['is_usd']:
-                new_price *= usdjpy
+            new_price = price_getter.get_close_price(code, date_str) * fx_table.rate(currency_of(self.jct_portfolio[code]), date_str)
 
             print(f'{code}: {new_price}')
             self.jct_portfolio[code]['price'] = new_price
@@ -432,3 +433,188 @@ class VariableGlobalJCT(object):
         self.users[_from]['total_jct_num'] -= num
         self.users[to]['total_jct_num'] += num
         print(self.users)
+
+
+class ArrayGlobalJCT(object):
+    """
+    可変JCT（VariableGlobalJCT を多数の参加者・移動に対応させたもの）
+    参加者は登録順の整数 id で管理し、JCT の保有数量と銘柄ごとの差入数量を NumPy の配列で保持する
+    - update_price: 全体のポートフォリオの時価を一括で更新する
+    - move_jct_batch: 複数の移動をまとめて反映する
+    """
+
+    def __init__(self, print_log: bool = False) -> None:
+        self.print_log = print_log
+        self.user_ids: Dict[str, int] = {}
+        self.user_names: List[str] = []
+        self.codes: List[str] = []
+        self.code_index: Dict[str, int] = {}
+        # 銘柄ごとの通貨 id（fx.py）
+        self.currency_ids = np.zeros(0, dtype=np.int64)
+        self.prices = np.zeros(0, dtype=np.float64)
+        # 全体のポートフォリオの銘柄ごとの数量
+        self.nums = np.zeros(0, dtype=np.int64)
+        # 参加者ごとの JCT の数量と、参加者 × 銘柄の差入数量（容量は倍々に確保する）
+        self._balances = np.zeros(0, dtype=np.float64)
+        self._collateral = np.zeros((0, 0), dtype=np.int64)
+        self.jct_num = 0.0
+        self.jct_price = 0.0
+
+    @property
+    def user_num(self) -> int:
+        return len(self.user_names)
+
+    @property
+    def balances(self) -> np.ndarray:
+        return self._balances[:self.user_num]
+
+    @property
+    def collateral(self) -> np.ndarray:
+        return self._collateral[:self.user_num, :len(self.codes)]
+
+    def _register_user(self, user_name: str) -> int:
+        user_id = self.user_ids.get(user_name)
+        if user_id is not None:
+            return user_id
+        user_id = self.user_num
+        if user_id >= len(self._balances):
+            capacity = max(2 * len(self._balances), 16)
+            self._balances = np.concatenate([self._balances, np.zeros(capacity - len(self._balances))])
+            collateral = np.zeros((capacity, self._collateral.shape[1]), dtype=np.int64)
+            collateral[:user_id] = self._collateral[:user_id]
+            self._collateral = collateral
+        self.user_ids[user_name] = user_id
+        self.user_names.append(user_name)
+        return user_id
+
+    def _register_code(self, code: str, currency: str) -> int:
+        idx = self.code_index.get(code)
+        if idx is not None:
+            return idx
+        idx = len(self.codes)
+        if idx >= self._collateral.shape[1]:
+            capacity = max(2 * self._collateral.shape[1], 8)
+            collateral = np.zeros((self._collateral.shape[0], capacity), dtype=np.int64)
+            collateral[:, :idx] = self._collateral[:, :idx]
+            self._collateral = collateral
+        self.code_index[code] = idx
+        self.codes.append(code)
+        self.currency_ids = np.append(self.currency_ids, currency_id(currency))
+        self.prices = np.append(self.prices, 0.0)
+        self.nums = np.append(self.nums, 0)
+        return idx
+
+    def user_id(self, user: Union[str, int]) -> int:
+        if isinstance(user, str):
+            if user not in self.user_ids:
+                raise ValueError(f'Unknown user: {user}')
+            return self.user_ids[user]
+        if not 0 <= user < self.user_num:
+            raise ValueError(f'Unknown user id: {user}')
+        return int(user)
+
+    def _to_ids(self, users: Union[Sequence[Union[str, int]], np.ndarray]) -> np.ndarray:
+        if isinstance(users, np.ndarray) and users.dtype.kind in 'iu':
+            ids = users.astype(np.int64, copy=False)
+            if len(ids) and (ids.min() < 0 or ids.max() >= self.user_num):
+                raise ValueError(f'Unknown user id in {ids}')
+            return ids
+        return np.fromiter((self.user_id(user) for user in users), dtype=np.int64, count=len(users))
+
+    def add_jct(self, user_name: str, jct_portfolio: dict, date_str) -> int:
+        """
+        VariableGlobalJCT.add_jct と同じく、差し入れた有価証券の時価に応じた JCT を発行し、参加者の id を返す
+        """
+        price_getter = get_price_getter()
+        fx_table = get_fx_table(price_getter)
+        user_id = self._register_user(user_name)
+        add_jct_portfolio_total = 0
+
+        for code in jct_portfolio:
+            num = jct_portfolio[code]['num']
+            currency = currency_of(jct_portfolio[code])
+            idx = self._register_code(code, currency)
+            self.nums[idx] += num
+            self._collateral[user_id, idx] += num
+
+            price = price_getter.get_close_price(code, date_str) * fx_table.rate(currency, date_str)
+            add_jct_portfolio_total += price * num
+
+        if self.jct_num == 0:
+            add_num = add_jct_portfolio_total
+            self.jct_price = 1.0
+        else:
+            add_num = add_jct_portfolio_total / self.jct_price
+        self.jct_num += add_num
+        self._balances[user_id] += add_num
+        return user_id
+
+    def update_price(self, date_str) -> float:
+        """
+        全体のポートフォリオの時価を一括で更新し、JCT の価格を返す
+        """
+        price_getter = get_price_getter()
+        rates = get_fx_table(price_getter).rates(date_str)
+        prices = fetch_price_vector(price_getter, self.codes, date_str)
+        self.prices = prices * np.asarray(rates)[self.currency_ids]
+        if self.print_log:
+            for code, price in zip(self.codes, self.prices):
+                print(f'{code}: {price}')
+        self.jct_price = float(np.dot(self.prices, self.nums)) / self.jct_num
+        return self.jct_price
+
+    def get_jct_price(self) -> float:
+        return self.jct_price
+
+    def get_jct_num(self) -> float:
+        return self.jct_num
+
+    def get_balance(self, user: Union[str, int]) -> float:
+        return float(self._balances[self.user_id(user)])
+
+    def move_jct(self, _from: Union[str, int], to: Union[str, int], num: float) -> None:
+        from_id, to_id = self.user_id(_from), self.user_id(to)
+        if self.print_log:
+            print(f'move {num} from {_from} to {to}')
+        self._balances[from_id] -= num
+        self._balances[to_id] += num
+
+    def move_jct_batch(self, froms: Union[Sequence[Union[str, int]], np.ndarray], tos: Union[Sequence[Union[str, int]], np.ndarray],
+                       nums: Union[Sequence[float], np.ndarray]) -> None:
+        """
+        froms[i] から tos[i] へ nums[i] の移動をまとめて反映する（移動の順序によらず結果は同じ）
+        """
+        from_ids, to_ids = self._to_ids(froms), self._to_ids(tos)
+        nums = np.asarray(nums, dtype=np.float64)
+        if not len(from_ids) == len(to_ids) == len(nums):
+            raise ValueError(f'froms, tos and nums must have the same length: {len(from_ids)}, {len(to_ids)}, {len(nums)}')
+        user_num = self.user_num
+        self._balances[:user_num] += np.bincount(to_ids, weights=nums, minlength=user_num) - np.bincount(from_ids, weights=nums, minlength=user_num)
+
+    def collateral_values(self) -> np.ndarray:
+        """
+        参加者ごとの差入担保の時価（直近の update_price の価格による）
+        """
+        return self.collateral @ self.prices
+
+    def _code_item(self, idx: int, num: int) -> dict:
+        currency = CURRENCIES[self.currency_ids[idx]]
+        item = {'num': num, 'is_usd': bool(self.currency_ids[idx] == CURRENCY_USD)}
+        if currency not in ('JPY', 'USD'):
+            item['currency'] = currency
+        return item
+
+    def to_users(self) -> Dict[str, dict]:
+        """
+        VariableGlobalJCT.users と同じ形式の dict
+        """
+        users: Dict[str, dict] = {}
+        collateral = self.collateral
+        for user_id, user_name in enumerate(self.user_names):
+            user = {
+                code: self._code_item(idx, int(collateral[user_id, idx]))
+                for idx, code in enumerate(self.codes) if collateral[user_id, idx] != 0
+            }
+            user['total_jct_num'] = float(self._balances[user_id])
+            users[user_name] = user
+        return users
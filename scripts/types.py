@@ -1,17 +1,25 @@
-from typing import Optional, TypedDict
+from typing import Any, Optional, TypedDict
 
-PortfolioItem = TypedDict('PortfolioItem', {
-    'num': int,
-    'price': int,
-    'is_usd': bool
-})
-PortfolioWithPriorityItem = TypedDict('PortfolioWithPriorityItem', {
-    'num': int,
-    'price': int,
-    'priority': Optional[int],
-    'is_usd': bool
-})
+# 'currency' は JPY / USD 以外の通貨の場合のみ指定する（省略時は is_usd から決める。fx.py）
+_CurrencyItem = TypedDict('_CurrencyItem', {
+    'currency': str
+}, total=False)
 
+
+class PortfolioItem(_CurrencyItem):
+    num: int
+    price: int
+    is_usd: bool
+
+
+class PortfolioWithPriorityItem(_CurrencyItem):
+    num: int
+    price: int
+    priority: Optional[int]
+    is_usd: bool
+
+
+# オプションはいずれも省略でき、省略時は各クラスの既定値を使う
 TransactionOption = TypedDict('TransactionOption', {
     'borrower': Optional[str],
     'lender': Optional[str],
@@ -23,4 +31,15 @@ TransactionOption = TypedDict('TransactionOption', {
     'is_reverse': Optional[bool],
     'margin_call_threshold': Optional[float],
     'is_manual': Optional[bool],
-})
+    'profile': Optional[bool],
+    'compact_portfolio': Optional[bool],
+    'fixed_point': Optional[bool],
+    'rebalance_band': Optional[float],
+    'reference_delay': Optional[int],
+    'online_stats': Optional[bool],
+    'keep_logs': Optional[bool],
+    'ledger': Optional[Any],
+    'price_band': Optional[bool],
+    'memory_probe': Optional[int],
+    'live_monitor': Optional[int],
+}, total=False)
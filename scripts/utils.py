@@ -1,24 +1,97 @@
 from datetime import date
-import math
-from .price_data.get_price import GetPriceData
+from typing import Any
 
-price_getter = GetPriceData()
+from .compact_portfolio import CompactPortfolio
+from .fixed_point import FLOAT_ARITHMETIC, Arithmetic
+from .fx import CURRENCY_USD, clear_fx_tables, currency_of, fx_codes, get_fx_table
+from .lazy_module import LazyModule
 
+# CompactPortfolio の価格更新で使うまで numpy は読み込まない
+np = LazyModule('numpy')
 
-def update_portfolio_price(portfolio, date: date, print_log: bool = False, is_dummy_data: bool = False) -> int:
+# 株価取得クラスは初めて使うときに作成する（utils.price_getter でも参照できる）
+_price_getter = None
+
+
+def get_price_getter():
+    """
+    時価更新に用いる株価取得クラスを返す
+    set_price_getter で差し替えられていなければ、初回呼び出し時に GetPriceData を作成する
+    """
+    global _price_getter
+    if _price_getter is None:
+        from .price_data.get_price import GetPriceData
+        _price_getter = GetPriceData()
+    return _price_getter
+
+
+def set_price_getter(getter) -> None:
+    """
+    時価更新に用いる株価取得クラスを差し替える（LocalPriceData などのローカルデータを使う場合）
+    """
+    global _price_getter
+    _price_getter = getter
+    clear_fx_tables()
+
+
+def __getattr__(name: str) -> Any:
+    if name == 'price_getter':
+        return get_price_getter()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def prefetch_portfolio_price(portfolios, date: date) -> None:
+    """
+    株価取得クラスが先読みに対応していれば、ポートフォリオに含まれる銘柄と為替の価格取得を開始しておく
+    """
+    prefetch = getattr(get_price_getter(), 'prefetch', None)
+    if prefetch is None:
+        return
+    codes = set(fx_codes())
+    for portfolio in portfolios:
+        codes.update(portfolio.keys())
+    prefetch(codes, date)
+
+
+def update_portfolio_price(portfolio, date: date, print_log: bool = False, is_dummy_data: bool = False, arith: Arithmetic = FLOAT_ARITHMETIC, price_getter=None) -> int:
     """
     ポートフォリオに含まれる各有価証券について時価を更新し、トータルの価値を返す
+    arith が FIXED_POINT_ARITHMETIC の場合、価格と価値は 0.1円単位の整数となる
+    price_getter を指定した場合（LaggedPriceReference など）はその株価取得クラスを用いる
+    対円レートは株価取得クラスごとの FXTable から日付単位で取得する（fx.py）
     """
-    usdjpy = price_getter.get_usdjpy_close(date, is_local=is_dummy_data)
+    if price_getter is None:
+        price_getter = get_price_getter()
+    fx_table = get_fx_table(price_getter)
+    rates = fx_table.rates(date, is_local=is_dummy_data)
     total_value = 0
     if print_log:
         print(f'{date}: Price updating...')
 
+    if isinstance(portfolio, CompactPortfolio):
+        # 円換算・丸めは通貨 id の配列でまとめて行い、並列配列を直接更新する（計算結果は下の dict の場合と同じ）
+        if len(portfolio) == 0:
+            return total_value
+        raw_prices = np.array([price_getter.get_close_price(code, date, is_local=is_dummy_data) for code in portfolio.codes], dtype=np.float64)
+        currency_ids = np.frombuffer(portfolio.currency_ids, dtype=np.int8)
+        new_prices = arith.to_prices(raw_prices * np.asarray(rates)[currency_ids])
+        np.frombuffer(portfolio.prices, dtype=new_prices.dtype)[:] = new_prices
+
+        # 合計は dict の場合と同じ順序で加算する
+        for code, new_price, num in zip(portfolio.codes, new_prices.tolist(), portfolio.nums):
+            if print_log:
+                print(f'{code}: {new_price}')
+            total_value += new_price * num
+        return total_value
+
     for code in list(portfolio.keys()):
         new_price = price_getter.get_close_price(code, date, is_local=is_dummy_data)
-        if portfolio[code]['is_usd']:
-            new_price *= usdjpy
-        new_price = math.floor(new_price * 10) / 10
+        currency = currency_of(portfolio[code])
+        if currency == 'USD':
+            new_price *= rates[CURRENCY_USD]
+        elif currency != 'JPY':
+            new_price *= fx_table.rate(currency, date, is_local=is_dummy_data)
+        new_price = arith.to_price(new_price)
         portfolio[code]['price'] = new_price
 
         if print_log:
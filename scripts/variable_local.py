@@ -2,11 +2,34 @@ import copy
 from datetime import date
 import math
 from pprint import pprint
-from typing import Dict, Union
+from typing import Any, Dict, Union
 
 from scripts.types import PortfolioItem, PortfolioWithPriorityItem, TransactionOption
 
-from .utils import update_portfolio_price
+from .compact_portfolio import CompactPortfolio
+from .deferred_log import DEFERRED_PORTFOLIO_KEYS, DeferredSteps
+from .fixed_point import JCT_PRICE_SCALE, PRICE_SCALE, ceil_div, fixed_point_rows_to_yen, get_arithmetic
+from .fx import currency_item
+from .inventory import attach_portfolio
+from .lag import LaggedPriceReference
+from .live_monitor import LiveMonitor
+from .memory_probe import MemoryProbe
+from .online_stats import OnlineLogStats
+from .price_band import NoMarginCallBand
+from .profiler import NULL_PROFILER, StepProfiler
+from .utils import get_price_getter, update_portfolio_price
+
+# 評価を省略した日（バンド内の日）のログの値（価格・評価額に関わる項目は参照時に deferred_log.py で埋める）
+DEFERRED_LOG_VALUES = {
+    'lender_additional_issue': False,
+    'borrower_additional_issue': False,
+    'has_done_margincall': False,
+    'transfer_count': 0,
+}
+# execute() がログに添付する実行全体の情報（ステップごとの項目ではない）
+RESULT_METADATA_KEYS = ('profile', 'summary', 'memory')
+# メモリ使用量を計測する取引のポートフォリオ
+MEMORY_PORTFOLIOS = ('st_portfolio', 'jct_portfolio', 'collateral_portfolio', 'initial_collateral_portfolio')
 
 
 class JCTVariableTransaction(object):
@@ -24,13 +47,20 @@ class JCTVariableTransaction(object):
         self.lender_loan_ratio = options['lender_loan_ratio'] if 'lender_loan_ratio' in options else 1.0
         self.print_log = options['print_log'] if 'print_log' in options else False
         self.auto_deposit = options['auto_deposit'] if 'auto_deposit' in options else True
+        self.fixed_point = options['fixed_point'] if 'fixed_point' in options else False
+        self.arith = get_arithmetic(self.fixed_point)
         self.logs = []
         print(f'JCT portfolio: {self.jct_portfolio}')
         print(f'ST portfolio: {self.st_portfolio}')
 
-        st_total_value = update_portfolio_price(self.st_portfolio, start_date, self.print_log)
-        self.lender_jct_num = math.ceil(st_total_value * self.lender_loan_ratio / self.borrower_loan_ratio)
-        self.total_jct_num = math.floor(update_portfolio_price(self.jct_portfolio, start_date, self.print_log))
+        st_total_value = update_portfolio_price(self.st_portfolio, start_date, self.print_log, arith=self.arith)
+        if self.fixed_point:
+            # 価値は 0.1円単位の整数なので、1JCT = 1円として口数に換算する
+            self.lender_jct_num = ceil_div(self.arith.necessary_value(st_total_value, self.lender_loan_ratio, self.borrower_loan_ratio), PRICE_SCALE)
+            self.total_jct_num = update_portfolio_price(self.jct_portfolio, start_date, self.print_log, arith=self.arith) // PRICE_SCALE
+        else:
+            self.lender_jct_num = math.ceil(st_total_value * self.lender_loan_ratio / self.borrower_loan_ratio)
+            self.total_jct_num = math.floor(update_portfolio_price(self.jct_portfolio, start_date, self.print_log))
         self.borrower_jct_num = self.total_jct_num - self.lender_jct_num
 
         if self.borrower_jct_num < 0:
@@ -40,7 +70,8 @@ class JCTVariableTransaction(object):
             'date': start_date,
             'jct_price': 1.0,
             'st_total_value': st_total_value,
-            'jct_total_value': self.total_jct_num,
+            # 1JCT = 1円（fixed_point の場合は ticks に揃える）
+            'jct_total_value': self.total_jct_num * PRICE_SCALE if self.fixed_point else self.total_jct_num,
             'borrower_jct_num': self.borrower_jct_num,
             'lender_jct_num': self.lender_jct_num,
             'jct_difference': 0,
@@ -58,14 +89,23 @@ class JCTVariableTransaction(object):
         JCT, STそれぞれの時価更新を行い、差分のJCT口数を算出、移動する
         JCTの裏付けとなる担保が不足する場合はアラートを出す
         """
-        st_total_value = update_portfolio_price(self.st_portfolio, date, self.print_log)
-        jct_total_value = update_portfolio_price(self.jct_portfolio, date, self.print_log)
-
-        jct_price = math.floor(((jct_total_value / self.total_jct_num) * 1e6)) / 1e6
+        st_total_value = update_portfolio_price(self.st_portfolio, date, self.print_log, arith=self.arith)
+        jct_total_value = update_portfolio_price(self.jct_portfolio, date, self.print_log, arith=self.arith)
+
+        if self.fixed_point:
+            # JCT の価格は 1e-6円単位の整数で切り捨て、価値も 1e-6円単位で比較する
+            units_per_tick = JCT_PRICE_SCALE // PRICE_SCALE
+            jct_price_units = jct_total_value * units_per_tick // self.total_jct_num
+            lender_jct_total_value = self.lender_jct_num * jct_price_units
+            necessary_value = self.arith.necessary_value(st_total_value, self.lender_loan_ratio, self.borrower_loan_ratio) * units_per_tick
+            jct_diff_num = ceil_div(necessary_value - lender_jct_total_value, jct_price_units)
+            jct_price = jct_price_units / JCT_PRICE_SCALE
+        else:
+            jct_price = math.floor(((jct_total_value / self.total_jct_num) * 1e6)) / 1e6
 
-        lender_jct_total_value = self.lender_jct_num * jct_price
+            lender_jct_total_value = self.lender_jct_num * jct_price
 
-        jct_diff_num = math.ceil(((st_total_value * self.lender_loan_ratio / self.borrower_loan_ratio) - lender_jct_total_value) / jct_price)
+            jct_diff_num = math.ceil(((st_total_value * self.lender_loan_ratio / self.borrower_loan_ratio) - lender_jct_total_value) / jct_price)
 
         necessary_deposit = jct_diff_num > 0 and jct_diff_num > self.borrower_jct_num
         if necessary_deposit:
@@ -73,7 +113,10 @@ class JCTVariableTransaction(object):
                 raise ValueError(f'WARNING: {self.borrower} must add JCT!!')
 
             # 自動で不足分の現金を補填する
-            additional_deposit = math.ceil((jct_diff_num - self.borrower_jct_num) * jct_price)
+            if self.fixed_point:
+                additional_deposit = ceil_div((jct_diff_num - self.borrower_jct_num) * jct_price_units, JCT_PRICE_SCALE)
+            else:
+                additional_deposit = math.ceil((jct_diff_num - self.borrower_jct_num) * jct_price)
             print(f'Additional deposit! {additional_deposit} JPY is added.')
             print('*' * 50)
             print('*' * 50)
@@ -102,6 +145,12 @@ class JCTVariableTransaction(object):
             print('OK. JCT is moved.')
             pprint(log)
 
+    def get_logs(self) -> list:
+        """
+        円に換算したログ（self.logs は fixed_point の場合 ticks で記録する）
+        """
+        return fixed_point_rows_to_yen(self.logs) if self.fixed_point else self.logs
+
 
 class AutoAdjustmentTransactionBase(object):
     """
@@ -114,8 +163,13 @@ class AutoAdjustmentTransactionBase(object):
     def __init__(self, jct_portfolio: Dict[str, PortfolioWithPriorityItem], st_portfolio: Dict[str, PortfolioItem], start_date: Union[str, date], options: TransactionOption) -> None:
         self.borrower = options['borrower'] if 'borrower' in options else "Borrower(A)"
         self.lender = options['lender'] if 'lender' in options else 'Lender(B)'
-        self.jct_portfolio = copy.deepcopy(jct_portfolio)
-        self.st_portfolio = copy.deepcopy(st_portfolio)
+        self.compact_portfolio = options['compact_portfolio'] if 'compact_portfolio' in options else False
+        self.fixed_point = options['fixed_point'] if 'fixed_point' in options else False
+        self.arith = get_arithmetic(self.fixed_point)
+        self.jct_portfolio = attach_portfolio(jct_portfolio, self.compact_portfolio, self.fixed_point)
+        self.st_portfolio = attach_portfolio(st_portfolio, self.compact_portfolio, self.fixed_point)
+        # 遅延を指定した場合は reference_delay 日前の価格で時価評価する
+        self.price_reference = LaggedPriceReference.create(options['reference_delay'] if 'reference_delay' in options else 0, (jct_portfolio, st_portfolio))
         self.borrower_loan_ratio = options['borrower_loan_ratio'] if 'borrower_loan_ratio' in options else 1.0
         self.lender_loan_ratio = options['lender_loan_ratio'] if 'lender_loan_ratio' in options else 1.0
         self.print_log = options['print_log'] if 'print_log' in options else False
@@ -124,22 +178,45 @@ class AutoAdjustmentTransactionBase(object):
         self.is_reverse = options['is_reverse'] if 'is_reverse' in options else False
         self.is_manual = options['is_manual'] if 'is_manual' in options else False
         self.margin_call_threshold = options['margin_call_threshold'] if 'margin_call_threshold' in options else 0.0
-        self.collateral_portfolio: Dict[str, PortfolioWithPriorityItem] = {}
+        self.rebalance_band = options['rebalance_band'] if 'rebalance_band' in options else None
+        self.reference_delay = options['reference_delay'] if 'reference_delay' in options else 0
+        self.profile = options['profile'] if 'profile' in options else False
+        self.profiler = StepProfiler() if self.profile else NULL_PROFILER
+        # keep_logs が False の場合はステップごとのログを保持せず、集計値（logs['summary']）のみを残す
+        self.keep_logs = options['keep_logs'] if 'keep_logs' in options else True
+        online_stats = options['online_stats'] if 'online_stats' in options else False
+        self.online_stats = OnlineLogStats(self.arith.to_yen) if online_stats or not self.keep_logs else None
+        # トークン移動・価格更新を書き出す LedgerEventWriter（ledger.py）
+        self.ledger = options['ledger'] if 'ledger' in options else None
+        # price_band が True の場合は、価格がマージンコールの起こらないバンド内の日の評価を省略する（price_band.py）
+        self.price_band = options['price_band'] if 'price_band' in options else False
+        self.no_margin_call_band = None
+        self.deferred_steps: list = []
+        self.deferred_state = None
+        # memory_probe にステップ数を指定した場合は、そのステップごとにメモリ使用量を記録する（memory_probe.py）
+        memory_probe = options['memory_probe'] if 'memory_probe' in options else None
+        self.memory_probe = MemoryProbe(memory_probe) if memory_probe else None
+        # live_monitor にステップ数を指定した場合は、そのステップごとに新しいログを図に追加する（live_monitor.py）
+        live_monitor = options['live_monitor'] if 'live_monitor' in options else None
+        if live_monitor and not self.keep_logs:
+            raise ValueError('live_monitor requires keep_logs (the monitor reads the step logs).')
+        self.live_monitor = LiveMonitor(live_monitor) if live_monitor else None
+        self.collateral_portfolio: Dict[str, PortfolioWithPriorityItem] = CompactPortfolio(integer_prices=self.fixed_point) if self.compact_portfolio else {}  # type: ignore
         self.logs: Dict[str, list] = {}
 
         pprint(f'JCT portfolio: {self.jct_portfolio}')
         pprint(f'ST portfolio: {self.st_portfolio}')
 
-        st_total_value = update_portfolio_price(self.st_portfolio, start_date, self.print_log, is_dummy_data=self.is_dummy_data)
-        jct_total_value = update_portfolio_price(self.jct_portfolio, start_date, self.print_log, is_dummy_data=self.is_dummy_data)
-        collateral_total_value = st_total_value * self.lender_loan_ratio / self.borrower_loan_ratio
+        st_total_value = update_portfolio_price(self.st_portfolio, start_date, self.print_log, is_dummy_data=self.is_dummy_data, arith=self.arith, price_getter=self.price_reference)
+        jct_total_value = update_portfolio_price(self.jct_portfolio, start_date, self.print_log, is_dummy_data=self.is_dummy_data, arith=self.arith, price_getter=self.price_reference)
+        collateral_total_value = self.arith.necessary_value(st_total_value, self.lender_loan_ratio, self.borrower_loan_ratio)
         self.necessary_collateral_value = collateral_total_value
 
         for code, collateral in sorted(self.jct_portfolio.items(), key=lambda x: x[1]['priority'], reverse=True):  # type: ignore
             pprint(f'{code}: {collateral}')
             collateral_value = collateral['price'] * collateral['num']
             if collateral_value >= collateral_total_value:
-                collateral_num = math.ceil(collateral_total_value / collateral['price'])
+                collateral_num = self.arith.ceil_div(collateral_total_value, collateral['price'])
 
                 if (collateral_num > self.jct_portfolio[code]['num']):
                     print("絶妙に足りない場合")
@@ -149,7 +226,8 @@ class AutoAdjustmentTransactionBase(object):
                     'num': collateral_num,
                     'is_usd': collateral['is_usd'],
                     'price': collateral['price'],
-                    'priority': collateral['priority']
+                    'priority': collateral['priority'],
+                    **currency_item(collateral)
                 }
                 self.jct_portfolio[code]['num'] -= collateral_num
 
@@ -162,7 +240,8 @@ class AutoAdjustmentTransactionBase(object):
                 'num': collateral['num'],
                 'is_usd': collateral['is_usd'],
                 'price': collateral['price'],
-                'priority': collateral['priority']
+                'priority': collateral['priority'],
+                **currency_item(collateral)
             }
             collateral_total_value -= collateral['price'] * collateral['num']
             self.jct_portfolio[code]['num'] = 0
@@ -170,7 +249,7 @@ class AutoAdjustmentTransactionBase(object):
         if collateral_total_value > 0:
             raise ValueError(f'Initial JCT is insufficient!! {self.jct_portfolio}')
 
-        collateral_sum = update_portfolio_price(self.collateral_portfolio, start_date, self.print_log, is_dummy_data=self.is_dummy_data)
+        collateral_sum = update_portfolio_price(self.collateral_portfolio, start_date, self.print_log, is_dummy_data=self.is_dummy_data, arith=self.arith, price_getter=self.price_reference)
         self.logs['date'] = [start_date]
         self.logs['st_total_value'] = [st_total_value]
         self.logs['jct_total_value'] = [jct_total_value]
@@ -185,11 +264,151 @@ class AutoAdjustmentTransactionBase(object):
         # 初日のcollateral_portfolioを比較用に保管しておく
         self.initial_collateral_portfolio = copy.deepcopy(self.collateral_portfolio)
         self.logs['initial_collateral_portfolio'] = [copy.deepcopy(self.collateral_portfolio)]
+        self.update_online_stats()
+        if self.ledger is not None:
+            self.ledger.record_step(self, start_date, {})
 
         print('Transaction is created.')
         if self.print_log:
             pprint(self.logs)
 
+    def append_step_logs(self, date: Union[str, date], st_total_value: float, jct_total_value: float, collateral_sum: float) -> None:
+        """
+        価格調整後の各ポートフォリオの状態をログに追加する
+        """
+        self.profiler.lap('allocation')
+        self.profiler.end_moves(self.collateral_portfolio)
+
+        self.logs['date'].append(date)
+        self.logs['st_total_value'].append(st_total_value)
+        self.logs['jct_total_value'].append(jct_total_value)
+        self.logs['necessary_collateral_value'].append(self.necessary_collateral_value)
+        self.logs['collateral_sum'].append(collateral_sum)
+        if self.keep_logs:
+            self.logs['jct_portfolio'].append(copy.deepcopy(self.jct_portfolio))
+            self.logs['collateral_portfolio'].append(copy.deepcopy(self.collateral_portfolio))
+        self.profiler.lap('logging')
+
+        update_portfolio_price(self.initial_collateral_portfolio, date, arith=self.arith, price_getter=self.price_reference)
+        self.profiler.lap('price_update')
+        self.profiler.count('price_lookups', len(self.initial_collateral_portfolio) + 1)
+        if self.keep_logs:
+            self.logs['initial_collateral_portfolio'].append(copy.deepcopy(self.initial_collateral_portfolio))
+        self.update_online_stats()
+        self.profiler.lap('logging')
+
+    def can_carry_forward(self) -> bool:
+        """
+        前回の評価が閾値内（マージンコールなし）であれば、st・担保の価格が変わらない限り再評価しても閾値内となり、carry_forward_step で代替できる
+        """
+        # is_manual は Single のみが持つオプション
+        if not self.keep_logs or getattr(self, 'is_manual', False) or self.is_dummy_data or self.reference_delay != 0:
+            return False
+        return not self.logs['has_done_margincall'][-1]
+
+    def carry_forward_step(self, date: Union[str, date]) -> None:
+        """
+        can_carry_forward() で、st・担保の価格が前回の評価から変わっていない取引の1日分の処理
+        jct（在庫は他の取引の担保移動で増減する）のみ時価を更新し、それ以外は前回のログを複製する
+        """
+        jct_total_value = update_portfolio_price(self.jct_portfolio, date, self.print_log, is_dummy_data=self.is_dummy_data, arith=self.arith, price_getter=self.price_reference)
+        for key, values in self.logs.items():
+            if key == 'date':
+                values.append(date)
+            elif key == 'jct_total_value':
+                values.append(jct_total_value)
+            elif key == 'jct_portfolio':
+                values.append(copy.deepcopy(self.jct_portfolio))
+            elif isinstance(values[-1], (int, float, bool)):
+                values.append(values[-1])
+            else:
+                values.append(copy.deepcopy(values[-1]))
+        self.update_online_stats()
+
+    def can_use_price_band(self) -> bool:
+        """
+        評価を省略した日のログは後から埋めるため、日ごとに集計・書き出しを行う取引や遅延参照・manual手続の取引では用いない
+        """
+        if not self.price_band or not self.keep_logs or self.online_stats is not None or self.ledger is not None:
+            return False
+        return self.reference_delay == 0 and not getattr(self, 'is_manual', False)
+
+    def update_no_margin_call_band(self) -> None:
+        """
+        価格調整後の数量・価格からバンドを求め直す
+        """
+        self.no_margin_call_band = NoMarginCallBand.create(self) if self.can_use_price_band() else None
+        self.deferred_state = None
+
+    def is_in_no_margin_call_band(self, date: Union[str, date]) -> bool:
+        if self.no_margin_call_band is None:
+            return False
+        return self.no_margin_call_band.contains(date, get_price_getter(), self.arith, self.is_dummy_data)
+
+    def defer_step(self, date: Union[str, date]) -> None:
+        """
+        バンド内の日（閾値内となり担保移動はない）の処理
+        評価は行わず、価格・評価額に関わるログは None としておき、参照された時点で埋める（deferred_log.py）
+        """
+        if self.deferred_state is None:
+            # 次に評価するまで数量は変わらないため、直前に評価した日のログのポートフォリオを参照する（埋める際に複製する）
+            # st はログに残らないため、バンドごとに1度だけ複製する
+            self.deferred_state = {name: self.logs[name][-1] for name in DEFERRED_PORTFOLIO_KEYS}
+            self.deferred_state['st_portfolio'] = copy.deepcopy(self.st_portfolio)
+        self.deferred_steps.append((len(self.logs['date']), date, self.deferred_state))
+        for key, values in self.logs.items():
+            if key not in RESULT_METADATA_KEYS:
+                values.append(date if key == 'date' else DEFERRED_LOG_VALUES.get(key))
+
+    def fill_deferred_logs(self) -> None:
+        """
+        評価を省略した日のログを全て埋める（fork() の前など、取引の内部のログに全ての日の値が必要な場合に呼ぶ）
+        execute() の返り値のログでは、その日を参照した時点で埋める（deferred_log.py）
+        """
+        if not self.deferred_steps:
+            return
+        self.sync_deferred_state()
+        DeferredSteps(self, self.deferred_steps, self.logs).fill_all()
+        self.deferred_steps = []
+
+    def sync_deferred_state(self) -> None:
+        """
+        最後の日の評価を省略した場合は、取引の状態（各ポートフォリオの価格と必要担保額）を最後の日の価格にしておく
+        """
+        if not self.deferred_steps:
+            return
+        last_index, last_date, _ = self.deferred_steps[-1]
+        if last_index != len(self.logs['date']) - 1:
+            return
+        st_total_value = update_portfolio_price(self.st_portfolio, last_date, is_dummy_data=self.is_dummy_data, arith=self.arith)
+        update_portfolio_price(self.jct_portfolio, last_date, is_dummy_data=self.is_dummy_data, arith=self.arith)
+        update_portfolio_price(self.collateral_portfolio, last_date, is_dummy_data=self.is_dummy_data, arith=self.arith)
+        update_portfolio_price(self.initial_collateral_portfolio, last_date, arith=self.arith)
+        self.necessary_collateral_value = self.arith.necessary_value(st_total_value, self.lender_loan_ratio, self.borrower_loan_ratio)
+
+    def memory_structures(self) -> Dict[str, Any]:
+        """
+        メモリ使用量を計測する構造（ログの項目ごと、各ポートフォリオ、株価取得クラスのキャッシュ）
+        """
+        structures: Dict[str, Any] = {f'logs.{key}': values for key, values in self.logs.items() if key not in RESULT_METADATA_KEYS}
+        for name in MEMORY_PORTFOLIOS:
+            structures[name] = getattr(self, name)
+        structures['deferred_steps'] = self.deferred_steps
+        structures['price_getter'] = get_price_getter()
+        return structures
+
+    def update_online_stats(self) -> None:
+        """
+        当日の価格調整後の状態で集計値を更新し、keep_logs が False の場合は当日分のログを破棄する
+        """
+        if self.online_stats is None:
+            return
+        self.online_stats.update(self.collateral_portfolio, self.necessary_collateral_value, self.logs['has_done_margincall'][-1],
+                                 self.logs['borrower_additional_issue'][-1], self.logs['lender_additional_issue'][-1])
+        if not self.keep_logs:
+            for values in self.logs.values():
+                values.clear()
+
 
 class AutoAdjustmentTransactionSingle(AutoAdjustmentTransactionBase):
     def __init__(self, jct_portfolio: Dict[str, PortfolioWithPriorityItem], st_portfolio: Dict[str, PortfolioItem], start_date: Union[str, date], options: TransactionOption) -> None:
@@ -201,18 +420,22 @@ class AutoAdjustmentTransactionSingle(AutoAdjustmentTransactionBase):
         差し入れている担保の優先寺度に従って差し入れていくことで、複数の担保がある際の
         価格調整用担保の追加差し入れのような事態を防ぐ
         """
-        st_total_value = update_portfolio_price(self.st_portfolio, date, self.print_log, is_dummy_data=self.is_dummy_data)
-        jct_total_value = update_portfolio_price(self.jct_portfolio, date, self.print_log, is_dummy_data=self.is_dummy_data)
-        collateral_sum = update_portfolio_price(self.collateral_portfolio, date, is_dummy_data=self.is_dummy_data)
+        st_total_value = update_portfolio_price(self.st_portfolio, date, self.print_log, is_dummy_data=self.is_dummy_data, arith=self.arith, price_getter=self.price_reference)
+        jct_total_value = update_portfolio_price(self.jct_portfolio, date, self.print_log, is_dummy_data=self.is_dummy_data, arith=self.arith, price_getter=self.price_reference)
+        collateral_sum = update_portfolio_price(self.collateral_portfolio, date, is_dummy_data=self.is_dummy_data, arith=self.arith, price_getter=self.price_reference)
+        self.profiler.lap('price_update')
+        self.profiler.count('price_lookups', len(self.st_portfolio) + len(self.jct_portfolio) + len(self.collateral_portfolio) + 3)
 
         # 預け入れるべき担保額
-        necessary_collateral_value = st_total_value * self.lender_loan_ratio / self.borrower_loan_ratio
+        necessary_collateral_value = self.arith.necessary_value(st_total_value, self.lender_loan_ratio, self.borrower_loan_ratio)
         self.necessary_collateral_value = necessary_collateral_value
 
         # 差し入れるべき担保と現状差し入れている担保価値との価値の差分
         collateral_diff = necessary_collateral_value - collateral_sum
+        self.profiler.lap('valuation')
+        self.profiler.begin_moves(self.collateral_portfolio)
 
-        if abs(collateral_diff) < necessary_collateral_value * self.margin_call_threshold:
+        if self.arith.is_within_threshold(collateral_diff, necessary_collateral_value, self.margin_call_threshold):
             print("price diff is so little that auto margin call is cancelled.")
             print('margincall threshold: ', self.margin_call_threshold)
             print('threshold price: ', necessary_collateral_value * self.margin_call_threshold)
@@ -225,6 +448,7 @@ class AutoAdjustmentTransactionSingle(AutoAdjustmentTransactionBase):
             # １種のトークンのみで価格調整を行う
             print("adjust by single token manually.")
             code, collateral = sorted(self.jct_portfolio.items(), key=lambda x: x[1]['priority'], reverse=True)[0]
+            self.profiler.count('securities_walked')
 
             self.logs['date'].append(date)
             self.logs['st_total_value'].append(st_total_value)
@@ -236,13 +460,17 @@ class AutoAdjustmentTransactionSingle(AutoAdjustmentTransactionBase):
             self.logs['lender_additional_issue'].append(True)
             self.logs['borrower_additional_issue'].append(True)
             self.logs['has_done_margincall'].append(True)
+            self.profiler.lap('logging')
 
-            update_portfolio_price(self.initial_collateral_portfolio, date)
+            update_portfolio_price(self.initial_collateral_portfolio, date, arith=self.arith, price_getter=self.price_reference)
+            self.profiler.lap('price_update')
+            self.profiler.count('price_lookups', len(self.initial_collateral_portfolio) + 1)
             self.logs['initial_collateral_portfolio'].append(copy.deepcopy(self.initial_collateral_portfolio))
+            self.profiler.lap('logging')
 
             if (collateral_diff > 0):
                 print(f'from {self.borrower} to {self.lender}')
-                collateral_num = math.ceil(collateral_diff / collateral['price'])
+                collateral_num = self.arith.ceil_div(collateral_diff, collateral['price'])
                 if collateral_num <= self.jct_portfolio[code]['num']:
                     self.collateral_portfolio[code]['num'] += collateral_num
                     self.jct_portfolio[code]['num'] -= collateral_num
@@ -255,7 +483,7 @@ class AutoAdjustmentTransactionSingle(AutoAdjustmentTransactionBase):
             else:
                 print(f'from {self.lender} to {self.borrower}')
                 collateral_diff = abs(collateral_diff)
-                collateral_num = math.ceil(collateral_diff / collateral['price'])
+                collateral_num = self.arith.ceil_div(collateral_diff, collateral['price'])
                 if collateral_num <= self.collateral_portfolio[code]['num']:
                     self.collateral_portfolio[code]['num'] -= collateral_num
                     self.jct_portfolio[code]['num'] += collateral_num
@@ -272,6 +500,9 @@ class AutoAdjustmentTransactionSingle(AutoAdjustmentTransactionBase):
                     print(f"!!!!!!!!!!!!additional token issuing by {self.lender} num: {collateral_num}!!!!!!!!!!!!!!")
                     self.jct_portfolio[code]['num'] += collateral_num
                     self.collateral_portfolio[code]['num'] -= collateral_num
+            self.profiler.lap('allocation')
+            self.profiler.end_moves(self.collateral_portfolio)
+            self.update_online_stats()
             if self.print_log:
                 pprint(self.collateral_portfolio)
             print('--------------------DONE(manual)------------------------')
@@ -281,9 +512,10 @@ class AutoAdjustmentTransactionSingle(AutoAdjustmentTransactionBase):
             print("adjust by single token.")
             self.logs['has_done_margincall'].append(True)
             code, collateral = sorted(self.jct_portfolio.items(), key=lambda x: x[1]['priority'], reverse=True)[0]
+            self.profiler.count('securities_walked')
             if (collateral_diff > 0):
                 print(f'from {self.borrower} to {self.lender}')
-                collateral_num = math.ceil(collateral_diff / collateral['price'])
+                collateral_num = self.arith.ceil_div(collateral_diff, collateral['price'])
                 if collateral_num <= self.jct_portfolio[code]['num']:
                     self.collateral_portfolio[code]['num'] += collateral_num
                     self.jct_portfolio[code]['num'] -= collateral_num
@@ -301,7 +533,7 @@ class AutoAdjustmentTransactionSingle(AutoAdjustmentTransactionBase):
             else:
                 print(f'from {self.lender} to {self.borrower}')
                 collateral_diff = abs(collateral_diff)
-                collateral_num = math.ceil(collateral_diff / collateral['price'])
+                collateral_num = self.arith.ceil_div(collateral_diff, collateral['price'])
                 if collateral_num <= self.collateral_portfolio[code]['num']:
                     self.collateral_portfolio[code]['num'] -= collateral_num
                     self.jct_portfolio[code]['num'] += collateral_num
@@ -318,15 +550,7 @@ class AutoAdjustmentTransactionSingle(AutoAdjustmentTransactionBase):
 
                     self.logs['lender_additional_issue'].append(True)
                     self.logs['borrower_additional_issue'].append(False)
-                    self.logs['date'].append(date)
-                    self.logs['st_total_value'].append(st_total_value)
-                    self.logs['jct_total_value'].append(jct_total_value)
-                    self.logs['jct_portfolio'].append(copy.deepcopy(self.jct_portfolio))
-                    self.logs['necessary_collateral_value'].append(self.necessary_collateral_value)
-                    self.logs['collateral_portfolio'].append(copy.deepcopy(self.collateral_portfolio))
-                    self.logs['collateral_sum'].append(collateral_sum)
-                    update_portfolio_price(self.initial_collateral_portfolio, date)
-                    self.logs['initial_collateral_portfolio'].append(copy.deepcopy(self.initial_collateral_portfolio))
+                    self.append_step_logs(date, st_total_value, jct_total_value, collateral_sum)
                     print(f'--------------------DONE. {self.lender} adds {shortage_num} tokens by tomorrow.------------------------')
                     if self.print_log:
                         pprint(self.collateral_portfolio)
@@ -342,15 +566,7 @@ class AutoAdjustmentTransactionSingle(AutoAdjustmentTransactionBase):
 
                     self.logs['lender_additional_issue'].append(True)
                     self.logs['borrower_additional_issue'].append(False)
-                    self.logs['date'].append(date)
-                    self.logs['st_total_value'].append(st_total_value)
-                    self.logs['jct_total_value'].append(jct_total_value)
-                    self.logs['jct_portfolio'].append(copy.deepcopy(self.jct_portfolio))
-                    self.logs['necessary_collateral_value'].append(self.necessary_collateral_value)
-                    self.logs['collateral_portfolio'].append(copy.deepcopy(self.collateral_portfolio))
-                    self.logs['collateral_sum'].append(collateral_sum)
-                    update_portfolio_price(self.initial_collateral_portfolio, date)
-                    self.logs['initial_collateral_portfolio'].append(copy.deepcopy(self.initial_collateral_portfolio))
+                    self.append_step_logs(date, st_total_value, jct_total_value, collateral_sum)
                     print(f'--------------------DONE. {self.lender} adds {shortage_num} tokens by tomorrow.------------------------')
                     if self.print_log:
                         pprint(self.collateral_portfolio)
@@ -359,15 +575,7 @@ class AutoAdjustmentTransactionSingle(AutoAdjustmentTransactionBase):
                     self.collateral_portfolio[code]['num'] -= shortage_num
                     return
 
-        self.logs['date'].append(date)
-        self.logs['st_total_value'].append(st_total_value)
-        self.logs['jct_total_value'].append(jct_total_value)
-        self.logs['jct_portfolio'].append(copy.deepcopy(self.jct_portfolio))
-        self.logs['necessary_collateral_value'].append(self.necessary_collateral_value)
-        self.logs['collateral_portfolio'].append(copy.deepcopy(self.collateral_portfolio))
-        self.logs['collateral_sum'].append(collateral_sum)
-        update_portfolio_price(self.initial_collateral_portfolio, date)
-        self.logs['initial_collateral_portfolio'].append(copy.deepcopy(self.initial_collateral_portfolio))
+        self.append_step_logs(date, st_total_value, jct_total_value, collateral_sum)
         print('--------------------OK. collateral is moved.------------------------')
 
         if self.print_log:
@@ -384,18 +592,22 @@ class AutoAdjustmentTransactionMulti(AutoAdjustmentTransactionBase):
         差し入れている担保の優先寺度に従って差し入れていくことで、複数の担保がある際の
         価格調整用担保の追加差し入れのような事態を防ぐ
         """
-        st_total_value = update_portfolio_price(self.st_portfolio, date, self.print_log, is_dummy_data=self.is_dummy_data)
-        jct_total_value = update_portfolio_price(self.jct_portfolio, date, self.print_log, is_dummy_data=self.is_dummy_data)
-        collateral_sum = update_portfolio_price(self.collateral_portfolio, date, is_dummy_data=self.is_dummy_data)
+        st_total_value = update_portfolio_price(self.st_portfolio, date, self.print_log, is_dummy_data=self.is_dummy_data, arith=self.arith, price_getter=self.price_reference)
+        jct_total_value = update_portfolio_price(self.jct_portfolio, date, self.print_log, is_dummy_data=self.is_dummy_data, arith=self.arith, price_getter=self.price_reference)
+        collateral_sum = update_portfolio_price(self.collateral_portfolio, date, is_dummy_data=self.is_dummy_data, arith=self.arith, price_getter=self.price_reference)
+        self.profiler.lap('price_update')
+        self.profiler.count('price_lookups', len(self.st_portfolio) + len(self.jct_portfolio) + len(self.collateral_portfolio) + 3)
 
         # 預け入れるべき担保額
-        necessary_collateral_value = st_total_value * self.lender_loan_ratio / self.borrower_loan_ratio
+        necessary_collateral_value = self.arith.necessary_value(st_total_value, self.lender_loan_ratio, self.borrower_loan_ratio)
         self.necessary_collateral_value = necessary_collateral_value
 
         # 差し入れるべき担保と現状差し入れている担保価値との価値の差分
         collateral_diff = necessary_collateral_value - collateral_sum
+        self.profiler.lap('valuation')
+        self.profiler.begin_moves(self.collateral_portfolio)
 
-        if abs(collateral_diff) < necessary_collateral_value * self.margin_call_threshold:
+        if self.arith.is_within_threshold(collateral_diff, necessary_collateral_value, self.margin_call_threshold):
             print("price diff is so little that auto margin call is cancelled.")
             print('margincall threshold: ', self.margin_call_threshold)
             print('threshold price: ', necessary_collateral_value * self.margin_call_threshold)
@@ -410,10 +622,11 @@ class AutoAdjustmentTransactionMulti(AutoAdjustmentTransactionBase):
                 # borrower -> lender への担保追加差し入れなのでシンプルに優先度が高い順に差し入れ
                 print(f'from {self.borrower} to {self.lender}')
                 for code, collateral in sorted(self.jct_portfolio.items(), key=lambda x: x[1]['priority'], reverse=True):  # type: ignore
+                    self.profiler.count('securities_walked')
                     pprint(f'{code}: {collateral}')
                     collateral_value = math.floor(collateral['price'] * collateral['num'])
                     if collateral_value >= collateral_diff:
-                        collateral_num = math.ceil(collateral_diff / collateral['price'])
+                        collateral_num = self.arith.ceil_div(collateral_diff, collateral['price'])
 
                         if code in self.collateral_portfolio:
                             self.collateral_portfolio[code]['num'] += collateral_num
@@ -422,7 +635,8 @@ class AutoAdjustmentTransactionMulti(AutoAdjustmentTransactionBase):
                                 'num': collateral_num,
                                 'is_usd': collateral['is_usd'],
                                 'price': collateral['price'],
-                                'priority': collateral['priority']
+                                'priority': collateral['priority'],
+                                **currency_item(collateral)
                             }
 
                         self.jct_portfolio[code]['num'] -= collateral_num
@@ -438,7 +652,8 @@ class AutoAdjustmentTransactionMulti(AutoAdjustmentTransactionBase):
                             'num': collateral['num'],
                             'is_usd': collateral['is_usd'],
                             'price': collateral['price'],
-                            'priority': collateral['priority']
+                            'priority': collateral['priority'],
+                            **currency_item(collateral)
                         }
                     collateral_diff -= collateral['price'] * collateral['num']
                     self.jct_portfolio[code]['num'] = 0
@@ -448,7 +663,7 @@ class AutoAdjustmentTransactionMulti(AutoAdjustmentTransactionBase):
                     print("collateral num is short@@@@@@@@@")
                     print(f"!!!!additional token issuing by {self.borrower}!!!!")
                     prior_code, prior_collateral = sorted(self.jct_portfolio.items(), key=lambda x: x[1]['priority'], reverse=True)[0]
-                    self.collateral_portfolio[prior_code]['num'] += math.ceil(math.ceil(collateral_diff / prior_collateral['price']))
+                    self.collateral_portfolio[prior_code]['num'] += self.arith.ceil_div(collateral_diff, prior_collateral['price'])
                     self.logs['lender_additional_issue'].append(False)
                     self.logs['borrower_additional_issue'].append(True)
                 else:
@@ -461,10 +676,11 @@ class AutoAdjustmentTransactionMulti(AutoAdjustmentTransactionBase):
                 collateral_diff = abs(collateral_diff)
                 print(f'from {self.lender} to {self.borrower}')
                 for code, collateral in sorted(self.collateral_portfolio.items(), key=lambda x: x[1]['priority'], reverse=self.is_reverse):  # type: ignore
+                    self.profiler.count('securities_walked')
                     pprint(f'{code}: {collateral}')
                     collateral_value = math.floor(collateral['price'] * collateral['num'])
                     if collateral_value >= collateral_diff:
-                        collateral_num = math.ceil(collateral_diff / collateral['price'])
+                        collateral_num = self.arith.ceil_div(collateral_diff, collateral['price'])
                         # if (collateral_num > self.collateral_portfolio[code]['num']):
                         #     continue
 
@@ -485,16 +701,7 @@ class AutoAdjustmentTransactionMulti(AutoAdjustmentTransactionBase):
                 if collateral_diff > 0:
                     raise ValueError(f'{self.lender} does not have enough collaterals. Bugs exist.')
 
-        self.logs['date'].append(date)
-        self.logs['st_total_value'].append(st_total_value)
-        self.logs['jct_total_value'].append(jct_total_value)
-        self.logs['jct_portfolio'].append(copy.deepcopy(self.jct_portfolio))
-        self.logs['necessary_collateral_value'].append(self.necessary_collateral_value)
-        self.logs['collateral_portfolio'].append(copy.deepcopy(self.collateral_portfolio))
-        self.logs['collateral_sum'].append(collateral_sum)
-
-        update_portfolio_price(self.initial_collateral_portfolio, date)
-        self.logs['initial_collateral_portfolio'].append(copy.deepcopy(self.initial_collateral_portfolio))
+        self.append_step_logs(date, st_total_value, jct_total_value, collateral_sum)
 
         if self.print_log:
             pprint(self.collateral_portfolio)
@@ -506,6 +713,83 @@ class AutoAdjustmentTransactionDynamicMulti(AutoAdjustmentTransactionBase):
     # ex.) １００億円の日本円を5種類の有価証券を担保に借りる場合、各トークンの差し入れ額が20億円ずつになるよう調整
     def __init__(self, jct_portfolio: Dict[str, PortfolioWithPriorityItem], st_portfolio: Dict[str, PortfolioItem], start_date: Union[str, date], options: TransactionOption) -> None:
         super().__init__(jct_portfolio, st_portfolio, start_date, options)
+        self.logs['transfer_count'] = [len(self.collateral_portfolio)]
+
+    def rebalance_all(self, necessary_each_collateral_value) -> bool:
+        """
+        全ての銘柄を目標数量（均等割りの金額 / 価格）に調整する
+        borrower の追加発行が必要になった場合は True を返す
+        """
+        borrower_additional_issue = False
+        # トークン毎に必要差し入れ金額になるように調整
+        for code, collateral in self.jct_portfolio.items():
+            self.profiler.count('securities_walked')
+            pprint(f'{code}: {collateral}')
+            necessary_num = self.arith.ceil_div(necessary_each_collateral_value, collateral['price'])
+            if (necessary_num > self.collateral_portfolio[code]['num']):
+                # 追加差入
+                if (necessary_num - self.collateral_portfolio[code]['num'] > collateral['num']):
+                    # 不足による追加発行
+                    print("collateral num is short@@@@@@@@@")
+                    print(f"!!!!additional token issuing by {self.borrower}!!!!")
+                    self.collateral_portfolio[code]['num'] = necessary_num
+                    self.jct_portfolio[code]['num'] = 0
+                    borrower_additional_issue = True
+                else:
+                    print('追加差入（充足時）')
+                    self.jct_portfolio[code]['num'] -= (necessary_num - self.collateral_portfolio[code]['num'])
+                    self.collateral_portfolio[code]['num'] += (necessary_num - self.collateral_portfolio[code]['num'])
+            else:
+                # 余剰返還
+                print('余剰返還時')
+                self.jct_portfolio[code]['num'] += (self.collateral_portfolio[code]['num'] - necessary_num)
+                self.collateral_portfolio[code]['num'] = necessary_num
+        return borrower_additional_issue
+
+    def rebalance_within_band(self, necessary_collateral_value, necessary_each_collateral_value) -> bool:
+        """
+        差入額が目標額（均等割り）から rebalance_band の割合以上ずれている銘柄のみ目標数量に調整する
+        それでも合計が必要担保額に満たない場合は、目標を下回っている銘柄を不足額の大きい順に目標数量まで追加差入する
+        borrower の追加発行が必要になった場合は True を返す
+        """
+        # 全銘柄の目標数量をまとめて算出
+        prices = {code: collateral['price'] for code, collateral in self.jct_portfolio.items()}
+        target_nums = {code: self.arith.ceil_div(necessary_each_collateral_value, price) for code, price in prices.items()}
+        current_nums = {code: self.collateral_portfolio[code]['num'] for code in prices}
+        self.profiler.count('securities_walked', len(prices))
+
+        moving_codes = [
+            code for code in prices
+            if not self.arith.is_within_threshold(current_nums[code] * prices[code] - necessary_each_collateral_value, necessary_each_collateral_value, self.rebalance_band)
+        ]
+        collateral_value = sum(prices[code] * (target_nums[code] if code in moving_codes else current_nums[code]) for code in prices)
+        if collateral_value < necessary_collateral_value:
+            # バンド内でも目標を下回っている銘柄を、不足額の大きい順に追加差入する
+            short_codes = sorted(
+                [code for code in prices if code not in moving_codes and current_nums[code] < target_nums[code]],
+                key=lambda code: (target_nums[code] - current_nums[code]) * prices[code], reverse=True
+            )
+            for code in short_codes:
+                moving_codes.append(code)
+                collateral_value += (target_nums[code] - current_nums[code]) * prices[code]
+                if collateral_value >= necessary_collateral_value:
+                    break
+
+        borrower_additional_issue = False
+        for code in moving_codes:
+            diff_num = target_nums[code] - current_nums[code]
+            if diff_num > self.jct_portfolio[code]['num']:
+                # 不足による追加発行
+                print("collateral num is short@@@@@@@@@")
+                print(f"!!!!additional token issuing by {self.borrower}!!!!")
+                self.collateral_portfolio[code]['num'] = target_nums[code]
+                self.jct_portfolio[code]['num'] = 0
+                borrower_additional_issue = True
+            else:
+                self.jct_portfolio[code]['num'] -= diff_num
+                self.collateral_portfolio[code]['num'] += diff_num
+        print(f'rebalanced {len(moving_codes)} / {len(prices)} securities (band: {self.rebalance_band})')
+        return borrower_additional_issue
 
     def check_diff_and_margin_call(self, date: Union[str, date]) -> None:
         """
@@ -513,18 +797,24 @@ class AutoAdjustmentTransactionDynamicMulti(AutoAdjustmentTransactionBase):
         差し入れている担保の優先寺度に従って差し入れていくことで、複数の担保がある際の
         価格調整用担保の追加差し入れのような事態を防ぐ
         """
-        st_total_value = update_portfolio_price(self.st_portfolio, date, self.print_log, is_dummy_data=self.is_dummy_data)
-        jct_total_value = update_portfolio_price(self.jct_portfolio, date, self.print_log, is_dummy_data=self.is_dummy_data)
-        collateral_sum = update_portfolio_price(self.collateral_portfolio, date, is_dummy_data=self.is_dummy_data)
+        st_total_value = update_portfolio_price(self.st_portfolio, date, self.print_log, is_dummy_data=self.is_dummy_data, arith=self.arith, price_getter=self.price_reference)
+        jct_total_value = update_portfolio_price(self.jct_portfolio, date, self.print_log, is_dummy_data=self.is_dummy_data, arith=self.arith, price_getter=self.price_reference)
+        collateral_sum = update_portfolio_price(self.collateral_portfolio, date, is_dummy_data=self.is_dummy_data, arith=self.arith, price_getter=self.price_reference)
+        self.profiler.lap('price_update')
+        self.profiler.count('price_lookups', len(self.st_portfolio) + len(self.jct_portfolio) + len(self.collateral_portfolio) + 3)
 
         # 預け入れるべき担保額
-        necessary_collateral_value = st_total_value * self.lender_loan_ratio / self.borrower_loan_ratio
+        necessary_collateral_value = self.arith.necessary_value(st_total_value, self.lender_loan_ratio, self.borrower_loan_ratio)
         self.necessary_collateral_value = necessary_collateral_value
 
         # 差し入れるべき担保と現状差し入れている担保価値との価値の差分
         collateral_diff = necessary_collateral_value - collateral_sum
+        self.profiler.lap('valuation')
+        self.profiler.begin_moves(self.collateral_portfolio)
+        # 移動（オンチェーンでのトークン移転）があった銘柄数を数えるため、調整前の数量を保持する
+        collateral_nums = {code: collateral['num'] for code, collateral in self.collateral_portfolio.items()}
 
-        if abs(collateral_diff) < necessary_collateral_value * self.margin_call_threshold:
+        if self.arith.is_within_threshold(collateral_diff, necessary_collateral_value, self.margin_call_threshold):
             print("price diff is so little that auto margin call is cancelled.")
             print('margincall threshold: ', self.margin_call_threshold)
             print('threshold price: ', necessary_collateral_value * self.margin_call_threshold)
@@ -539,47 +829,18 @@ class AutoAdjustmentTransactionDynamicMulti(AutoAdjustmentTransactionBase):
 
             # １トークンあたりの差し入れ必要金額
             collateral_type_num = len(self.collateral_portfolio.keys())
-            necessary_each_collateral_value = math.ceil(necessary_collateral_value / collateral_type_num)
+            necessary_each_collateral_value = self.arith.ceil_div(necessary_collateral_value, collateral_type_num)
             print(f'necessary_each_collateral_value: {necessary_each_collateral_value}')
 
-            # トークン毎に必要差し入れ金額になるように調整
-            for code, collateral in self.jct_portfolio.items():
-                pprint(f'{code}: {collateral}')
-                necessary_num = math.ceil(necessary_each_collateral_value / collateral['price'])
-                if (necessary_num > self.collateral_portfolio[code]['num']):
-                    # 追加差入
-                    if (necessary_num - self.collateral_portfolio[code]['num'] > collateral['num']):
-                        # 不足による追加発行
-                        print("collateral num is short@@@@@@@@@")
-                        print(f"!!!!additional token issuing by {self.borrower}!!!!")
-                        self.collateral_portfolio[code]['num'] = necessary_num
-                        self.jct_portfolio[code]['num'] = 0
-                        self.logs['lender_additional_issue'].append(False)
-                        self.logs['borrower_additional_issue'].append(True)
-                    else:
-                        print('追加差入（充足時）')
-                        self.jct_portfolio[code]['num'] -= (necessary_num - self.collateral_portfolio[code]['num'])
-                        self.collateral_portfolio[code]['num'] += (necessary_num - self.collateral_portfolio[code]['num'])
-                        self.logs['lender_additional_issue'].append(False)
-                        self.logs['borrower_additional_issue'].append(False)
-                else:
-                    # 余剰返還
-                    print('余剰返還時')
-                    self.jct_portfolio[code]['num'] += (self.collateral_portfolio[code]['num'] - necessary_num)
-                    self.collateral_portfolio[code]['num'] = necessary_num
-                    self.logs['lender_additional_issue'].append(False)
-                    self.logs['borrower_additional_issue'].append(False)
-
-        self.logs['date'].append(date)
-        self.logs['st_total_value'].append(st_total_value)
-        self.logs['jct_total_value'].append(jct_total_value)
-        self.logs['jct_portfolio'].append(copy.deepcopy(self.jct_portfolio))
-        self.logs['necessary_collateral_value'].append(self.necessary_collateral_value)
-        self.logs['collateral_portfolio'].append(copy.deepcopy(self.collateral_portfolio))
-        self.logs['collateral_sum'].append(collateral_sum)
+            if self.rebalance_band is not None:
+                borrower_additional_issue = self.rebalance_within_band(necessary_collateral_value, necessary_each_collateral_value)
+            else:
+                borrower_additional_issue = self.rebalance_all(necessary_each_collateral_value)
+            self.logs['lender_additional_issue'].append(False)
+            self.logs['borrower_additional_issue'].append(borrower_additional_issue)
 
-        update_portfolio_price(self.initial_collateral_portfolio, date)
-        self.logs['initial_collateral_portfolio'].append(copy.deepcopy(self.initial_collateral_portfolio))
+        self.logs['transfer_count'].append(sum(1 for code, num in collateral_nums.items() if self.collateral_portfolio[code]['num'] != num))
+        self.append_step_logs(date, st_total_value, jct_total_value, collateral_sum)
 
         if self.print_log:
             pprint(self.collateral_portfolio)
@@ -1,16 +1,21 @@
 """
 シミュレーション結果を可視化するためのクラス
 """
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 import copy
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.ticker import ScalarFormatter
 import statistics
 
+from .lazy_module import LazyModule
+from .memory_probe import MemoryProbe
+
+# matplotlib の読み込みには時間がかかるため、初めて描画するときに import する
+plt = LazyModule('matplotlib.pyplot')
+mticker = LazyModule('matplotlib.ticker')
+
 
 class LogVisualizer(object):
-    def __init__(self, logs: List[dict], save_path: Optional[str] = None) -> None:
+    def __init__(self, logs: List[dict], save_path: Optional[str] = None, memory_probe: bool = False) -> None:
         # ex.)
         # logs = [{
         # 	date: [],
@@ -24,6 +29,10 @@ class LogVisualizer(object):
         #   lender_additional_issue: []
         #   has_done_margincall: []
         # }]
+        # memory_probe が True の場合は、record_memory() を呼ぶたびにメモリ使用量を記録する（tracemalloc は初期化時に開始する）
+        self.memory_probe = MemoryProbe() if memory_probe else None
+        if self.memory_probe is not None:
+            self.memory_probe.start()
         self.logs = logs
         self.date_list = logs['date']
         self.collateral_portfolio_list = logs['collateral_portfolio']
@@ -40,8 +49,28 @@ class LogVisualizer(object):
 
         if save_path:
             np.save(save_path, logs)
+        self.record_memory()
         print('Log Visualizer initialized.')
 
+    def memory_structures(self) -> Dict[str, Any]:
+        structures: Dict[str, Any] = {f'logs.{key}': values for key, values in self.logs.items()}
+        structures['collateral_sum_list'] = self.collateral_sum_list
+        structures['collateral_price_diff_list'] = self.collateral_price_diff_list
+        structures['initial_collateral_value_list'] = self.initial_collateral_value_list
+        return structures
+
+    def record_memory(self, stop: bool = False) -> Optional[dict]:
+        """
+        memory_probe を指定した場合、現在のメモリ使用量（ログ・集計用のリスト・開いている図）を記録し、それまでの記録の集計を返す
+        描画の前後で呼ぶと図によるメモリの増加がわかる。stop が True の場合は tracemalloc を停止する
+        """
+        if self.memory_probe is None:
+            return None
+        self.memory_probe.sample(len(self.memory_probe.samples), self.memory_structures(), force=True)
+        if stop:
+            self.memory_probe.stop()
+        return self.memory_probe.summary()
+
     @staticmethod
     def portfolio_sum(portfolio: dict) -> int:
         total_value = 0
@@ -109,7 +138,7 @@ class LogVisualizer(object):
 
         ax1.plot(self.date_list, self.initial_collateral_value_list, marker='o', markersize=5, color='red', label='初期差し入れ担保資産価値')
         ax1.set_ylabel('総価値（円）', fontsize=24, fontname="Hiragino Sans")
-        ax1.yaxis.set_major_formatter(ScalarFormatter(useMathText=True))
+        ax1.yaxis.set_major_formatter(mticker.ScalarFormatter(useMathText=True))
         ax1.plot(self.date_list, self.necessary_collateral_value_list, marker='o', markersize=5, color='blue', label='貸付資産価値')
 
         ax1.legend(loc=4, prop={"size": 24, "family": "Hiragino Sans"})
@@ -139,7 +168,7 @@ class LogVisualizer(object):
 
         ax1.legend(loc=4, prop={"size": 24, "family": "Hiragino Sans"})
         ax1.tick_params(labelsize=24)
-        ax1.yaxis.set_major_formatter(ScalarFormatter(useMathText=True))
+        ax1.yaxis.set_major_formatter(mticker.ScalarFormatter(useMathText=True))
         ax1.set_ylim(ymin=ymin)
         ax1.xaxis.offsetText.set_fontsize(24)
         ax1.yaxis.offsetText.set_fontsize(24)
@@ -151,7 +180,7 @@ class LogVisualizer(object):
         plt.plot(self.date_list, self.initial_collateral_value_list, marker='o', markersize=5, color='red')
         plt.xticks(fontsize=24)
         plt.yticks(fontsize=24)
-        ax.yaxis.set_major_formatter(ScalarFormatter(useMathText=True))
+        ax.yaxis.set_major_formatter(mticker.ScalarFormatter(useMathText=True))
         ax.yaxis.offsetText.set_fontsize(24)
         ax.xaxis.offsetText.set_fontsize(24)
 
@@ -163,10 +192,10 @@ class LogVisualizer(object):
         # plt.title('実際の差入担保と必要担保価値の差分推移', fontsize=30, pad=20, fontname="Hiragino Sans")
         ax1.plot(self.date_list, self.collateral_sum_list, marker='o', markersize=5, color='red', label='Actual Collateral Value')
         ax1.set_ylabel('Actual Collateral Value', fontsize=20, fontname="Hiragino Sans")
-        ax1.yaxis.set_major_formatter(ScalarFormatter(useMathText=True))
+        ax1.yaxis.set_major_formatter(mticker.ScalarFormatter(useMathText=True))
         ax1_2.plot(self.date_list, self.necessary_collateral_value_list, marker='o', markersize=5, color='blue', label='Necessary Collateral Value')
         ax1_2.set_ylabel('Necessary Collateral Value', fontsize=20, fontname="Hiragino Sans")
-        ax1_2.yaxis.set_major_formatter(ScalarFormatter(useMathText=True))
+        ax1_2.yaxis.set_major_formatter(mticker.ScalarFormatter(useMathText=True))
         ax1_2.set_ylim(ax1.get_ylim())
         handler1, label1 = ax1.get_legend_handles_labels()
         handler2, label2 = ax1_2.get_legend_handles_labels()
@@ -193,7 +222,7 @@ class LogVisualizer(object):
             plt.ylim(ymax=ymax)
         if not is_decimal:
             ax.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
-        # ax.yaxis.set_major_formatter(ScalarFormatter(useMathText=True))
+        # ax.yaxis.set_major_formatter(mticker.ScalarFormatter(useMathText=True))
         ax.yaxis.offsetText.set_fontsize(24)
         ax.xaxis.offsetText.set_fontsize(24)
 
@@ -253,7 +282,7 @@ class LogVisualizer(object):
 
         plt.xticks(fontsize=24)
         plt.yticks(fontsize=24)
-        ax.yaxis.set_major_formatter(ScalarFormatter(useMathText=True))
+        ax.yaxis.set_major_formatter(mticker.ScalarFormatter(useMathText=True))
         ax.yaxis.offsetText.set_fontsize(24)
         ax.xaxis.offsetText.set_fontsize(24)
         plt.ylabel('差入担保トークン数', fontsize=32, fontname='Hiragino Sans')
@@ -306,7 +335,7 @@ class LogVisualizer(object):
 
         plt.xticks(fontsize=24)
         plt.yticks(fontsize=24)
-        ax.yaxis.set_major_formatter(ScalarFormatter(useMathText=True))
+        ax.yaxis.set_major_formatter(mticker.ScalarFormatter(useMathText=True))
         ax.yaxis.offsetText.set_fontsize(24)
         ax.xaxis.offsetText.set_fontsize(24)
         plt.ylabel('差入担保トークン数（初期差入量に対する比率）', fontsize=40, fontname='Hiragino Sans')
@@ -357,7 +386,7 @@ class LogVisualizer(object):
 
         plt.xticks(fontsize=24)
         plt.yticks(fontsize=24)
-        ax.yaxis.set_major_formatter(ScalarFormatter(useMathText=True))
+        ax.yaxis.set_major_formatter(mticker.ScalarFormatter(useMathText=True))
         ax.yaxis.offsetText.set_fontsize(24)
         ax.xaxis.offsetText.set_fontsize(24)
         plt.ylabel('差入担保トークン数（初期差入量に対する比率）', fontsize=40, fontname='Hiragino Sans')
@@ -417,7 +446,7 @@ class LogVisualizer(object):
 
         plt.xticks(fontsize=24)
         plt.yticks(fontsize=24)
-        ax.yaxis.set_major_formatter(ScalarFormatter(useMathText=True))
+        ax.yaxis.set_major_formatter(mticker.ScalarFormatter(useMathText=True))
         ax.yaxis.offsetText.set_fontsize(24)
         ax.xaxis.offsetText.set_fontsize(24)
         plt.ylabel('差入担保トークン数', fontsize=40, fontname='Hiragino Sans')